@@ -1,72 +1,200 @@
-import json
+import hmac
 import logging
+import time
+from datetime import timedelta
+from functools import partial
 from http import HTTPStatus
+from typing import Awaitable, Callable, Optional
 from uuid import UUID
 
-from fastapi import Depends, FastAPI, HTTPException, Request, Response
-from slack_sdk import WebClient
-from slack_sdk.models.dialogs import DialogBuilder
-from slack_sdk.signature import SignatureVerifier
-from sqlalchemy.orm import Session
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.akashi import AkashiRequestClient, APIError, annotate_stamp_type
+from app.akashi import AkashiRequestClient, APIError, NewStampResponse, Stamp, UnavailableError, annotate_stamp_type
+from app.async_crud import fetch_credential, fetch_token_pairs, insert_stamps, update_or_create
 from app.buttons import AlreadyClockedOutException, get_buttons
-from app.crud import UserTokenDoesNotExtsts, fetch, update_or_create
-from app.db import SessionLocal
-from app.settings import settings
+from app.cache import create_backend
+from app.crud import UserTokenDoesNotExtsts
+from app.db import database_url, get_async_sessionmaker
+from app.deferred import DeferredRunner, Result
+from app.idempotency import Idempotency, Unconfirmed, interaction_key, settle
+from app.ingest import SlackIngestMiddleware
+from app.instrument import RouteTimingMiddleware
+from app.membership import ChannelMembership
+from app.metrics import DEFERRED_ACK_LATENCY, STAMPS, render
+from app.models import SOURCE_SLACK
+from app.notifier import Notifier
+from app.presence import PresenceBoard
+from app.profiler import SamplingProfiler
+from app.refresher import TokenRefresher
+from app.report import DayCache, build_report
+from app.scheduler import AdvisoryLockLeader, JustInTimeReissuer, LocalLeader, ReissueScheduler
+from app.settings import admin_settings, cache_settings, refresh_settings, settings
+from app.stamp_cache import StampCache
+from app.tenant import Tenant, create_registry
+from app.timing import ServerTimingMiddleware, budget
+from app.token_cache import TokenCacheListener
+from app.transport import LazyWebClient, close_client
+
+UNAVAILABLE = 'AKASHIが応答していません。時間をおいて再度お試しください'
+UNKNOWN_TEAM = 'このワークスペースでは利用できません'
 
 api = FastAPI(docs_url=None, redoc_url=None)
+request_profiler = SamplingProfiler(admin_settings.PROFILE_DIR, interval=admin_settings.PROFILE_INTERVAL)
+api.add_middleware(SlackIngestMiddleware, signing_secret=settings.SLACK_SIGNING_SECRET)
+api.add_middleware(ServerTimingMiddleware, header=admin_settings.SERVER_TIMING, profiler=request_profiler)
+api.add_middleware(RouteTimingMiddleware)
 logger = logging.getLogger(__name__)
-slack = WebClient(settings.SLACK_BOT_TOKEN)
+slack = LazyWebClient(settings.SLACK_BOT_TOKEN)
+stamp_cache = StampCache(
+    create_backend(cache_settings.CACHE_BACKEND, cache_settings.STAMP_CACHE_SIZE, cache_settings.REDIS_URL),
+    reconcile_ttl=cache_settings.STAMP_CACHE_RECONCILE_TTL,
+)
+report_cache = DayCache(
+    create_backend(cache_settings.CACHE_BACKEND, cache_settings.REPORT_CACHE_SIZE, cache_settings.REDIS_URL))
+idempotency = Idempotency(
+    create_backend(cache_settings.CACHE_BACKEND, cache_settings.IDEMPOTENCY_CACHE_SIZE, cache_settings.REDIS_URL),
+    ttl=cache_settings.IDEMPOTENCY_TTL,
+    lock_ttl=cache_settings.IDEMPOTENCY_LOCK_TTL,
+)
+deferred_runner = DeferredRunner(max_concurrency=settings.DEFERRED_MAX_CONCURRENCY, timeout=settings.DEFERRED_TIMEOUT)
+channel_membership = ChannelMembership(slack, ttl=settings.SLACK_MEMBERSHIP_TTL)
+channel_notifier = Notifier(
+    slack,
+    maxsize=settings.SLACK_NOTIFY_QUEUE_SIZE,
+    batch_size=settings.SLACK_NOTIFY_BATCH_SIZE,
+    membership=channel_membership,
+)
+presence_board = PresenceBoard(
+    concurrency=settings.PRESENCE_CONCURRENCY,
+    ttl=settings.PRESENCE_TTL,
+    progress_interval=settings.PRESENCE_PROGRESS_INTERVAL,
+)
+# 環境変数で設定したワークスペース以外はtenantsテーブルから読み込む
+default_tenant = Tenant.from_settings(
+    slack=slack,
+    membership=channel_membership,
+    notifier=channel_notifier,
+    presence=presence_board,
+)
+tenant_registry = create_registry(default_tenant)
+postgres_dsn = str(make_url(database_url).set(
+    drivername='postgresql')) if make_url(database_url).get_backend_name() == 'postgresql' else None
+# PostgresのNOTIFYを受け取れる場合のみ他のdynoからの無効化を購読する
+token_cache_listener = TokenCacheListener(postgres_dsn) if postgres_dsn else None
+
+
+def create_refresher() -> TokenRefresher:
+    return TokenRefresher(
+        get_async_sessionmaker(),
+        concurrency=refresh_settings.REFRESH_CONCURRENCY,
+        rate=refresh_settings.REFRESH_RATE_LIMIT,
+        max_retries=refresh_settings.REFRESH_MAX_RETRIES,
+        batch_size=refresh_settings.REFRESH_BATCH_SIZE,
+        tenants=tenant_registry,
+    )
+
+
+reissue_scheduler = ReissueScheduler(
+    lambda: get_async_sessionmaker()(),
+    create_refresher,
+    # 複数のdynoのうち1台だけが実行する
+    leader=AdvisoryLockLeader(postgres_dsn) if postgres_dsn else LocalLeader(),
+    interval=refresh_settings.REFRESH_INTERVAL,
+    lead_time=timedelta(seconds=refresh_settings.REFRESH_LEAD_TIME),
+    window=timedelta(seconds=refresh_settings.REFRESH_WINDOW),
+)
+just_in_time = JustInTimeReissuer(threshold=timedelta(seconds=refresh_settings.REFRESH_JIT_THRESHOLD),
+                                  tenants=tenant_registry)
+
+
+@api.on_event('startup')
+async def startup():
+    channel_notifier.start()
+    if token_cache_listener:
+        token_cache_listener.start()
+    if refresh_settings.REFRESH_SCHEDULER:
+        reissue_scheduler.start()
+    if settings.SLACK_CHANNEL_ID:
+        channel_membership.schedule_refresh(settings.SLACK_CHANNEL_ID)
+
+
+@api.on_event('shutdown')
+async def shutdown():
+    await channel_notifier.stop()
+    if token_cache_listener:
+        await token_cache_listener.stop()
+    await reissue_scheduler.stop()
+    await tenant_registry.close()
+    await close_client()
 
 
 async def get_db():
-    try:
-        db = SessionLocal()
+    async with get_async_sessionmaker()() as db:
         yield db
-    finally:
-        db.close()
 
 
 async def verify_signature(request: Request) -> bool:
-    if not settings.SLACK_SIGNING_SECRET:
-        raise HTTPException(HTTPStatus.FORBIDDEN)
-    verifier = SignatureVerifier(settings.SLACK_SIGNING_SECRET)
-    if verifier.is_valid_request(await request.body(), dict(request.headers)):
+    # 検証はSlackIngestMiddlewareで済ませている
+    if getattr(request.state, 'verified', False):
         return True
     raise HTTPException(HTTPStatus.FORBIDDEN)
 
 
-def joined() -> bool:
-    channel = settings.SLACK_CHANNEL_ID
-    if channel:
-        try:
-            slack.conversations_join(channel=channel)
-            return True
-        except Exception as e:
-            logger.error(e, exc_info=True)
-            return False
-    return True
+async def get_tenant(request: Request) -> Optional[Tenant]:
+    # slash commandはform、interactionとeventはpayloadにワークスペースのIDが入っている
+    form = getattr(request.state, 'form', None) or {}
+    payload = getattr(request.state, 'payload', None) or {}
+    team_id = form.get('team_id') or payload.get('team_id') or (payload.get('team') or {}).get('id')
+    return await tenant_registry.get(team_id)
 
 
-@api.post('/slash', status_code=HTTPStatus.OK, dependencies=[Depends(verify_signature)])
-async def slash(request: Request, db: Session = Depends(get_db)):
-    if not joined():
-        message = ':warning:エラーが発生しました\n'\
-            f'- 環境変数の`SLACK_CHANNEL_ID`を確認してください（現在の値：{settings.SLACK_CHANNEL_ID}）\n'\
-            '- private-channelには通知できません\n'\
-            '- 打刻の通知が不要な場合は環境変数の`SLACK_CHANNEL_ID`を削除してください\n'\
-            '- SlackAppのOAuth scopeに`channels:join`が追加されていることを確認してください'
-        return Response(message)
-    form = await request.form()
-    user_id = form['user_id']
-    trigger_id = form['trigger_id']
+def joined(tenant: Tenant) -> bool:
+    return tenant.joined()
+
+
+def to_response(result: Result):
+    if isinstance(result, dict):
+        return result
+    return Response(result or '')
+
+
+async def run_within_budget(request: Request, job: Callable[[], Awaitable[Result]]):
+    # Slackの応答期限までの残り時間をAKASHIへのリクエストの期限にする
+    with budget(settings.SLACK_RESPONSE_BUDGET, getattr(request.state, 'received_at', None)):
+        return to_response(await job())
+
+
+def defer(request: Request,
+          background_tasks: BackgroundTasks,
+          response_url: str,
+          job: Callable[[], Awaitable[Result]],
+          ack: Optional[str] = None,
+          replace_original: bool = False) -> Response:
+    received_at = getattr(request.state, 'received_at', time.perf_counter())
+    background_tasks.add_task(deferred_runner.run, response_url, job, received_at, replace_original)
+    DEFERRED_ACK_LATENCY.observe(time.perf_counter() - received_at)
+    return Response(ack or '')
+
+
+async def fetch_token(db: AsyncSession, tenant: Tenant, user_id: str) -> Optional[str]:
+    credential = await fetch_credential(db, user_id, tenant.team_id)
+    if credential is None:
+        return None
+    # スケジューラーの再発行が間に合わなかった場合はその場で再発行する
+    if just_in_time.needs_reissue(credential.expires_at):
+        return await just_in_time.reissue(db, user_id, credential.token, tenant.team_id)
+    return credential.token
+
+
+async def build_stamp_menu(db: AsyncSession, tenant: Tenant, user_id: str, trigger_id: str) -> Result:
     try:
-        user_token = fetch(db, user_id=user_id)
-        if not user_token:
+        token = await fetch_token(db, tenant, user_id)
+        if not token:
             raise UserTokenDoesNotExtsts()
-        akashi = AkashiRequestClient(user_token.token)
-        last_stamp = akashi.fetch_last_stamp()
+        last_stamp = await stamp_cache.fetch_last_stamp(tenant.scope(user_id), tenant.akashi(token))
         return {
             'attachments': [{
                 'attachment_type': 'stamp',
@@ -76,59 +204,218 @@ async def slash(request: Request, db: Session = Depends(get_db)):
             }]
         }
     except AlreadyClockedOutException:
-        return Response('すでに勤務を終了しています。')
+        return 'すでに勤務を終了しています。'
+    except UnavailableError as e:
+        logger.error(e)
+        return UNAVAILABLE
     except Exception as e:
         logger.error(e, exc_info=True)
+        from slack_sdk.models.dialogs import DialogBuilder
         dialog = DialogBuilder()
         dialog.callback_id('api_token').title('APIトークンを登録する').submit_label('Submit').state('Limo').text_area(
             name='api_token', label='APIトークンを入力してください', hint='https://atnd.ak4.jp/mypage/tokens から発行できます')
-        slack.dialog_open(
+        await tenant.slack.dialog_open(
             dialog=dialog.to_dict(),
             trigger_id=trigger_id,
         )
-        return Response()
+        return None
+
+
+async def send_report(db: AsyncSession, tenant: Tenant, user_id: str, text: str) -> Result:
+    token = await fetch_token(db, tenant, user_id)
+    if not token:
+        return 'APIトークンが登録されていません。`/akashi`から登録してください'
+    try:
+        return await build_report(report_cache, tenant.scope(user_id), tenant.akashi(token), text)
+    except APIError as e:
+        logger.error(e, exc_info=True)
+        return 'APIトークンを確認してください'
+    except UnavailableError as e:
+        logger.error(e)
+        return UNAVAILABLE
+    except Exception as e:
+        logger.error(e, exc_info=True)
+        return 'エラーが発生しました'
+
+
+async def fetch_last_stamp(tenant: Tenant, user_id: str, token: str) -> Optional[Stamp]:
+    return await stamp_cache.fetch_last_stamp(tenant.scope(user_id), tenant.akashi(token))
+
+
+async def show_presence(db: AsyncSession, tenant: Tenant, background_tasks: BackgroundTasks,
+                        response_url: str) -> Response:
+    board = tenant.presence
+    snapshot = board.fresh()
+    if snapshot:
+        return to_response(snapshot.render())
+    # 人数が多いと3秒に間に合わないので、途中経過をresponse_urlに送る
+    snapshot = await board.collect(partial(fetch_token_pairs, db, tenant.team_id), partial(fetch_last_stamp, tenant))
+    background_tasks.add_task(board.stream, snapshot,
+                              partial(deferred_runner.respond, response_url, replace_original=True))
+    return Response('集計中…')
+
+
+async def register_token(db: AsyncSession, tenant: Tenant, user_id: str, payload: dict) -> Result:
+    try:
+        api_token = payload['submission']['api_token'].strip()
+        UUID(api_token)
+        await update_or_create(db=db, user_id=user_id, token=api_token, team_id=tenant.team_id)
+        await tenant.slack.chat_postMessage(channel=user_id, text='APIトークンを登録しました')
+    except ValueError:
+        # APIトークンがUUID形式でなかった場合
+        await tenant.slack.chat_postMessage(channel=user_id, text='APIトークンが（おそらく）正しくありません')
+    except Exception as e:
+        logger.error(e, exc_info=True)
+    return None
+
+
+async def save_stamp(db: AsyncSession, tenant: Tenant, user_id: str, stamp: NewStampResponse):
+    # 履歴の保存に失敗しても打刻は完了しているので、エラーは同期に任せる
+    try:
+        await insert_stamps(db, [{
+            'team_id': tenant.team_id,
+            'user_id': user_id,
+            'stamped_at': stamp.stamped_at,
+            'type': stamp.type,
+            'source': SOURCE_SLACK
+        }])
+    except Exception as e:
+        logger.error(e, exc_info=True)
+
+
+async def record_stamp(db: AsyncSession, tenant: Tenant, user_id: str, payload: dict) -> Result:
+    token = await fetch_token(db, tenant, user_id)
+    if not token:
+        raise UserTokenDoesNotExtsts()
+    akashi = tenant.akashi(token)
+    try:
+        stamp = await akashi.stamp(payload['actions'][0]['value'])
+    # 打刻できたか確認できない結果は保存しないので、同じボタンをもう一度押すと再実行する
+    except APIError as e:
+        logger.error(e, exc_info=True)
+        raise Unconfirmed('APIトークンを確認してください')
+    except UnavailableError as e:
+        logger.error(e)
+        raise Unconfirmed(UNAVAILABLE)
+    except Exception as e:
+        logger.error(e, exc_info=True)
+        raise Unconfirmed('エラーが発生しました')
+    STAMPS.labels(str(stamp.type)).inc()
+    try:
+        await stamp_cache.set(tenant.scope(user_id), Stamp(stamped_at=stamp.stamped_at, type=stamp.type))
+        await save_stamp(db, tenant, user_id, stamp)
+        tenant.notify(f'<@{user_id}>さんが{annotate_stamp_type(stamp.type)}しました')
+    except Exception as e:
+        # AKASHIには打刻できているので、再実行させずに結果を返す
+        logger.error(e, exc_info=True)
+    return f'{annotate_stamp_type(stamp.type)}しました（時刻：{stamp.stamped_at}）'
+
+
+@api.post('/slash', status_code=HTTPStatus.OK, dependencies=[Depends(verify_signature)])
+async def slash(request: Request,
+                background_tasks: BackgroundTasks,
+                db: AsyncSession = Depends(get_db),
+                tenant: Optional[Tenant] = Depends(get_tenant)):
+    if tenant is None:
+        return Response(UNKNOWN_TEAM)
+    if not joined(tenant):
+        message = ':warning:エラーが発生しました\n'\
+            f'- 環境変数の`SLACK_CHANNEL_ID`を確認してください（現在の値：{tenant.channel_id}）\n'\
+            '- private-channelには通知できません\n'\
+            '- 打刻の通知が不要な場合は環境変数の`SLACK_CHANNEL_ID`を削除してください\n'\
+            '- SlackAppのOAuth scopeに`channels:join`が追加されていることを確認してください'
+        return Response(message)
+    form = request.state.form
+    user_id = form['user_id']
+    trigger_id = form['trigger_id']
+    command = form.get('text', '').split(maxsplit=1)
+    if command and command[0] == 'who':
+        return await show_presence(db, tenant, background_tasks, form.get('response_url'))
+    if AkashiRequestClient.breaker.is_open:
+        return Response(UNAVAILABLE)
+    if command and command[0] == 'report':
+        job = partial(send_report, db, tenant, user_id, command[1] if len(command) > 1 else '')
+    else:
+        job = partial(build_stamp_menu, db, tenant, user_id, trigger_id)
+    if settings.SLACK_DEFERRED_RESPONSE:
+        return defer(request, background_tasks, form.get('response_url'), job)
+    return await run_within_budget(request, job)
 
 
 @api.post('/actions', status_code=HTTPStatus.OK, dependencies=[Depends(verify_signature)])
-async def actions(request: Request, db: Session = Depends(get_db)):
-    form = await request.form()
-    payload = json.loads(form['payload'])
+async def actions(request: Request,
+                  background_tasks: BackgroundTasks,
+                  db: AsyncSession = Depends(get_db),
+                  tenant: Optional[Tenant] = Depends(get_tenant)):
+    if tenant is None:
+        return Response(UNKNOWN_TEAM)
+    payload = request.state.payload
     callback_id = payload['callback_id']
     user_id = payload['user']['id']
 
     if callback_id == 'api_token':
-        try:
-            api_token = payload['submission']['api_token'].strip()
-            UUID(api_token)
-            update_or_create(db=db, user_id=user_id, token=api_token)
-            slack.chat_postMessage(channel=user_id, text='APIトークンを登録しました')
-        except ValueError:
-            # APIトークンがUUID形式でなかった場合
-            slack.chat_postMessage(channel=user_id, text='APIトークンが（おそらく）正しくありません')
-            return Response()
-        except Exception as e:
-            logger.error(e, exc_info=True)
-        return Response()
+        job = partial(register_token, db, tenant, user_id, payload)
+        ack = None
     elif callback_id == 'stamp':
-        user_token = fetch(db, user_id=user_id)
-        if not user_token:
-            raise UserTokenDoesNotExtsts()
-        akashi = AkashiRequestClient(user_token=user_token.token)
-        try:
-            stamp = akashi.stamp(payload['actions'][0]['value'])
-            if settings.SLACK_CHANNEL_ID:
-                slack.chat_postMessage(
-                    channel=settings.SLACK_CHANNEL_ID,
-                    text=f'<@{user_id}>さんが{annotate_stamp_type(stamp.type)}しました',
-                )
-        except APIError as e:
-            logger.error(e, exc_info=True)
-            return Response('APIトークンを確認してください')
-        except Exception as e:
-            logger.error(e, exc_info=True)
-            return Response('エラーが発生しました')
-        else:
-            return Response(f'{annotate_stamp_type(stamp.type)}しました（時刻：{stamp.stamped_at}）')
+        if AkashiRequestClient.breaker.is_open:
+            return Response(UNAVAILABLE)
+        job = partial(record_stamp, db, tenant, user_id, payload)
+        # Slackの再送やダブルクリックで二重に打刻しない
+        if key := interaction_key(payload):
+            job = partial(idempotency.run, key, job)
+        job = partial(settle, job)
+        ack = '処理中…'
+    else:
+        return None
+    if settings.SLACK_DEFERRED_RESPONSE:
+        return defer(request, background_tasks, payload.get('response_url'), job, ack=ack, replace_original=True)
+    return await run_within_budget(request, job)
+
+
+@api.post('/events', status_code=HTTPStatus.OK, dependencies=[Depends(verify_signature)])
+async def events(request: Request):
+    body = request.state.payload
+    if body.get('type') == 'url_verification':
+        return {'challenge': body['challenge']}
+    event = body.get('event', {})
+    if event.get('type') in ('channel_left', 'member_left_channel') and event.get('channel'):
+        tenant = await tenant_registry.get(body.get('team_id'))
+        if tenant:
+            tenant.membership.invalidate(event['channel'])
+    return Response()
+
+
+async def verify_admin(request: Request) -> bool:
+    expected = f'Bearer {admin_settings.ADMIN_TOKEN}'
+    if admin_settings.ADMIN_TOKEN and hmac.compare_digest(request.headers.get('authorization', ''), expected):
+        return True
+    raise HTTPException(HTTPStatus.FORBIDDEN)
+
+
+@api.post('/admin/profile', status_code=HTTPStatus.ACCEPTED, dependencies=[Depends(verify_admin)])
+async def start_profile(requests: int = 10):
+    """
+    次のrequests件の/slashと/actionsの処理をプロファイルする
+    """
+    if not 1 <= requests <= 1000:
+        raise HTTPException(HTTPStatus.BAD_REQUEST)
+    request_profiler.arm(requests)
+    return {'requests': requests}
+
+
+@api.get('/admin/profile', status_code=HTTPStatus.OK, dependencies=[Depends(verify_admin)])
+async def download_profile():
+    # flamegraph.pl や speedscope でそのまま読める
+    if not request_profiler.last_path:
+        raise HTTPException(HTTPStatus.NOT_FOUND)
+    with open(request_profiler.last_path) as f:
+        return PlainTextResponse(f.read())
+
+
+@api.get('/metrics', status_code=HTTPStatus.OK)
+async def metrics():
+    content, media_type = render()
+    return Response(content, media_type=media_type)
 
 
 @api.get('/', status_code=HTTPStatus.OK)
@@ -1,12 +1,19 @@
+import asyncio
 import logging
+import time
 from datetime import date, datetime
-from typing import Optional
+from functools import wraps
+from typing import Callable, Optional
 
+import orjson
 from dateutil.parser import parse
-from pydantic import BaseModel, Field, validator
-from requests import Response, Session
+from httpx import AsyncClient, Response, TimeoutException
 
-from .settings import settings
+from .breaker import CircuitBreaker
+from .metrics import AKASHI_REQUEST_LATENCY
+from .settings import breaker_settings, settings
+from .timing import record, remaining
+from .transport import get_client
 
 logger = logging.getLogger(__name__)
 
@@ -38,46 +45,99 @@ class StampTypeAnnotator:
 annotate_stamp_type = StampTypeAnnotator()
 
 
-class AkashiAPIResponse(BaseModel):
-    success: bool
-    response: Optional[dict]
-    code: Optional[str]
-    message: Optional[str]
+def parse_datetime(value) -> datetime:
+    """
+    AKASHIの日時は`YYYY/MM/DD HH:MM:SS`形式なので、まずは位置で切り出してパースする
+    形式が異なる場合のみdateutilで解釈する
+    """
+    if isinstance(value, datetime):
+        return value
+    if len(value) == 19 and value[4] == value[7] == '/' and value[10] == ' ' and value[13] == value[16] == ':':
+        try:
+            return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]), int(value[11:13]),
+                            int(value[14:16]), int(value[17:19]))
+        except ValueError:
+            pass
+    return parse(value)
 
 
-class Stamp(BaseModel):
-    stamped_at: datetime
-    type: int
+class Record:
+    """
+    APIのレスポンスを格納するだけの軽量なクラス
+    """
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, i) == getattr(other, i) for i in self.__slots__)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(f'{i}={getattr(self, i)!r}' for i in self.__slots__))
+
+
+class AkashiAPIResponse(Record):
+    __slots__ = ('success', 'response', 'code', 'message')
+
+    def __init__(self,
+                 success: bool,
+                 response: Optional[dict] = None,
+                 code: Optional[str] = None,
+                 message: Optional[str] = None):
+        self.success = success
+        self.response = response
+        self.code = code
+        self.message = message
+
+    @classmethod
+    def decode(cls, data: dict) -> 'AkashiAPIResponse':
+        return cls(data.get('success', False), data.get('response'), data.get('code'), data.get('message'))
+
+
+class Stamp(Record):
+    __slots__ = ('stamped_at', 'type')
+
+    def __init__(self, stamped_at, type: int):
+        self.stamped_at: datetime = parse_datetime(stamped_at)
+        self.type = int(type)
 
-    @validator('stamped_at', pre=True)
     @classmethod
-    def parse_stamped_at(cls, value):
-        return parse(value)
+    def decode(cls, data: dict) -> 'Stamp':
+        return cls(data['stamped_at'], data['type'])
+
 
+class NewStampResponse(Record):
+    __slots__ = ('stamped_at', 'type')
 
-class NewStampResponse(BaseModel):
-    stamped_at: datetime = Field(alias='stampedAt')
-    type: int
+    def __init__(self, stamped_at, type: int):
+        self.stamped_at: datetime = parse_datetime(stamped_at)
+        self.type = int(type)
 
-    @validator('stamped_at', pre=True)
     @classmethod
-    def parse_stamped_at(cls, value):
-        return parse(value)
+    def decode(cls, data: dict) -> 'NewStampResponse':
+        return cls(data['stampedAt'], data['type'])
+
+
+class FetchedStampResponse(Record):
+    __slots__ = ('count', 'stamps')
+
+    def __init__(self, count: int, stamps: list[Stamp]):
+        self.count = count
+        self.stamps = stamps
 
+    @classmethod
+    def decode(cls, data: dict) -> 'FetchedStampResponse':
+        return cls(data['count'], [Stamp(i['stamped_at'], i['type']) for i in data['stamps']])
 
-class FetchedStampResponse(BaseModel):
-    count: int
-    stamps: list[Stamp]
 
+class ReissuedTokenResponse(Record):
+    __slots__ = ('token', 'expired_at')
 
-class ReissuedTokenResponse(BaseModel):
-    token: str
-    expired_at: datetime
+    def __init__(self, token: str, expired_at):
+        self.token = token
+        self.expired_at: datetime = parse_datetime(expired_at)
 
-    @validator('expired_at', pre=True)
     @classmethod
-    def parse_expired_at(cls, value):
-        return parse(value)
+    def decode(cls, data: dict) -> 'ReissuedTokenResponse':
+        return cls(data['token'], data['expired_at'])
 
 
 class APIError(Exception):
@@ -100,56 +160,170 @@ class RequestFailedError(Exception):
         return f'{super().__repr__()} code:{self.status_code}, url:{self.url}]'
 
 
+class UnavailableError(Exception):
+    """
+    AKASHIへのリクエストを遮断しているか、応答の期限までに応答がなかった
+    """
+    pass
+
+
+def akashi_method(name: str) -> Callable:
+    """
+    AKASHIのAPIの呼び出しにかかった時間を結果ごとに記録する
+    """
+    children = {
+        i: AKASHI_REQUEST_LATENCY.labels(name, i)
+        for i in ('ok', 'api_error', 'request_failed', 'unavailable', 'error')
+    }
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = await func(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            except APIError:
+                outcome = 'api_error'
+                raise
+            except RequestFailedError:
+                outcome = 'request_failed'
+                raise
+            except UnavailableError:
+                outcome = 'unavailable'
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                children[outcome].observe(elapsed)
+                record('akashi', elapsed)
+
+        return wrapper
+
+    return decorator
+
+
 class AkashiRequestClient:
-    base_url = 'https://atnd.ak4.jp/api/cooperation'
+    base_url = settings.AKASHI_BASE_URL
     company_id = settings.AKASHI_COMPANY_ID
-
-    def __init__(self, user_token: str):
-        self.session = Session()
+    breaker = CircuitBreaker(
+        'akashi',
+        failure_rate=breaker_settings.BREAKER_FAILURE_RATE,
+        window=breaker_settings.BREAKER_WINDOW,
+        min_calls=breaker_settings.BREAKER_MIN_CALLS,
+        slow_call=breaker_settings.BREAKER_SLOW_CALL,
+        open_seconds=breaker_settings.BREAKER_OPEN_SECONDS,
+    )
+
+    def __init__(self,
+                 user_token: str,
+                 client: Optional[AsyncClient] = None,
+                 company_id: Optional[str] = None,
+                 bucket=None):
+        self.client = client or get_client()
         self.__token = user_token
+        # ワークスペースごとの企業IDとリクエスト数の上限（tenant.Tenant.akashiから渡される）
+        self.company_id = company_id or type(self).company_id
+        self.bucket = bucket
 
     def build_url(self, endpoint: str) -> str:
         return f'{self.base_url}{endpoint}'
 
-    def stamp(self, type_: int) -> NewStampResponse:
+    @akashi_method('stamp')
+    async def stamp(self, type_: int) -> NewStampResponse:
         endpoint = f'/{self.company_id}/stamps'
-        return NewStampResponse(**self.post(endpoint, type=type_))
+        return NewStampResponse.decode(await self.post(endpoint, type=type_))
 
-    def fetch_last_stamp(self) -> Optional[Stamp]:
+    async def fetch_last_stamp(self) -> Optional[Stamp]:
         current_date = date.today()
-        res = self.fetch_stamps(current_date)
+        res = await self.fetch_stamps(current_date)
         if res.count == 0:
             return None
         return res.stamps[-1]
 
-    def fetch_stamps(self, date_from: date, date_to: date = date.today()) -> FetchedStampResponse:
+    @akashi_method('fetch_stamps')
+    async def fetch_stamps(self, date_from: date, date_to: Optional[date] = None) -> FetchedStampResponse:
+        # デフォルト引数だと読み込んだ日に固定されてしまう
+        date_to = date_to or date.today()
         endpoint = f'/{self.company_id}/stamps'
         start_date = date_from.strftime('%Y%m%d000000')
         end_date = date_to.strftime('%Y%m%d235959')
-        return FetchedStampResponse(**self.get(endpoint=endpoint, start_date=start_date, end_date=end_date))
+        return FetchedStampResponse.decode(await self.get(endpoint=endpoint, start_date=start_date, end_date=end_date))
 
-    def reissue_token(self) -> ReissuedTokenResponse:
+    @akashi_method('reissue_token')
+    async def reissue_token(self) -> ReissuedTokenResponse:
         endpoint = f'/token/reissue/{self.company_id}'
-        return ReissuedTokenResponse(**self.post(endpoint))
+        return ReissuedTokenResponse.decode(await self.post(endpoint))
 
-    def get(self, endpoint, **params) -> dict:
+    async def get(self, endpoint, **params) -> dict:
         url = self.build_url(endpoint=endpoint)
         params.update(token=self.__token)
-        return self.request('get', url, params=params)
+        return await self.request('get', url, params=params)
 
-    def post(self, endpoint, **data) -> dict:
+    async def post(self, endpoint, **data) -> dict:
         url = self.build_url(endpoint=endpoint)
         data.update(token=self.__token)
-        return self.request('post', url, data=data)
+        return await self.request('post', url, data=data)
 
-    def request(self, method: str, url: str, params: Optional[dict] = None, data: Optional[dict] = None) -> dict:
-        res = self.request_(method=method, url=url, params=params, data=data)
-        if not res.ok:
+    async def request(self, method: str, url: str, params: Optional[dict] = None, data: Optional[dict] = None) -> dict:
+        res = await self.guarded_request(method=method, url=url, params=params, data=data)
+        if not res.is_success:
             raise RequestFailedError(status_code=res.status_code, url=url)
-        api_response = AkashiAPIResponse(**res.json())
+        api_response = AkashiAPIResponse.decode(orjson.loads(res.content))
         if api_response.response:
             return api_response.response
         raise APIError(api_response, self.__token)
 
-    def request_(self, method: str, url: str, params: Optional[dict] = None, data: Optional[dict] = None) -> Response:
-        return self.session.request(method=method, url=url, params=params, data=data)
+    async def guarded_request(self, method: str, url: str, params: Optional[dict], data: Optional[dict]) -> Response:
+        """
+        遮断中は送信せずに失敗させ、期限（timing.budget）が設定されている場合は残り時間で打ち切る
+        httpxのタイムアウトは接続や読み込みなどの段階ごとにかかるので、全体の期限にはasyncio.wait_forを使う
+        """
+        left = remaining()
+        if left is not None and left <= 0:
+            raise UnavailableError('deadline exceeded')
+        if self.bucket is not None:
+            try:
+                await asyncio.wait_for(self.bucket.acquire(), left)
+            except asyncio.TimeoutError:
+                raise UnavailableError('rate limited') from None
+            left = remaining()
+        if not self.breaker.allow():
+            raise UnavailableError('circuit open')
+        return await self.send(method, url, params, data, left)
+
+    async def send(self,
+                   method: str,
+                   url: str,
+                   params: Optional[dict],
+                   data: Optional[dict],
+                   left: Optional[float] = None) -> Response:
+        # 結果を遮断の判定に記録する
+        started = time.perf_counter()
+        try:
+            request = self.request_(method=method, url=url, params=params, data=data)
+            res = await (request if left is None else asyncio.wait_for(request, left))
+        except asyncio.TimeoutError:
+            # 期限による打ち切りはこちらの都合なので、AKASHIの失敗として数えない
+            self.breaker.release()
+            raise UnavailableError('deadline exceeded') from None
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except TimeoutException as e:
+            self.breaker.record(False, time.perf_counter() - started)
+            raise UnavailableError('timed out') from e
+        except Exception:
+            self.breaker.record(False, time.perf_counter() - started)
+            raise
+        self.breaker.record(res.status_code < 500, time.perf_counter() - started)
+        return res
+
+    async def request_(self,
+                       method: str,
+                       url: str,
+                       params: Optional[dict] = None,
+                       data: Optional[dict] = None,
+                       **options) -> Response:
+        return await self.client.request(method=method, url=url, params=params, data=data, **options)
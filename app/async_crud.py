@@ -0,0 +1,218 @@
+from datetime import datetime
+from typing import Iterable, Optional, Union
+
+from sqlalchemy import delete as delete_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .crud import chunked, insert_stamps_statement, upsert_statement
+from .instrument import query
+from .models import DEFAULT_TEAM, TenantConfig, UserStamp, UserToken, scoped
+from .token_cache import Credential, notify_statements, token_cache
+
+
+@query
+async def fetch(db: AsyncSession, user_id: str, team_id: str = DEFAULT_TEAM) -> Union[UserToken, None]:
+    result = await db.execute(select(UserToken).filter(UserToken.team_id == team_id, UserToken.user_id == user_id))
+    return result.scalars().one_or_none()
+
+
+async def fetch_credential(db: AsyncSession, user_id: str, team_id: str = DEFAULT_TEAM) -> Optional[Credential]:
+    # キャッシュにあればDBに問い合わせない（DBの実行時間に含めないように、問い合わせだけを計測する）
+    key = scoped(team_id, user_id)
+    credential = token_cache.get_credential(key)
+    if credential is None:
+        credential = await select_credential(db, user_id, team_id)
+        if credential is not None:
+            token_cache.set(key, *credential)
+    return credential
+
+
+@query
+async def select_credential(db: AsyncSession, user_id: str, team_id: str = DEFAULT_TEAM) -> Optional[Credential]:
+    result = await db.execute(
+        select(UserToken.token, UserToken.expires_at).filter(UserToken.team_id == team_id,
+                                                             UserToken.user_id == user_id))
+    row = result.one_or_none()
+    return Credential(*row) if row is not None else None
+
+
+@query
+async def fetch_all(db: AsyncSession) -> list[UserToken]:
+    result = await db.execute(select(UserToken))
+    return result.scalars().all()
+
+
+@query
+async def fetch_token_pairs(db: AsyncSession, team_id: str = DEFAULT_TEAM) -> list[tuple[str, str]]:
+    # 全件のモデルを作らずに必要な列だけを読む
+    result = await db.execute(select(UserToken.user_id, UserToken.token).filter(UserToken.team_id == team_id))
+    return [(user_id, token) for user_id, token in result]
+
+
+@query
+async def fetch_token_page(db: AsyncSession, after_id: int, limit: int) -> list[tuple]:
+    """
+    idがafter_idより大きい(id, team_id, user_id, token)をid順にlimit件返す
+    OFFSETを使わないので、後ろのページでも読み飛ばす行をスキャンしない
+    """
+    result = await db.execute(
+        select(UserToken.id, UserToken.team_id, UserToken.user_id,
+               UserToken.token).filter(UserToken.id > after_id).order_by(UserToken.id).limit(limit))
+    return result.all()
+
+
+@query
+async def fetch_by_expires_at(db: AsyncSession, expires_at_lt: datetime) -> list[UserToken]:
+    result = await db.execute(
+        select(UserToken).filter(or_(UserToken.expires_at == None, UserToken.expires_at < expires_at_lt)))
+    return result.scalars().all()
+
+
+def due_tokens_statement(expires_at_lt: datetime, limit: int):
+    # PostgresはNULLを最後に並べるので、期限が近いトークンが多いと期限のわからないトークンが選ばれなくなる
+    return select(UserToken.id, UserToken.team_id, UserToken.user_id, UserToken.token, UserToken.expires_at).filter(
+        or_(UserToken.expires_at == None,
+            UserToken.expires_at < expires_at_lt)).order_by(UserToken.expires_at.asc().nullsfirst()).limit(limit)
+
+
+@query
+async def fetch_due_tokens(db: AsyncSession, expires_at_lt: datetime, limit: int) -> list[tuple]:
+    """
+    期限のわからない（登録したばかりの）トークンを先に、期限が近い順に(id, team_id, user_id, token, expires_at)を返す
+    """
+    result = await db.execute(due_tokens_statement(expires_at_lt, limit))
+    return result.all()
+
+
+@query
+async def create(db: AsyncSession,
+                 user_id: str,
+                 token: str,
+                 expires_at: Optional[datetime] = None,
+                 team_id: str = DEFAULT_TEAM) -> UserToken:
+    instance = UserToken(user_id=user_id, token=token, expires_at=expires_at, team_id=team_id)
+    db.add(instance)
+    await db.commit()
+    await db.refresh(instance)
+    return instance
+
+
+@query
+async def update(
+    db: AsyncSession,
+    instance: UserToken,
+    token: Optional[str] = None,
+    expires_at: Optional[datetime] = None,
+) -> UserToken:
+    instance.token = token or instance.token
+    instance.expires_at = expires_at or instance.expires_at
+    keys = [scoped(instance.team_id, instance.user_id)]
+    await notify_token_changed(db, keys)
+    await db.commit()
+    token_cache.invalidate(keys)
+    return instance
+
+
+@query
+async def update_or_create(db: AsyncSession,
+                           user_id: str,
+                           token: Optional[str] = None,
+                           expires_at: Optional[datetime] = None,
+                           team_id: str = DEFAULT_TEAM) -> UserToken:
+    if not token:
+        instance = await fetch(db, user_id, team_id)
+        if not instance:
+            raise Exception
+        return await update(db, instance, token, expires_at)
+    await db.execute(
+        upsert_statement(db.bind.dialect.name, [{
+            'team_id': team_id,
+            'user_id': user_id,
+            'token': token,
+            'expires_at': expires_at
+        }]))
+    keys = [scoped(team_id, user_id)]
+    await notify_token_changed(db, keys)
+    await db.commit()
+    token_cache.invalidate(keys)
+    result = await db.execute(
+        select(UserToken).filter(UserToken.team_id == team_id,
+                                 UserToken.user_id == user_id).execution_options(populate_existing=True))
+    return result.scalars().one()
+
+
+@query
+async def delete(db: AsyncSession, instance: UserToken):
+    keys = [scoped(instance.team_id, instance.user_id)]
+    await db.delete(instance)
+    await notify_token_changed(db, keys)
+    await db.commit()
+    token_cache.invalidate(keys)
+
+
+async def notify_token_changed(db: AsyncSession, keys: list[str]):
+    if keys and db.bind.dialect.name == 'postgresql':
+        for statement in notify_statements(keys):
+            await db.execute(statement)
+
+
+@query
+async def bulk_upsert_tokens(db: AsyncSession, rows: Iterable[dict], chunk_size: int = 200) -> int:
+    keys = []
+    for chunk in chunked(rows, chunk_size):
+        await db.execute(upsert_statement(db.bind.dialect.name, chunk))
+        await notify_token_changed(db, [scoped(row.get('team_id', DEFAULT_TEAM), row['user_id']) for row in chunk])
+        keys += [scoped(row.get('team_id', DEFAULT_TEAM), row['user_id']) for row in chunk]
+    await db.commit()
+    token_cache.invalidate(keys)
+    return len(keys)
+
+
+@query
+async def bulk_delete_by_user_ids(db: AsyncSession,
+                                  user_ids: Iterable[str],
+                                  chunk_size: int = 500,
+                                  team_id: str = DEFAULT_TEAM) -> int:
+    count = 0
+    deleted = []
+    for chunk in chunked(user_ids, chunk_size):
+        result = await db.execute(
+            delete_(UserToken).where(UserToken.team_id == team_id,
+                                     UserToken.user_id.in_(chunk)).execution_options(synchronize_session=False))
+        keys = [scoped(team_id, user_id) for user_id in chunk]
+        await notify_token_changed(db, keys)
+        count += result.rowcount
+        deleted += keys
+    await db.commit()
+    token_cache.invalidate(deleted)
+    return count
+
+
+@query
+async def fetch_tenant(db: AsyncSession, team_id: str) -> Optional[TenantConfig]:
+    result = await db.execute(select(TenantConfig).filter(TenantConfig.team_id == team_id))
+    return result.scalars().one_or_none()
+
+
+@query
+async def insert_stamps(db: AsyncSession, rows: Iterable[dict], chunk_size: int = 200) -> int:
+    count = 0
+    for chunk in chunked(rows, chunk_size):
+        result = await db.execute(insert_stamps_statement(db.bind.dialect.name, chunk))
+        count += result.rowcount
+    await db.commit()
+    return count
+
+
+@query
+async def fetch_stamp_history(db: AsyncSession,
+                              user_id: str,
+                              since: datetime,
+                              until: Optional[datetime] = None,
+                              team_id: str = DEFAULT_TEAM) -> list[UserStamp]:
+    stmt = select(UserStamp).filter(UserStamp.team_id == team_id, UserStamp.user_id == user_id,
+                                    UserStamp.stamped_at >= since)
+    if until is not None:
+        stmt = stmt.filter(UserStamp.stamped_at < until)
+    result = await db.execute(stmt.order_by(UserStamp.stamped_at))
+    return result.scalars().all()
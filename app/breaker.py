@@ -0,0 +1,87 @@
+import logging
+import time
+from collections import deque
+from typing import Optional
+
+from .metrics import CIRCUIT_SHORT_CIRCUITS, CIRCUIT_STATE, CIRCUIT_TRANSITIONS
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """
+    直近window件の呼び出しのうち、失敗か遅延（slow_call秒以上）の割合がfailure_rateを超えたら遮断する
+    遮断してからopen_seconds秒経つと1件だけ試し（half-open）、成功すれば元に戻す
+    """
+    def __init__(self,
+                 name: str,
+                 failure_rate: float = 0.5,
+                 window: int = 20,
+                 min_calls: int = 10,
+                 slow_call: float = 2.0,
+                 open_seconds: float = 30):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.calls: deque[bool] = deque(maxlen=window)
+        CIRCUIT_STATE.labels(name).set(STATE_VALUES[CLOSED])
+
+    @property
+    def is_open(self) -> bool:
+        # 遮断中でも試す時刻になっていればFalseを返す
+        return self.state == OPEN and time.monotonic() - self.opened_at < self.open_seconds
+
+    def allow(self) -> bool:
+        if self.state == OPEN and not self.is_open:
+            self.transition(HALF_OPEN)
+        if self.state == CLOSED or (self.state == HALF_OPEN and not self.probing):
+            self.probing = self.state == HALF_OPEN
+            return True
+        CIRCUIT_SHORT_CIRCUITS.labels(self.name).inc()
+        return False
+
+    def record(self, success: bool, elapsed: float):
+        failed = not success or elapsed >= self.slow_call
+        if self.state == HALF_OPEN:
+            self.probing = False
+            self.transition(OPEN if failed else CLOSED)
+            return
+        self.calls.append(failed)
+        if self.state == CLOSED and len(self.calls) >= self.min_calls and self.failure_ratio >= self.failure_rate:
+            self.transition(OPEN)
+
+    def release(self):
+        # 結果を記録しない（こちらの期限切れでAKASHIの状態がわからない場合）。half-openの場合は次の呼び出しで試す
+        if self.state == HALF_OPEN:
+            self.probing = False
+
+    @property
+    def failure_ratio(self) -> float:
+        return sum(self.calls) / len(self.calls) if self.calls else 0.0
+
+    def transition(self, state: str):
+        if state == self.state:
+            return
+        logger.warning('circuit %s: %s -> %s (failure ratio %.2f)', self.name, self.state, state, self.failure_ratio)
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        if state == CLOSED:
+            self.calls.clear()
+        CIRCUIT_STATE.labels(self.name).set(STATE_VALUES[state])
+        CIRCUIT_TRANSITIONS.labels(self.name, state).inc()
+
+    def reset(self, state: Optional[str] = None):
+        self.calls.clear()
+        self.probing = False
+        self.transition(state or CLOSED)
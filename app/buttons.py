@@ -1,26 +1,43 @@
-from typing import Optional
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
 
 from app.akashi import (BREAK, CLOCK_IN, CLOCK_OUT, LEAVE_DIRECTLY, RESTART, STRAIGHT_TO, Stamp, annotate_stamp_type)
-from slack_sdk.models.attachments import ActionButton, ConfirmObject
+
+if TYPE_CHECKING:
+    from slack_sdk.models.attachments import ConfirmObject
 
 PRIMARY = 'primary'
 DANGER = 'danger'
 BUTTON = 'button'
 
 
-def get_button(_type: int, style: Optional[str] = PRIMARY, confirm: Optional[ConfirmObject] = None) -> dict:
+def get_button(_type: int, style: Optional[str] = PRIMARY, confirm: Optional['ConfirmObject'] = None) -> dict:
+    from slack_sdk.models.attachments import ActionButton
     text = annotate_stamp_type(_type)
     return ActionButton(text=text, name=text, value=str(_type), style=style, confirm=confirm).to_dict()
 
 
-confirm = ConfirmObject(title='確認', deny='いいえ', confirm='はい', text='本当に勤務を終了しますか？')
+@lru_cache()
+def build_buttons() -> dict[str, dict]:
+    # slack_sdkのモデルの読み込みを起動時に行わないように、最初に使うときに作る
+    from slack_sdk.models.attachments import ConfirmObject
+    confirm = ConfirmObject(title='確認', deny='いいえ', confirm='はい', text='本当に勤務を終了しますか？')
+    return {
+        'clock_in': get_button(_type=CLOCK_IN),
+        'clock_out': get_button(_type=CLOCK_OUT, style=DANGER, confirm=confirm),
+        'break_': get_button(_type=BREAK),
+        'restart': get_button(_type=RESTART),
+        'leave_directry': get_button(_type=LEAVE_DIRECTLY, style=DANGER, confirm=confirm),
+        'straight_to': get_button(_type=STRAIGHT_TO),
+    }
+
 
-clock_in = get_button(_type=CLOCK_IN)
-clock_out = get_button(_type=CLOCK_OUT, style=DANGER, confirm=confirm)
-break_ = get_button(_type=BREAK)
-restart = get_button(_type=RESTART)
-leave_directry = get_button(_type=LEAVE_DIRECTLY, style=DANGER, confirm=confirm)
-straight_to = get_button(_type=STRAIGHT_TO)
+def __getattr__(name: str) -> dict:
+    # `from app.buttons import clock_in`のように参照されたときに作る
+    buttons = build_buttons()
+    if name in buttons:
+        return buttons[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 class AlreadyClockedOutException(Exception):
@@ -28,15 +45,16 @@ class AlreadyClockedOutException(Exception):
 
 
 def get_buttons(last_stamp: Optional[Stamp] = None):
+    buttons = build_buttons()
     # 打刻がない場合
     if not last_stamp:
-        return [clock_in, straight_to]
+        return [buttons['clock_in'], buttons['straight_to']]
     stamp_type = last_stamp.type
     # 最後の打刻が休憩の場合
     if stamp_type == BREAK:
-        return [restart]
+        return [buttons['restart']]
     # すでに勤務を終了
     if stamp_type in [CLOCK_OUT, LEAVE_DIRECTLY]:
         raise AlreadyClockedOutException()
     # それ以外
-    return [break_, leave_directry, clock_out]
+    return [buttons['break_'], buttons['leave_directry'], buttons['clock_out']]
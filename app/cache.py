@@ -0,0 +1,123 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """
+    エントリごとに有効期限を持てるLRUキャッシュ
+    """
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self._data: OrderedDict[Hashable, tuple[Any, Optional[float]]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _missing) is not _missing
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+_missing = object()
+
+
+class CacheBackend:
+    async def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    async def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        """
+        キーが存在しない場合だけ保存し、保存したかどうかを返す
+        """
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    # dynoが1台の場合
+    def __init__(self, maxsize: int = 1024):
+        self.cache = LRUCache(maxsize)
+
+    async def get(self, key: str) -> Optional[str]:
+        return self.cache.get(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self.cache.set(key, value, ttl)
+
+    async def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        if key in self.cache:
+            return False
+        self.cache.set(key, value, ttl)
+        return True
+
+    async def delete(self, key: str):
+        self.cache.delete(key)
+
+
+class RedisBackend(CacheBackend):
+    # 複数のdynoでキャッシュを共有する場合
+    def __init__(self, url: Optional[str] = None, client=None, prefix: str = 'akashi:'):
+        if client is None:
+            from redis.asyncio import from_url
+            client = from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self.client.get(self.prefix + key)
+        if isinstance(value, bytes):
+            return value.decode()
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        if ttl is not None and ttl <= 0:
+            await self.delete(key)
+            return
+        await self.client.set(self.prefix + key, value, px=int(ttl * 1000) if ttl else None)
+
+    async def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        return bool(await self.client.set(self.prefix + key, value, px=int(ttl * 1000) if ttl else None, nx=True))
+
+    async def delete(self, key: str):
+        await self.client.delete(self.prefix + key)
+
+
+def create_backend(backend: str, maxsize: int = 1024, url: Optional[str] = None) -> CacheBackend:
+    if backend == 'redis':
+        return RedisBackend(url)
+    if backend == 'memory':
+        return MemoryBackend(maxsize)
+    raise ValueError(f'unknown cache backend: {backend}')
@@ -1,32 +1,69 @@
 from datetime import datetime
-from typing import Optional, Union
+from itertools import islice
+from typing import Iterable, Iterator, Optional, Union
 
-from sqlalchemy import or_
+from sqlalchemy import func, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
 
-from .models import UserToken
+from .instrument import query
+from .models import DEFAULT_TEAM, SOURCE_AKASHI, TenantConfig, UserStamp, UserToken, scoped
+from .token_cache import notify_statements, token_cache
 
 
-def fetch(db: Session, user_id: str) -> Union[UserToken, None]:
-    return db.query(UserToken).filter(UserToken.user_id == user_id).one_or_none()
+@query
+def fetch(db: Session, user_id: str, team_id: str = DEFAULT_TEAM) -> Union[UserToken, None]:
+    return db.query(UserToken).filter(UserToken.team_id == team_id, UserToken.user_id == user_id).one_or_none()
 
 
+@query
 def fetch_all(db: Session) -> list[UserToken]:
     return db.query(UserToken).all()
 
 
+@query
 def fetch_by_expires_at(db: Session, expires_at_lt: datetime) -> list[UserToken]:
     return db.query(UserToken).filter(or_(UserToken.expires_at == None, UserToken.expires_at < expires_at_lt)).all()
 
 
-def create(db: Session, user_id: str, token: str, expires_at: Optional[datetime] = None) -> UserToken:
-    instance = UserToken(user_id=user_id, token=token, expires_at=expires_at)
+@query
+def fetch_token_page(db: Session, after_id: int, limit: int, expires_at_lt: Optional[datetime] = None) -> list[Row]:
+    query = db.query(UserToken.id, UserToken.team_id, UserToken.user_id, UserToken.token)
+    query = query.filter(UserToken.id > after_id)
+    if expires_at_lt is not None:
+        query = query.filter(or_(UserToken.expires_at == None, UserToken.expires_at < expires_at_lt))
+    return query.order_by(UserToken.id).limit(limit).all()
+
+
+def iter_tokens(db: Session, expires_at_lt: Optional[datetime] = None, page_size: int = 1000) -> Iterator[Row]:
+    """
+    (id, team_id, user_id, token)をid順に1件ずつ返す
+    idをキーにpage_size件ずつ読み込み、ORMのオブジェクトを作らないので、件数によらずメモリに載るのは1ページ分だけになる
+    """
+    after_id = 0
+    while True:
+        rows = fetch_token_page(db, after_id, page_size, expires_at_lt)
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after_id = rows[-1].id
+
+
+@query
+def create(db: Session,
+           user_id: str,
+           token: str,
+           expires_at: Optional[datetime] = None,
+           team_id: str = DEFAULT_TEAM) -> UserToken:
+    instance = UserToken(user_id=user_id, token=token, expires_at=expires_at, team_id=team_id)
     db.add(instance)
     db.commit()
     db.refresh(instance)
     return instance
 
 
+@query
 def update(
     db: Session,
     instance: UserToken,
@@ -35,25 +72,201 @@ def update(
 ) -> UserToken:
     instance.token = token or instance.token
     instance.expires_at = expires_at or instance.expires_at
+    keys = [scoped(instance.team_id, instance.user_id)]
+    notify_token_changed(db, keys)
     db.commit()
+    token_cache.invalidate(keys)
     return instance
 
 
+@query
 def update_or_create(db: Session,
                      user_id: str,
                      token: Optional[str] = None,
-                     expires_at: Optional[datetime] = None) -> UserToken:
-    instance = fetch(db, user_id)
-    if instance:
-        return update(db, instance, token, expires_at)
+                     expires_at: Optional[datetime] = None,
+                     team_id: str = DEFAULT_TEAM) -> UserToken:
     if not token:
-        raise Exception
-    return create(db, user_id, token, expires_at)
+        # トークンがない場合は作成できないので更新のみ
+        instance = fetch(db, user_id, team_id)
+        if not instance:
+            raise Exception
+        return update(db, instance, token, expires_at)
+    db.execute(
+        upsert_statement(dialect_name(db), [{
+            'team_id': team_id,
+            'user_id': user_id,
+            'token': token,
+            'expires_at': expires_at
+        }]))
+    keys = [scoped(team_id, user_id)]
+    notify_token_changed(db, keys)
+    db.commit()
+    token_cache.invalidate(keys)
+    return db.query(UserToken).populate_existing().filter(UserToken.team_id == team_id,
+                                                          UserToken.user_id == user_id).one()
 
 
+@query
 def delete(db: Session, instance: UserToken):
+    keys = [scoped(instance.team_id, instance.user_id)]
     db.delete(instance)
+    notify_token_changed(db, keys)
+    db.commit()
+    token_cache.invalidate(keys)
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def dialect_name(db: Session) -> str:
+    return db.get_bind().dialect.name
+
+
+def notify_token_changed(db: Session, keys: list[str]):
+    # 他のdynoのトークンのキャッシュを無効化する（キーはscopedで作る）
+    # 通知の上限があるので、SQLのチャンクとは別にバイト数で分けて送る
+    if keys and dialect_name(db) == 'postgresql':
+        for statement in notify_statements(keys):
+            db.execute(statement)
+
+
+def upsert_statement(dialect: str, rows: list[dict]):
+    if dialect == 'postgresql':
+        insert = postgresql.insert
+    elif dialect == 'sqlite':
+        insert = sqlite.insert
+    else:
+        raise NotImplementedError(f'upsert is not supported on {dialect}')
+    now = datetime.now()
+    stmt = insert(UserToken).values([{
+        'team_id': row.get('team_id', DEFAULT_TEAM),
+        'user_id': row['user_id'],
+        'token': row['token'],
+        'expires_at': row.get('expires_at'),
+        'created_at': now,
+    } for row in rows])
+    # updateと同じく有効期限が渡されなかった場合は元の値を残す
+    return stmt.on_conflict_do_update(
+        index_elements=[UserToken.team_id, UserToken.user_id],
+        set_={
+            'token': stmt.excluded.token,
+            'expires_at': func.coalesce(stmt.excluded.expires_at, UserToken.expires_at),
+        },
+    )
+
+
+@query
+def bulk_upsert_tokens(db: Session, rows: Iterable[dict], chunk_size: int = 200) -> int:
+    """
+    user_id, token, expires_at（省略可）, team_id（省略可）を持つdictをまとめて作成または更新する
+    SQLiteのプレースホルダ数の上限に収まるようにchunk_size件ずつ実行する
+    """
+    keys = []
+    for chunk in chunked(rows, chunk_size):
+        db.execute(upsert_statement(dialect_name(db), chunk))
+        notify_token_changed(db, [scoped(row.get('team_id', DEFAULT_TEAM), row['user_id']) for row in chunk])
+        keys += [scoped(row.get('team_id', DEFAULT_TEAM), row['user_id']) for row in chunk]
     db.commit()
+    token_cache.invalidate(keys)
+    return len(keys)
+
+
+@query
+def bulk_delete_by_user_ids(db: Session,
+                            user_ids: Iterable[str],
+                            chunk_size: int = 500,
+                            team_id: str = DEFAULT_TEAM) -> int:
+    count = 0
+    deleted = []
+    for chunk in chunked(user_ids, chunk_size):
+        count += db.query(UserToken).filter(UserToken.team_id == team_id,
+                                            UserToken.user_id.in_(chunk)).delete(synchronize_session=False)
+        keys = [scoped(team_id, user_id) for user_id in chunk]
+        notify_token_changed(db, keys)
+        deleted += keys
+    db.commit()
+    token_cache.invalidate(deleted)
+    return count
+
+
+def insert_stamps_statement(dialect: str, rows: list[dict]):
+    if dialect == 'postgresql':
+        insert = postgresql.insert
+    elif dialect == 'sqlite':
+        insert = sqlite.insert
+    else:
+        raise NotImplementedError(f'insert is not supported on {dialect}')
+    now = datetime.now()
+    stmt = insert(UserStamp).values([{
+        'team_id': row.get('team_id', DEFAULT_TEAM),
+        'user_id': row['user_id'],
+        'stamped_at': row['stamped_at'],
+        'type': row['type'],
+        'source': row['source'],
+        'created_at': now,
+    } for row in rows])
+    # Slackから打刻したものを同期で取り込んだ場合など、同じ打刻は無視する
+    return stmt.on_conflict_do_nothing(
+        index_elements=[UserStamp.team_id, UserStamp.user_id, UserStamp.stamped_at, UserStamp.type])
+
+
+@query
+def insert_stamps(db: Session, rows: Iterable[dict], chunk_size: int = 200) -> int:
+    """
+    user_id, stamped_at, type, source（とteam_id）を持つdictをまとめて登録する
+    """
+    count = 0
+    for chunk in chunked(rows, chunk_size):
+        count += db.execute(insert_stamps_statement(dialect_name(db), chunk)).rowcount
+    db.commit()
+    return count
+
+
+@query
+def fetch_stamp_history(db: Session,
+                        user_id: str,
+                        since: datetime,
+                        until: Optional[datetime] = None,
+                        team_id: str = DEFAULT_TEAM) -> list[UserStamp]:
+    query = db.query(UserStamp).filter(UserStamp.team_id == team_id, UserStamp.user_id == user_id,
+                                       UserStamp.stamped_at >= since)
+    if until is not None:
+        query = query.filter(UserStamp.stamped_at < until)
+    return query.order_by(UserStamp.stamped_at).all()
+
+
+@query
+def fetch_high_water_marks(db: Session,
+                           user_ids: Iterable[str],
+                           chunk_size: int = 500,
+                           team_id: str = DEFAULT_TEAM) -> dict[str, datetime]:
+    """
+    ワークスペースのユーザーごとに、AKASHIから同期済みの最後の打刻日時を返す
+    Slackから記録した打刻を含めると、それより前のAKASHIだけにある打刻を取得しなくなるので除く
+    """
+    result = {}
+    for chunk in chunked(user_ids, chunk_size):
+        query = db.query(UserStamp.user_id, func.max(UserStamp.stamped_at)).filter(
+            UserStamp.team_id == team_id, UserStamp.source == SOURCE_AKASHI,
+            UserStamp.user_id.in_(chunk)).group_by(UserStamp.user_id)
+        result.update(dict(query.all()))
+    return result
+
+
+@query
+def update_or_create_tenant(db: Session, team_id: str, **values) -> TenantConfig:
+    instance = db.query(TenantConfig).filter(TenantConfig.team_id == team_id).one_or_none()
+    if instance is None:
+        instance = TenantConfig(team_id=team_id)
+        db.add(instance)
+    for key, value in values.items():
+        setattr(instance, key, value)
+    db.commit()
+    db.refresh(instance)
+    return instance
 
 
 class UserTokenDoesNotExtsts(Exception):
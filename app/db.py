@@ -1,12 +1,145 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import time
+from functools import lru_cache
 
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from .metrics import DB_POOL_CHECKOUT
 from .settings import db_settings
 
-engine = create_engine(db_settings.DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-session = SessionLocal()
+
+def normalize_url(url: str) -> str:
+    # HerokuのDATABASE_URLはSQLAlchemy 1.4で使えないpostgres://で始まる
+    if url.startswith('postgres://'):
+        return url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+
+def async_url(url: str) -> str:
+    url = make_url(normalize_url(url))
+    if url.drivername in ('postgresql', 'postgresql+psycopg2'):
+        return str(url.set(drivername='postgresql+asyncpg'))
+    if url.drivername in ('sqlite', 'sqlite+pysqlite'):
+        return str(url.set(drivername='sqlite+aiosqlite'))
+    return str(url)
+
+
+class TimedQueuePool(QueuePool):
+    # プールからコネクションを取り出すまでの待ち時間を記録する
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT.labels('sync').observe(time.perf_counter() - started)
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT.labels('async').observe(time.perf_counter() - started)
+
+
+def pool_options(url: str, poolclass) -> dict:
+    # SQLiteはSQLAlchemyが選ぶプールをそのまま使う
+    if make_url(url).get_backend_name() == 'sqlite':
+        return {}
+    return {
+        'poolclass': poolclass,
+        'pool_size': db_settings.DB_POOL_SIZE,
+        'max_overflow': db_settings.DB_MAX_OVERFLOW,
+        'pool_timeout': db_settings.DB_POOL_TIMEOUT,
+        'pool_recycle': db_settings.DB_POOL_RECYCLE,
+        'pool_pre_ping': db_settings.DB_POOL_PRE_PING,
+    }
+
+
+database_url = normalize_url(db_settings.DATABASE_URL)
 Base = declarative_base()
 
-Base.metadata.create_all(engine)
+
+# エンジンはドライバの読み込みを伴うので、起動時ではなく最初に使うときに作る
+@lru_cache()
+def get_engine() -> Engine:
+    return create_engine(database_url, **pool_options(database_url, TimedQueuePool))
+
+
+@lru_cache()
+def get_async_engine() -> AsyncEngine:
+    return create_async_engine(async_url(database_url), **pool_options(database_url, TimedAsyncQueuePool))
+
+
+@lru_cache()
+def get_sessionmaker() -> sessionmaker:
+    return sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+
+
+@lru_cache()
+def get_async_sessionmaker() -> sessionmaker:
+    return sessionmaker(get_async_engine(), class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+def migrate():
+    """
+    テーブルを作成する
+    起動を遅らせないように、アプリの読み込み時ではなくリリース時（`python migrate.py`）に実行する
+    """
+    from . import models  # noqa: F401
+    engine = get_engine()
+    Base.metadata.create_all(engine)
+    upgrade(engine)
+
+
+def upgrade(engine: Engine):
+    """
+    create_allでは既存のテーブルは変更されないので、user_tokensとstampsにteam_idを追加する
+    """
+    if lacks_column(engine, 'user_tokens', 'team_id'):
+        upgrade_user_tokens(engine)
+    if lacks_column(engine, 'stamps', 'team_id'):
+        upgrade_stamps(engine)
+
+
+def lacks_column(engine: Engine, table: str, column: str) -> bool:
+    inspector = inspect(engine)
+    return inspector.has_table(table) and column not in [i['name'] for i in inspector.get_columns(table)]
+
+
+def upgrade_user_tokens(engine: Engine):
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE user_tokens ADD COLUMN team_id VARCHAR(16) NOT NULL DEFAULT ''"))
+        # SQLiteは制約を削除できないが、ローカルで1つのワークスペースに使うだけなので残しておく
+        if engine.dialect.name == 'postgresql':
+            connection.execute(text('ALTER TABLE user_tokens DROP CONSTRAINT IF EXISTS user_tokens_user_id_key'))
+        connection.execute(
+            text('CREATE UNIQUE INDEX ix_user_tokens_team_id_user_id ON user_tokens (team_id, user_id)'))
+
+
+def upgrade_stamps(engine: Engine):
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE stamps ADD COLUMN team_id VARCHAR(16) NOT NULL DEFAULT ''"))
+        connection.execute(text('DROP INDEX IF EXISTS ix_stamps_user_id_stamped_at'))
+        connection.execute(
+            text('CREATE UNIQUE INDEX ix_stamps_team_id_user_id_stamped_at '
+                 'ON stamps (team_id, user_id, stamped_at, type)'))
+
+
+LAZY_ATTRIBUTES = {
+    'engine': get_engine,
+    'async_engine': get_async_engine,
+    'SessionLocal': get_sessionmaker,
+    'AsyncSessionLocal': get_async_sessionmaker,
+}
+
+
+def __getattr__(name: str):
+    # `from app.db import SessionLocal`のように参照されたときに作る
+    if name in LAZY_ATTRIBUTES:
+        return LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
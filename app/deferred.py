@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional, Union
+
+from .metrics import DEFERRED_COMPLETION_LATENCY, DEFERRED_IN_PROGRESS, DEFERRED_TIMEOUTS
+from .timing import budget
+from .transport import get_client
+
+logger = logging.getLogger(__name__)
+
+Result = Union[str, dict, None]
+
+
+def to_message(result: Result) -> Optional[dict]:
+    if result is None:
+        return None
+    if isinstance(result, str):
+        return {'text': result}
+    return dict(result)
+
+
+class DeferredRunner:
+    """
+    Slackには先に応答を返し、処理の結果をresponse_urlに送信する
+    """
+    def __init__(self, max_concurrency: int = 20, timeout: float = 20.0):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def run(self,
+                  response_url: str,
+                  job: Callable[[], Awaitable[Result]],
+                  received_at: float,
+                  replace_original: bool = False):
+        async with self.semaphore:
+            DEFERRED_IN_PROGRESS.inc()
+            try:
+                # AKASHIへのリクエストもこの時間内に打ち切る
+                with budget(self.timeout):
+                    result = await asyncio.wait_for(job(), self.timeout)
+            except asyncio.TimeoutError:
+                DEFERRED_TIMEOUTS.inc()
+                logger.error('deferred job timed out after %.1fs', self.timeout)
+                result = 'タイムアウトしました。時間をおいて再度お試しください'
+            except Exception as e:
+                logger.error(e, exc_info=True)
+                result = 'エラーが発生しました'
+            finally:
+                DEFERRED_IN_PROGRESS.dec()
+            await self.respond(response_url, result, replace_original)
+            DEFERRED_COMPLETION_LATENCY.observe(time.perf_counter() - received_at)
+
+    async def respond(self, response_url: str, result: Result, replace_original: bool = False):
+        message = to_message(result)
+        if message is None or not response_url:
+            return
+        message.setdefault('replace_original', replace_original)
+        try:
+            res = await get_client().post(response_url, json=message)
+            res.raise_for_status()
+        except Exception as e:
+            logger.error(e, exc_info=True)
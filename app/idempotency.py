@@ -0,0 +1,121 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from .cache import CacheBackend
+from .deferred import Result
+from .metrics import IDEMPOTENT_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+_missing = object()
+
+
+def interaction_key(payload: dict) -> Optional[str]:
+    """
+    同じボタンの操作に対して同じキーを返す
+    Slackの再送は同じpayloadで届き、ダブルクリックはaction_tsとtrigger_idが変わってもmessage_tsは同じになる
+    """
+    interaction_id = payload.get('message_ts') or payload.get('action_ts') or payload.get('trigger_id')
+    if not interaction_id:
+        return None
+    value = payload['actions'][0]['value']
+    return f'idempotency:{payload["user"]["id"]}:{interaction_id}:{value}'
+
+
+class Unconfirmed(Exception):
+    """
+    処理が完了したことを確認できなかった
+    resultは応答に使うが保存せずに解放するので、同じキーでもう一度実行できる
+    """
+    def __init__(self, result: Result):
+        super().__init__(result)
+        self.result = result
+
+
+async def settle(job: Callable[[], Awaitable[Result]]) -> Result:
+    try:
+        return await job()
+    except Unconfirmed as e:
+        return e.result
+
+
+class Idempotency:
+    """
+    同じキーの処理をttl秒の間に一度だけ実行し、2回目以降は最初の結果を返す
+    処理が例外（Unconfirmedを含む）で終わった場合は結果を保存しない
+    最初の処理が実行中の場合は、同じプロセスなら完了を待ち、他のdynoならlock_ttl秒までbackendをポーリングする
+    """
+    def __init__(self, backend: CacheBackend, ttl: float = 300, lock_ttl: float = 30, poll_interval: float = 0.1):
+        self.backend = backend
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self._in_flight: dict[str, asyncio.Future] = {}
+
+    async def run(self, key: str, job: Callable[[], Awaitable[Result]]) -> Result:
+        while True:
+            future = self._in_flight.get(key)
+            if future is not None:
+                IDEMPOTENT_REQUESTS.labels('waited').inc()
+                return await asyncio.shield(future)
+            try:
+                claimed = await self.backend.add(key, PENDING, self.lock_ttl)
+            except Exception as e:
+                # 保存先が使えない場合は重複を防げないが、処理は止めない
+                logger.error(e, exc_info=True)
+                return await job()
+            if claimed:
+                return await self.execute(key, job)
+            try:
+                result = await self.wait(key)
+            except Exception as e:
+                # 待っている間に保存先が使えなくなった場合も、重複は防げないが処理は止めない
+                logger.error(e, exc_info=True)
+                return await job()
+            if result is not _missing:
+                IDEMPOTENT_REQUESTS.labels('replayed').inc()
+                return result
+            # 最初の処理が失敗して解放された場合は、もう一度取得を試みる
+
+    async def execute(self, key: str, job: Callable[[], Awaitable[Result]]) -> Result:
+        IDEMPOTENT_REQUESTS.labels('executed').inc()
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await job()
+        except BaseException as e:
+            await self.release(key)
+            future.set_exception(e)
+            # 待っている処理がなくても警告を出さない
+            future.exception()
+            raise
+        else:
+            try:
+                await self.backend.set(key, json.dumps({'result': result}), self.ttl)
+            except Exception as e:
+                logger.error(e, exc_info=True)
+            future.set_result(result)
+            return result
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def release(self, key: str):
+        try:
+            await self.backend.delete(key)
+        except Exception as e:
+            logger.error(e, exc_info=True)
+
+    async def wait(self, key: str):
+        deadline = time.monotonic() + self.lock_ttl
+        while time.monotonic() < deadline:
+            value = await self.backend.get(key)
+            if value is None:
+                return _missing
+            if value != PENDING:
+                return json.loads(value)['result']
+            await asyncio.sleep(self.poll_interval)
+        return _missing
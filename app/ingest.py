@@ -0,0 +1,104 @@
+import hashlib
+import hmac
+import json
+import time
+from typing import Optional
+from urllib.parse import parse_qsl
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .timing import measure
+
+TIMESTAMP_TOLERANCE = 60 * 5
+
+
+class SignatureVerifier:
+    """
+    Slackのリクエスト署名を検証する
+    HMACの鍵の処理はインスタンス作成時に済ませておき、リクエストごとにはcopyするだけにする
+    """
+    def __init__(self, signing_secret: str, tolerance: int = TIMESTAMP_TOLERANCE):
+        self._hmac = hmac.new(signing_secret.encode(), digestmod=hashlib.sha256) if signing_secret else None
+        self.tolerance = tolerance
+
+    def is_valid(self, body: bytes, timestamp: Optional[bytes], signature: Optional[bytes],
+                 now: Optional[float] = None) -> bool:
+        if self._hmac is None or not timestamp or not signature:
+            return False
+        # 古いリクエストはハッシュを計算する前に弾く
+        try:
+            if abs((now or time.time()) - int(timestamp)) > self.tolerance:
+                return False
+        except ValueError:
+            return False
+        mac = self._hmac.copy()
+        mac.update(b'v0:' + timestamp + b':' + body)
+        return hmac.compare_digest(b'v0=' + mac.hexdigest().encode(), signature)
+
+
+def parse_body(body: bytes, content_type: bytes) -> tuple[Optional[dict], Optional[dict]]:
+    """
+    フォームとinteractionのpayloadを返す
+    """
+    if content_type.startswith(b'application/x-www-form-urlencoded'):
+        form = dict(parse_qsl(body.decode(), keep_blank_values=True))
+        payload = json.loads(form['payload']) if 'payload' in form else None
+        return form, payload
+    if content_type.startswith(b'application/json'):
+        return None, json.loads(body or b'{}')
+    return None, None
+
+
+class SlackIngestMiddleware:
+    """
+    Slackからのリクエストのボディを一度だけ読み込み、署名の検証結果とパース結果をrequest.stateに格納する
+    検証に失敗しても拒否はせず、verify_signatureに任せる（パースはせず、formとpayloadはNoneにする）
+    """
+    def __init__(self, app: ASGIApp, signing_secret: str, paths: tuple[str, ...] = ('/slash', '/actions', '/events')):
+        self.app = app
+        self.verifier = SignatureVerifier(signing_secret)
+        self.paths = paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or scope['path'] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        state = scope.setdefault('state', {})
+        state['received_at'] = time.perf_counter()
+        body = await read_body(receive)
+        headers = dict(scope['headers'])
+        with measure('verify'):
+            state['verified'] = self.verifier.is_valid(body, headers.get(b'x-slack-request-timestamp'),
+                                                       headers.get(b'x-slack-signature'))
+        state['form'], state['payload'] = None, None
+        # 署名が正しいリクエストだけをパースし、不正なリクエストにはコストをかけない
+        if state['verified']:
+            with measure('parse'):
+                try:
+                    state['form'], state['payload'] = parse_body(body, headers.get(b'content-type', b''))
+                except ValueError:
+                    pass
+        await self.app(scope, replay(body, receive), send)
+
+
+async def read_body(receive: Receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+def replay(body: bytes, receive: Receive) -> Receive:
+    # 後続がボディを読んでも同じ内容を返す
+    sent = False
+
+    async def wrapped() -> Message:
+        nonlocal sent
+        if sent:
+            return await receive()
+        sent = True
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    return wrapped
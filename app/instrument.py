@@ -0,0 +1,159 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Optional
+
+from slack_sdk.errors import SlackApiError
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import DB_QUERY_LATENCY, ROUTE_LATENCY, SLACK_TIMEOUT_RISK, SLOW_REQUESTS
+from .timing import record
+
+
+def timed(histogram, *labels, phase: Optional[str] = None) -> Callable:
+    """
+    関数の実行時間をhistogramに記録する
+    ラベルは先に解決しておき、呼び出しごとのコストをobserveだけにする
+    phaseを指定した場合はServer-Timingにも加算する
+    """
+    child = histogram.labels(*labels)
+
+    def observe(seconds: float):
+        child.observe(seconds)
+        if phase:
+            record(phase, seconds)
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    observe(time.perf_counter() - started)
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+class LabelCache:
+    """
+    labels()の解決結果を保持し、2回目以降は辞書の参照だけにする
+    """
+    def __init__(self, metric):
+        self.metric = metric
+        self._children: dict[tuple, object] = {}
+
+    def __call__(self, *labels):
+        child = self._children.get(labels)
+        if child is None:
+            child = self._children[labels] = self.metric.labels(*labels)
+        return child
+
+
+# queryで計測中かどうか（update_or_createからfetchを呼ぶ場合などに、内側を二重に数えない）
+in_query: ContextVar[bool] = ContextVar('in_query', default=False)
+
+
+def query(func):
+    """
+    DBの実行時間を関数ごとに記録する
+    queryを付けた関数から呼ばれた場合は、外側の関数の時間に含まれるので記録しない
+    """
+    timed_func = timed(DB_QUERY_LATENCY, func.__name__, phase='db')(func)
+    if asyncio.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if in_query.get():
+                return await func(*args, **kwargs)
+            token = in_query.set(True)
+            try:
+                return await timed_func(*args, **kwargs)
+            finally:
+                in_query.reset(token)
+
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if in_query.get():
+            return func(*args, **kwargs)
+        token = in_query.set(True)
+        try:
+            return timed_func(*args, **kwargs)
+        finally:
+            in_query.reset(token)
+
+    return wrapper
+
+
+def outcome_of(e: Optional[BaseException]) -> str:
+    if e is None:
+        return 'ok'
+    if isinstance(e, SlackApiError):
+        return 'slack_error'
+    return 'error'
+
+
+class RouteTimingMiddleware:
+    """
+    ルートごとのレスポンスを返し終わるまでの時間を記録する
+    BackgroundTasksはレスポンスの後に実行されるので含めない
+    ラベルが増えすぎないように、登録されていないパスは`other`にまとめる
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._paths: Optional[set[str]] = None
+        self.latency = LabelCache(ROUTE_LATENCY)
+        self.slow = LabelCache(SLOW_REQUESTS)
+
+    def route_of(self, scope: Scope) -> str:
+        if self._paths is None:
+            self._paths = {i.path for i in getattr(scope.get('app'), 'routes', [])}
+        return scope['path'] if scope['path'] in self._paths else 'other'
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+        observed = False
+
+        def observe():
+            nonlocal observed
+            observed = True
+            elapsed = time.perf_counter() - started
+            route = self.route_of(scope)
+            self.latency(route, scope['method'], status).observe(elapsed)
+            if elapsed > SLACK_TIMEOUT_RISK:
+                self.slow(route).inc()
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                observe()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not observed:
+                observe()
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Optional
+
+from slack_sdk.errors import SlackApiError
+
+if TYPE_CHECKING:
+    # aiohttpを読み込むので型の確認のときだけ読み込む
+    from slack_sdk.web.async_client import AsyncWebClient
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelMembership:
+    """
+    通知先チャンネルへの参加状況をキャッシュし、期限切れや無効化のたびにバックグラウンドで参加し直す
+    """
+    def __init__(self, client: 'AsyncWebClient', ttl: float = 3600):
+        self.client = client
+        self.ttl = ttl
+        self._joined: dict[str, tuple[bool, float]] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def joined(self, channel: str) -> Optional[bool]:
+        """
+        キャッシュされている参加状況を返す（未確認の場合はNone）
+        期限切れの場合も直前の値を返しつつ再確認を予約する
+        """
+        cached = self._joined.get(channel)
+        if not cached or time.monotonic() - cached[1] > self.ttl:
+            self.schedule_refresh(channel)
+        return cached[0] if cached else None
+
+    def invalidate(self, channel: str):
+        self._joined.pop(channel, None)
+        self.schedule_refresh(channel)
+
+    def schedule_refresh(self, channel: str):
+        task = self._tasks.get(channel)
+        if task and not task.done():
+            return
+        try:
+            self._tasks[channel] = asyncio.get_running_loop().create_task(self.refresh(channel))
+        except RuntimeError:
+            # イベントループ外から呼ばれた場合は次のリクエストで確認する
+            pass
+
+    async def refresh(self, channel: str) -> Optional[bool]:
+        try:
+            await self.client.conversations_join(channel=channel)
+            joined = True
+        except SlackApiError as e:
+            # channel_not_foundやmissing_scopeなど設定の誤り
+            logger.error(e, exc_info=True)
+            joined = False
+        except Exception as e:
+            # 通信エラーなどは参加状況がわからないのでキャッシュを更新しない
+            logger.error(e, exc_info=True)
+            return None
+        self._joined[channel] = (joined, time.monotonic())
+        return joined
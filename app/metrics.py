@@ -0,0 +1,72 @@
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+HTTP_POOL_REQUESTS = Counter(
+    'http_pool_requests_total',
+    'Outbound HTTP requests by whether a pooled connection was reused',
+    ['host', 'result'],
+)
+HTTP_POOL_HANDSHAKES = Counter('http_pool_tls_handshakes_total', 'TLS handshakes performed by the pool', ['host'])
+
+NOTIFY_QUEUE_DEPTH = Gauge('slack_notify_queue_depth', 'Channel notifications waiting to be sent')
+NOTIFY_DROPPED = Counter('slack_notify_dropped_total', 'Channel notifications dropped because the queue was full')
+NOTIFY_RATE_LIMITED = Counter('slack_notify_rate_limited_total', 'chat.postMessage calls rejected with HTTP 429')
+NOTIFY_DRAIN_LATENCY = Histogram('slack_notify_drain_seconds', 'Time from enqueue until a notification is sent')
+
+STAMP_CACHE_REQUESTS = Counter('stamp_cache_requests_total', 'Last stamp cache lookups', ['result'])
+
+DEFERRED_ACK_LATENCY = Histogram('deferred_ack_seconds', 'Time until Slack is acknowledged in deferred mode')
+DEFERRED_COMPLETION_LATENCY = Histogram(
+    'deferred_completion_seconds',
+    'Time until the result is posted to response_url in deferred mode',
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0),
+)
+DEFERRED_IN_PROGRESS = Gauge('deferred_in_progress', 'Deferred jobs currently running')
+DEFERRED_TIMEOUTS = Counter('deferred_timeouts_total', 'Deferred jobs that exceeded DEFERRED_TIMEOUT')
+
+DB_POOL_CHECKOUT = Histogram(
+    'db_pool_checkout_seconds',
+    'Time spent waiting for a connection from the database pool',
+    ['engine'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+TOKEN_CACHE_REQUESTS = Counter('token_cache_requests_total', 'API token cache lookups', ['result'])
+TOKEN_CACHE_EVICTIONS = Counter('token_cache_evictions_total', 'API tokens evicted from the cache')
+
+REPORT_CACHE_REQUESTS = Counter('report_cache_requests_total', 'Per-day stamp cache lookups for reports', ['result'])
+
+IDEMPOTENT_REQUESTS = Counter('idempotent_requests_total', 'Interactions by whether they ran or reused a result',
+                              ['result'])
+
+# Slackは3秒以内に応答しないとタイムアウトとして扱う
+SLACK_TIMEOUT_RISK = 2.5
+
+ROUTE_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'End-to-end latency of each route',
+    ['route', 'method', 'status'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 2.5, 3.0, 5.0, 10.0),
+)
+SLOW_REQUESTS = Counter('http_requests_slow_total', f'Requests slower than {SLACK_TIMEOUT_RISK}s', ['route'])
+AKASHI_REQUEST_LATENCY = Histogram('akashi_request_duration_seconds', 'AKASHI API calls', ['method', 'outcome'])
+SLACK_API_LATENCY = Histogram('slack_api_duration_seconds', 'Slack Web API calls', ['method', 'outcome'])
+DB_QUERY_LATENCY = Histogram(
+    'db_query_duration_seconds',
+    'Time spent in each crud function',
+    ['function'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+CIRCUIT_STATE = Gauge('circuit_breaker_state', 'Circuit breaker state (0: closed, 1: half-open, 2: open)', ['name'])
+CIRCUIT_TRANSITIONS = Counter('circuit_breaker_transitions_total', 'Circuit breaker state changes', ['name', 'state'])
+CIRCUIT_SHORT_CIRCUITS = Counter('circuit_breaker_short_circuits_total', 'Calls rejected while the circuit was open',
+                                 ['name'])
+
+TENANTS_ACTIVE = Gauge('tenants_active', 'Workspaces whose clients are loaded in this process')
+TENANT_EVICTIONS = Counter('tenant_evictions_total', 'Workspaces unloaded because they were idle or over the limit')
+
+STAMPS = Counter('stamps_total', 'Stamps recorded from Slack', ['type'])
+
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
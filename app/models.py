@@ -1,24 +1,64 @@
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import Column, DateTime, Integer, String
+from sqlalchemy import Column, DateTime, Float, Index, Integer, String
 
-from .db import Base, engine
+from .db import Base
+
+# 環境変数で設定したワークスペース（tenantsに登録していないワークスペースも含む）
+DEFAULT_TEAM = ''
+
+
+def scoped(team_id: str, user_id: str) -> str:
+    # キャッシュのキー。既定のワークスペースは従来どおりuser_idだけにする
+    return f'{team_id}:{user_id}' if team_id else user_id
 
 
 class UserToken(Base):
     __tablename__ = 'user_tokens'
+    __table_args__ = (Index('ix_user_tokens_team_id_user_id', 'team_id', 'user_id', unique=True), )
     id = Column(Integer, primary_key=True)
-    user_id = Column(String(16), nullable=False, unique=True)
+    team_id = Column(String(16), nullable=False, default=DEFAULT_TEAM, server_default=DEFAULT_TEAM)
+    user_id = Column(String(16), nullable=False)
     token = Column(String(36), nullable=False)
     expires_at = Column(DateTime, index=True, nullable=True)
     created_at = Column(DateTime, nullable=False, default=datetime.now)
 
-    def __init__(self, user_id: str, token: str, expires_at: Optional[datetime] = None):
+    def __init__(self, user_id: str, token: str, expires_at: Optional[datetime] = None, team_id: str = DEFAULT_TEAM):
+        self.team_id = team_id
         self.user_id = user_id
         self.token = token
         self.expires_at = expires_at
         self.created_at = datetime.now()
 
 
-Base.metadata.create_all(engine)
+class TenantConfig(Base):
+    # Slackのワークスペースごとの設定（未設定の項目は環境変数の値を使う）
+    __tablename__ = 'tenants'
+    id = Column(Integer, primary_key=True)
+    team_id = Column(String(16), nullable=False, unique=True)
+    akashi_company_id = Column(String(64), nullable=False)
+    slack_bot_token = Column(String(128), nullable=False)
+    slack_channel_id = Column(String(16), nullable=True)
+    rate_limit = Column(Float, nullable=True)
+    pool_size = Column(Integer, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+
+
+SOURCE_SLACK = 'slack'
+SOURCE_AKASHI = 'akashi'
+
+
+class UserStamp(Base):
+    # AKASHIの打刻の履歴（Slackから打刻したものと、AKASHIから同期したもの）
+    __tablename__ = 'stamps'
+    __table_args__ = (Index('ix_stamps_team_id_user_id_stamped_at', 'team_id', 'user_id', 'stamped_at', 'type',
+                            unique=True), )
+    id = Column(Integer, primary_key=True)
+    # Enterprise GridではユーザーIDがワークスペースをまたいで同じになるので、ワークスペースごとに分ける
+    team_id = Column(String(16), nullable=False, default=DEFAULT_TEAM, server_default=DEFAULT_TEAM)
+    user_id = Column(String(16), nullable=False)
+    stamped_at = Column(DateTime, nullable=False)
+    type = Column(Integer, nullable=False)
+    source = Column(String(8), nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
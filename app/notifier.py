@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import time
+import weakref
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Optional
+
+from slack_sdk.errors import SlackApiError
+
+from .membership import ChannelMembership
+from .metrics import NOTIFY_DRAIN_LATENCY, NOTIFY_DROPPED, NOTIFY_QUEUE_DEPTH, NOTIFY_RATE_LIMITED
+
+if TYPE_CHECKING:
+    from slack_sdk.web.async_client import AsyncWebClient
+
+logger = logging.getLogger(__name__)
+# ワークスペースごとにNotifierを作るので、キューの長さは合計を記録する
+_notifiers: 'weakref.WeakSet[Notifier]' = weakref.WeakSet()
+NOTIFY_QUEUE_DEPTH.set_function(lambda: sum(i.depth for i in list(_notifiers)))
+
+
+class Message:
+    __slots__ = ('channel', 'text', 'enqueued_at')
+
+    def __init__(self, channel: str, text: str):
+        self.channel = channel
+        self.text = text
+        self.enqueued_at = time.perf_counter()
+
+
+class Notifier:
+    """
+    チャンネルへの通知をキューに積み、バックグラウンドでまとめて送信する
+    """
+    def __init__(self,
+                 client: 'AsyncWebClient',
+                 maxsize: int = 1000,
+                 batch_size: int = 50,
+                 membership: Optional[ChannelMembership] = None):
+        self.client = client
+        self.membership = membership
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        _notifiers.add(self)
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.maxsize)
+        return self._queue
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def notify(self, channel: str, text: str) -> bool:
+        try:
+            self.queue.put_nowait(Message(channel, text))
+            return True
+        except asyncio.QueueFull:
+            # 送信が追いつかない場合は打刻のレスポンスを優先して通知を捨てる
+            self.dropped += 1
+            NOTIFY_DROPPED.inc()
+            logger.warning('notification dropped: %s', text)
+            return False
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self, timeout: float = 5.0):
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning('%d notifications were not sent', self.depth)
+        self._worker.cancel()
+        self._worker = None
+
+    async def run(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await self.drain(batch)
+            except Exception as e:
+                logger.error(e, exc_info=True)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def drain(self, batch: list[Message]):
+        # 同じチャンネル宛の通知は1件のメッセージにまとめる
+        channels: dict[str, list[Message]] = {}
+        for message in batch:
+            channels.setdefault(message.channel, []).append(message)
+        for channel, messages in channels.items():
+            await self.send(channel, '\n'.join(message.text for message in messages))
+            now = time.perf_counter()
+            for message in messages:
+                NOTIFY_DRAIN_LATENCY.observe(now - message.enqueued_at)
+
+    async def send(self, channel: str, text: str, max_retry_count: int = 3):
+        for _ in range(max_retry_count + 1):
+            try:
+                await self.client.chat_postMessage(channel=channel, text=text)
+                return
+            except SlackApiError as e:
+                if e.response.get('error') == 'not_in_channel' and self.membership:
+                    # チャンネルから外されていた場合は参加し直してから再送する
+                    if not await self.membership.refresh(channel):
+                        raise
+                    continue
+                if e.response.status_code != HTTPStatus.TOO_MANY_REQUESTS:
+                    raise
+                NOTIFY_RATE_LIMITED.inc()
+                headers = e.response.headers
+                retry_after = int(headers.get('Retry-After') or headers.get('retry-after') or 1)
+                logger.warning('rate limited, retry after %ds', retry_after)
+                await asyncio.sleep(retry_after)
+        raise Exception(f'failed to notify {channel} after {max_retry_count} retries')
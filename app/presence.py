@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from .akashi import BREAK, CLOCK_IN, CLOCK_OUT, LEAVE_DIRECTLY, RESTART, STRAIGHT_TO, Stamp
+from .deferred import Result
+
+logger = logging.getLogger(__name__)
+
+WORKING = 'working'
+ON_BREAK = 'on_break'
+CLOCKED_OUT = 'clocked_out'
+NOT_STARTED = 'not_started'
+UNKNOWN = 'unknown'
+
+STATUSES = (
+    (WORKING, ':office: 勤務中'),
+    (ON_BREAK, ':coffee: 休憩中'),
+    (CLOCKED_OUT, ':house: 退勤済み'),
+    (NOT_STARTED, ':zzz: 未出勤'),
+    (UNKNOWN, ':warning: 取得できませんでした'),
+)
+
+# response_urlは5回までしか使えないので、最後の結果のために1回残す
+MAX_PROGRESS = 4
+
+Fetch = Callable[[str, str], Awaitable[Optional[Stamp]]]
+
+
+def status_of(stamp: Optional[Stamp]) -> str:
+    if stamp is None:
+        return NOT_STARTED
+    if stamp.type in (CLOCK_IN, STRAIGHT_TO, RESTART):
+        return WORKING
+    if stamp.type == BREAK:
+        return ON_BREAK
+    if stamp.type in (CLOCK_OUT, LEAVE_DIRECTLY):
+        return CLOCKED_OUT
+    return UNKNOWN
+
+
+class Snapshot:
+    __slots__ = ('total', 'statuses', 'taken_at', 'done')
+
+    def __init__(self, total: int):
+        self.total = total
+        self.statuses: dict[str, str] = {}
+        self.taken_at: Optional[float] = None
+        self.done = asyncio.Event()
+
+    @property
+    def complete(self) -> bool:
+        return self.done.is_set()
+
+    def render(self) -> dict:
+        groups: dict[str, list[str]] = {}
+        for user_id, status in self.statuses.items():
+            groups.setdefault(status, []).append(f'<@{user_id}>')
+        lines = []
+        if not self.complete:
+            lines.append(f'集計中…（{len(self.statuses)}/{self.total}人）')
+        for status, label in STATUSES:
+            if users := groups.get(status):
+                lines.append(f'*{label}*（{len(users)}人）\n' + ' '.join(sorted(users)))
+        if not self.total:
+            lines.append('APIトークンを登録しているユーザーがいません')
+        return {'text': '\n'.join(lines)}
+
+
+class PresenceBoard:
+    """
+    登録しているユーザー全員の最後の打刻から勤務状況を集計する
+    AKASHIへの問い合わせはconcurrency件まで並行して行い、結果はttl秒の間は共有する
+    集計中に呼ばれた場合は同じ集計の結果を待つ
+    """
+    def __init__(self, concurrency: int = 20, ttl: float = 60, progress_interval: float = 1.0):
+        self.concurrency = concurrency
+        self.ttl = ttl
+        self.progress_interval = progress_interval
+        self._snapshot: Optional[Snapshot] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def fresh(self) -> Optional[Snapshot]:
+        snapshot = self._snapshot
+        if snapshot and snapshot.complete and time.monotonic() - snapshot.taken_at < self.ttl:
+            return snapshot
+        return None
+
+    async def collect(self, load_targets: Callable[[], Awaitable[list[tuple[str, str]]]], fetch: Fetch) -> Snapshot:
+        """
+        集計を開始して途中経過のSnapshotを返す
+        集計中の場合は対象を読み込まずに同じSnapshotを返す
+        """
+        if self._task is None or self._task.done():
+            targets = await load_targets()
+            self._snapshot = Snapshot(len(targets))
+            self._task = asyncio.get_running_loop().create_task(self.run(self._snapshot, targets, fetch))
+        return self._snapshot
+
+    async def run(self, snapshot: Snapshot, targets: list[tuple[str, str]], fetch: Fetch):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def check(user_id: str, token: str):
+            async with semaphore:
+                try:
+                    snapshot.statuses[user_id] = status_of(await fetch(user_id, token))
+                except Exception as e:
+                    logger.error(e)
+                    snapshot.statuses[user_id] = UNKNOWN
+
+        try:
+            await asyncio.gather(*(check(user_id, token) for user_id, token in targets))
+        finally:
+            snapshot.taken_at = time.monotonic()
+            snapshot.done.set()
+
+    async def stream(self, snapshot: Snapshot, respond: Callable[[Result], Awaitable]):
+        """
+        集計が終わるまで途中経過を最大MAX_PROGRESS回送り、最後に結果を送る
+        集計が長引いても途中経過を送り続けられるように、間隔はprogress_interval秒から倍にしていく
+        """
+        interval = self.progress_interval
+        for _ in range(MAX_PROGRESS):
+            try:
+                await asyncio.wait_for(snapshot.done.wait(), interval)
+                break
+            except asyncio.TimeoutError:
+                await respond(snapshot.render())
+            interval *= 2
+        await snapshot.done.wait()
+        await respond(snapshot.render())
@@ -0,0 +1,85 @@
+import logging
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from os import path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def collapse(frame) -> str:
+    # flamegraph.plやspeedscopeが読めるcollapsed stack形式（呼び出し元から順に`;`で繋ぐ）
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    """
+    有効にした後のN件のリクエストを処理している間、イベントループのスレッドのスタックを一定間隔で記録する
+    対象のリクエストがすべて終わるとcollapsed stack形式でファイルに書き出す
+    """
+    def __init__(self, directory: str, interval: float = 0.005):
+        self.directory = directory
+        self.interval = interval
+        self.remaining = 0
+        self.in_flight = 0
+        self.last_path: Optional[str] = None
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def arm(self, requests: int):
+        self.remaining = requests
+
+    def request_started(self) -> bool:
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        self.in_flight += 1
+        if self._thread is None:
+            self.start(threading.get_ident())
+        return True
+
+    def request_finished(self):
+        self.in_flight -= 1
+        if self.remaining <= 0 and self.in_flight <= 0:
+            self.stop()
+
+    def start(self, thread_id: int):
+        self.stacks = Counter()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.sample, args=(thread_id, ), daemon=True)
+        self._thread.start()
+
+    def sample(self, thread_id: int):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def stop(self) -> Optional[str]:
+        if self._thread is None:
+            return None
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        filename = path.join(self.directory, datetime.now().strftime('profile-%Y%m%d-%H%M%S.collapsed'))
+        try:
+            with open(filename, 'w') as f:
+                f.writelines(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+        except OSError as e:
+            logger.error(e, exc_info=True)
+            return None
+        logger.info('profile written to %s (%d samples)', filename, sum(self.stacks.values()))
+        self.last_path = filename
+        return filename
@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, NamedTuple, Optional, Union
+
+from httpx import ConnectError, TransportError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import async_crud
+from .akashi import AkashiRequestClient, APIError, ReissuedTokenResponse, RequestFailedError, UnavailableError
+from .crud import bulk_delete_by_user_ids, bulk_upsert_tokens, iter_tokens
+from .models import DEFAULT_TEAM
+from .utils import percentile
+
+if TYPE_CHECKING:
+    from .tenant import TenantRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    AKASHIへのリクエストを1秒あたりrate件に制限する
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Target(NamedTuple):
+    id: int
+    user_id: str
+    token: str
+    team_id: str = DEFAULT_TEAM
+
+
+class Summary:
+    def __init__(self):
+        self.total = 0
+        self.updated = 0
+        self.deleted = 0
+        self.errors = 0
+        self.retries = 0
+        self.elapsed = 0.0
+        self.latencies: list[float] = []
+
+    @property
+    def throughput(self) -> float:
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return '\n'.join([
+            f'更新バッチの実行が完了しました（対象：{self.total:,}件）',
+            f'更新：{self.updated:,}件',
+            f'削除：{self.deleted:,}件',
+            f'エラー：{self.errors:,}件',
+            f'リトライ：{self.retries:,}回',
+            f'所要時間：{self.elapsed:.1f}秒（{self.throughput:.1f}件/秒）',
+            'レイテンシ：p50 {:.0f}ms / p95 {:.0f}ms / p99 {:.0f}ms'.format(
+                *(percentile(self.latencies, p) * 1000 for p in (50, 95, 99))),
+        ])
+
+
+def is_retryable(e: Exception) -> bool:
+    # 5xxとレート制限、タイムアウトなどの通信エラーはリトライする
+    if isinstance(e, RequestFailedError):
+        return e.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR or e.status_code == HTTPStatus.TOO_MANY_REQUESTS
+    return isinstance(e, (TransportError, UnavailableError))
+
+
+def is_reissue_retryable(e: Exception) -> bool:
+    # 再発行は冪等ではない（最初のリクエストでトークンが変わっている可能性がある）ので、
+    # AKASHIがエラーを返した場合と、接続できなかった場合だけリトライする
+    if isinstance(e, RequestFailedError):
+        return is_retryable(e)
+    return isinstance(e, ConnectError)
+
+
+class AmbiguousReissueError(Exception):
+    """
+    リトライした再発行でAPIErrorが返ってきた
+    前のリクエストで再発行済みの（DBのトークンが古いだけの）可能性があるので、トークンを削除しない
+    """
+    pass
+
+
+class TokenRefresher:
+    """
+    期限切れが近いトークンを並行して再発行し、DBへの書き込みはbatch_size件ごとにまとめて行う
+    APIErrorが返ってきたトークンは無効とみなして削除する（リトライした場合は除く）
+    書き込みに失敗したバッチは次のflushで書き込み、最後のflushでも失敗した場合はrunが例外を送出する
+    session_factoryがAsyncSessionを返す場合は、イベントループを止めないように非同期で書き込む（アプリの中で実行する場合）
+    """
+    def __init__(self,
+                 session_factory: Callable[[], Union[Session, AsyncSession]],
+                 concurrency: int = 10,
+                 rate: float = 20,
+                 max_retries: int = 3,
+                 backoff: float = 0.5,
+                 batch_size: int = 100,
+                 tenants: Optional['TenantRegistry'] = None):
+        self.session_factory = session_factory
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.batch_size = batch_size
+        # 指定しない場合はすべて環境変数のAKASHI_COMPANY_IDで再発行する
+        self.tenants = tenants
+        self.summary = Summary()
+        self._updates: list[dict] = []
+        self._deletes: list[Target] = []
+
+    async def run(self, targets: Iterable[Target]) -> Summary:
+        started = time.perf_counter()
+        # targetsがジェネレーターの場合は、キューが空いた分だけ読み込む
+        queue: asyncio.Queue = asyncio.Queue(self.concurrency * 2)
+        workers = [asyncio.create_task(self.worker(queue)) for _ in range(self.concurrency)]
+        try:
+            for target in targets:
+                await queue.put(target)
+                self.summary.total += 1
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            # 再起動などで止められた場合も、AKASHIで再発行済みのトークンは書き込んでから終わる
+            await asyncio.shield(self.close(workers))
+        self.summary.elapsed = time.perf_counter() - started
+        return self.summary
+
+    async def worker(self, queue: asyncio.Queue):
+        while True:
+            target = await queue.get()
+            try:
+                await self.refresh(target)
+            except Exception as e:
+                logger.error(e, exc_info=True)
+            finally:
+                queue.task_done()
+
+    async def refresh(self, target: Target):
+        started = time.perf_counter()
+        try:
+            response = await self.reissue(target)
+        except APIError as e:
+            logger.error(e)
+            self._deletes.append(target)
+            self.summary.deleted += 1
+        except Exception as e:
+            logger.error(e)
+            self.summary.errors += 1
+        else:
+            self._updates.append({
+                'team_id': target.team_id,
+                'user_id': target.user_id,
+                'token': response.token,
+                'expires_at': response.expired_at,
+            })
+            self.summary.updated += 1
+        self.summary.latencies.append(time.perf_counter() - started)
+        if len(self._updates) + len(self._deletes) >= self.batch_size:
+            await self.flush()
+
+    async def reissue(self, target: Target) -> ReissuedTokenResponse:
+        if self.tenants:
+            akashi = await self.tenants.akashi(target.team_id, target.token)
+        else:
+            akashi = AkashiRequestClient(target.token)
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                return await akashi.reissue_token()
+            except APIError as e:
+                if attempt:
+                    raise AmbiguousReissueError(e) from e
+                raise
+            except Exception as e:
+                if attempt >= self.max_retries or not is_reissue_retryable(e):
+                    raise
+            # full jitterで待ってからリトライする
+            self.summary.retries += 1
+            await asyncio.sleep(random.uniform(0, self.backoff * 2**attempt))
+            attempt += 1
+
+    async def close(self, workers: list[asyncio.Task]):
+        await asyncio.gather(*workers, return_exceptions=True)
+        await self.flush()
+
+    async def flush(self):
+        if not self._updates and not self._deletes:
+            return
+        updates, self._updates = self._updates, []
+        deletes, self._deletes = self._deletes, []
+        try:
+            await self.write(updates, deletes)
+        except BaseException:
+            # 元のトークンはAKASHIで無効になっているので捨てずに戻し、次のflushで書き込む
+            self._updates[:0] = updates
+            self._deletes[:0] = deletes
+            raise
+
+    async def write(self, updates: list[dict], deletes: list[Target]):
+        teams: dict[str, list[str]] = {}
+        for target in deletes:
+            teams.setdefault(target.team_id, []).append(target.user_id)
+        db = self.session_factory()
+        if isinstance(db, AsyncSession):
+            async with db:
+                await async_crud.bulk_upsert_tokens(db, updates)
+                for team_id, user_ids in teams.items():
+                    await async_crud.bulk_delete_by_user_ids(db, user_ids, team_id=team_id)
+            return
+        try:
+            bulk_upsert_tokens(db, updates)
+            for team_id, user_ids in teams.items():
+                bulk_delete_by_user_ids(db, user_ids, team_id=team_id)
+        finally:
+            db.close()
+
+
+def fetch_targets(db: Session, expires_at_lt: datetime, page_size: int = 1000) -> Iterator[Target]:
+    # 再発行が終わるまでdbを閉じないこと
+    for i in iter_tokens(db, expires_at_lt, page_size):
+        yield Target(i.id, i.user_id, i.token, i.team_id)
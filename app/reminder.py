@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+from http import HTTPStatus
+from typing import Callable, Optional
+
+from slack_sdk.errors import SlackApiError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .akashi import Stamp, annotate_stamp_type
+from .async_crud import fetch_token_page
+from .presence import NOT_STARTED, ON_BREAK, WORKING, status_of
+from .refresher import TokenBucket
+from .tenant import TenantRegistry
+from .utils import percentile
+
+logger = logging.getLogger(__name__)
+
+CLOCK_IN = 'clock_in'  # 出勤の打刻がない
+CLOCK_OUT = 'clock_out'  # 退勤の打刻がない
+KINDS = (CLOCK_IN, CLOCK_OUT)
+
+
+def build_message(kind: str, stamp: Optional[Stamp]) -> Optional[str]:
+    # 通知が不要な場合はNone
+    status = status_of(stamp)
+    if kind == CLOCK_IN and status == NOT_STARTED:
+        return 'まだ出勤の打刻がありません。`/akashi`から打刻してください'
+    if kind == CLOCK_OUT and status in (WORKING, ON_BREAK):
+        return f'{stamp.stamped_at:%H:%M}の「{annotate_stamp_type(stamp.type)}」から打刻がありません。'\
+            '勤務を終了した場合は`/akashi`から打刻してください'
+    return None
+
+
+class DirectMessageSender:
+    """
+    DMをワークスペース（Slackのクライアント）ごとに1秒あたりrate件までに制限して送る
+    429が返ってきた場合はRetry-Afterの間、そのワークスペースへの送信をすべて止めてから再送する
+    """
+    def __init__(self, rate: float = 10, max_retries: int = 3):
+        self.rate = rate
+        self.max_retries = max_retries
+        self.rate_limited = 0
+        self._buckets: dict = {}
+        self._resume_at: dict = {}
+
+    async def send(self, client, channel: str, text: str):
+        if client not in self._buckets:
+            self._buckets[client] = TokenBucket(self.rate)
+        attempt = 0
+        while True:
+            delay = self._resume_at.get(client, 0) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._buckets[client].acquire()
+            try:
+                await client.chat_postMessage(channel=channel, text=text)
+                return
+            except SlackApiError as e:
+                if e.response.status_code != HTTPStatus.TOO_MANY_REQUESTS or attempt >= self.max_retries:
+                    raise
+                self.rate_limited += 1
+                headers = e.response.headers
+                retry_after = int(headers.get('Retry-After') or headers.get('retry-after') or 1)
+                self._resume_at[client] = max(self._resume_at.get(client, 0), time.monotonic() + retry_after)
+            attempt += 1
+
+
+class ReminderSummary:
+    def __init__(self):
+        self.users = 0
+        self.checked = 0
+        self.reminded = 0
+        self.skipped = 0
+        self.errors = 0
+        self.elapsed = 0.0
+        self.latencies: list[float] = []
+
+    @property
+    def throughput(self) -> float:
+        return self.checked / self.elapsed if self.elapsed else 0.0
+
+    def progress(self) -> str:
+        return f'{self.checked + self.skipped + self.errors:,}/{self.users:,}人を確認しました'\
+            f'（通知：{self.reminded:,}件、エラー：{self.errors:,}件、{self.elapsed:.1f}秒経過）'
+
+    def __str__(self):
+        return '\n'.join([
+            f'打刻のリマインドが完了しました（対象：{self.users:,}人）',
+            f'通知：{self.reminded:,}件',
+            f'スキップ：{self.skipped:,}件',
+            f'エラー：{self.errors:,}件',
+            f'所要時間：{self.elapsed:.1f}秒（{self.throughput:.1f}人/秒）',
+            'レイテンシ：p50 {:.0f}ms / p95 {:.0f}ms / p99 {:.0f}ms'.format(
+                *(percentile(self.latencies, p) * 1000 for p in (50, 95, 99))),
+        ])
+
+
+class ReminderDispatcher:
+    """
+    登録しているユーザーに、打刻を忘れている場合だけDMを送る
+    ユーザーはpage_size件ずつDBから読み込み、concurrency件まで並行してAKASHIから当日の最後の打刻を取得する
+    キューが空くまで次のページを読まないので、ユーザーが多くてもメモリに載るのは一部だけになる
+    """
+    def __init__(self,
+                 session_factory: Callable[[], AsyncSession],
+                 tenants: TenantRegistry,
+                 sender: DirectMessageSender,
+                 kind: str,
+                 concurrency: int = 20,
+                 rate: float = 20,
+                 page_size: int = 500,
+                 progress_interval: float = 10.0,
+                 on_progress: Optional[Callable[[ReminderSummary], None]] = None):
+        self.session_factory = session_factory
+        self.tenants = tenants
+        self.sender = sender
+        self.kind = kind
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate)
+        self.page_size = page_size
+        self.progress_interval = progress_interval
+        self.on_progress = on_progress or (lambda summary: logger.info(summary.progress()))
+        self.summary = ReminderSummary()
+
+    async def run(self) -> ReminderSummary:
+        started = time.perf_counter()
+        queue: asyncio.Queue = asyncio.Queue(self.concurrency * 2)
+        workers = [asyncio.create_task(self.worker(queue)) for _ in range(self.concurrency)]
+        reporter = asyncio.create_task(self.report(started))
+        try:
+            await self.produce(queue)
+            await queue.join()
+        finally:
+            for task in (*workers, reporter):
+                task.cancel()
+        self.summary.elapsed = time.perf_counter() - started
+        return self.summary
+
+    async def produce(self, queue: asyncio.Queue):
+        after_id = 0
+        while True:
+            async with self.session_factory() as db:
+                rows = await fetch_token_page(db, after_id, self.page_size)
+            for row in rows:
+                await queue.put(row)
+                self.summary.users += 1
+            if len(rows) < self.page_size:
+                return
+            after_id = rows[-1].id
+
+    async def worker(self, queue: asyncio.Queue):
+        while True:
+            row = await queue.get()
+            try:
+                await self.remind(row)
+            except Exception as e:
+                logger.error(e)
+                self.summary.errors += 1
+            finally:
+                queue.task_done()
+
+    async def remind(self, row):
+        tenant = await self.tenants.get(row.team_id)
+        if tenant is None:
+            self.summary.skipped += 1
+            return
+        await self.bucket.acquire()
+        started = time.perf_counter()
+        try:
+            stamp = await tenant.akashi(row.token).fetch_last_stamp()
+        finally:
+            self.summary.latencies.append(time.perf_counter() - started)
+        self.summary.checked += 1
+        text = build_message(self.kind, stamp)
+        if text:
+            await self.sender.send(tenant.slack, row.user_id, text)
+            self.summary.reminded += 1
+
+    async def report(self, started: float):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            self.summary.elapsed = time.perf_counter() - started
+            self.on_progress(self.summary)
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import logging
+import re
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from .akashi import BREAK, CLOCK_IN, CLOCK_OUT, LEAVE_DIRECTLY, RESTART, STRAIGHT_TO, AkashiRequestClient, Stamp
+from .cache import CacheBackend
+from .metrics import REPORT_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = '月火水木金土日'
+USAGE = '`/akashi report [week|month|YYYY-MM]` の形式で入力してください'
+
+
+class InvalidPeriodError(ValueError):
+    pass
+
+
+def parse_period(text: str, today: date) -> tuple[date, date]:
+    """
+    `week`（今週）、`month`（今月）、`YYYY-MM`を期間の初日と最終日に変換する
+    """
+    text = text.strip() or 'week'
+    if text == 'week':
+        date_from = today - timedelta(days=today.weekday())
+        return date_from, date_from + timedelta(days=6)
+    if text == 'month':
+        return month_range(today.year, today.month)
+    if match := re.fullmatch(r'(\d{4})-(\d{1,2})', text):
+        year, month = int(match.group(1)), int(match.group(2))
+        if 1 <= month <= 12:
+            return month_range(year, month)
+    raise InvalidPeriodError(text)
+
+
+def month_range(year: int, month: int) -> tuple[date, date]:
+    date_from = date(year, month, 1)
+    next_month = date(year + month // 12, month % 12 + 1, 1)
+    return date_from, next_month - timedelta(days=1)
+
+
+def days_between(date_from: date, date_to: date) -> list[date]:
+    return [date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+
+
+class DaySummary:
+    __slots__ = ('day', 'clock_in', 'clock_out', 'break_time')
+
+    def __init__(self, day: date, stamps: list[Stamp]):
+        self.day = day
+        self.clock_in: Optional[datetime] = None
+        self.clock_out: Optional[datetime] = None
+        self.break_time = timedelta()
+        break_started_at = None
+        for stamp in sorted(stamps, key=lambda x: x.stamped_at):
+            if stamp.type in (CLOCK_IN, STRAIGHT_TO) and self.clock_in is None:
+                self.clock_in = stamp.stamped_at
+            elif stamp.type in (CLOCK_OUT, LEAVE_DIRECTLY):
+                self.clock_out = stamp.stamped_at
+            elif stamp.type == BREAK:
+                break_started_at = stamp.stamped_at
+            elif stamp.type == RESTART and break_started_at:
+                self.break_time += stamp.stamped_at - break_started_at
+                break_started_at = None
+        if break_started_at and self.clock_out and self.clock_out > break_started_at:
+            # 休憩を終了せずに勤務を終了した場合
+            self.break_time += self.clock_out - break_started_at
+
+    @property
+    def worked_time(self) -> Optional[timedelta]:
+        if self.clock_in is None or self.clock_out is None:
+            return None
+        return self.clock_out - self.clock_in - self.break_time
+
+    def __str__(self):
+        return '{} {}  {} - {}  休憩 {}  労働 {}'.format(
+            self.day.strftime('%m/%d'),
+            WEEKDAYS[self.day.weekday()],
+            format_time(self.clock_in),
+            format_time(self.clock_out),
+            format_duration(self.break_time),
+            format_duration(self.worked_time),
+        )
+
+
+def format_time(value: Optional[datetime]) -> str:
+    return value.strftime('%H:%M') if value else '--:--'
+
+
+def format_duration(value: Optional[timedelta]) -> str:
+    if value is None:
+        return '-:--'
+    minutes = int(value.total_seconds()) // 60
+    return f'{minutes // 60}:{minutes % 60:02d}'
+
+
+def render(date_from: date, date_to: date, summaries: list[DaySummary]) -> str:
+    total = sum((i.worked_time for i in summaries if i.worked_time), timedelta())
+    worked_days = sum(1 for i in summaries if i.worked_time)
+    lines = [str(i) for i in summaries if i.clock_in or i.clock_out]
+    header = f'{date_from:%Y/%m/%d} - {date_to:%Y/%m/%d} の勤務実績'
+    if not lines:
+        return f'{header}\n打刻がありません'
+    footer = f'合計 {format_duration(total)}（{worked_days}日）'
+    return '\n'.join([header, '```', *lines, '```', footer])
+
+
+class DayCache:
+    """
+    ユーザーごとに日単位で打刻をキャッシュする
+    過去の日の打刻は変わらないので期限なしで保存し、当日は毎回AKASHIから取得する
+    """
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+
+    @staticmethod
+    def key(user_id: str, day: date) -> str:
+        return f'stamps:{user_id}:{day.isoformat()}'
+
+    async def get(self, user_id: str, day: date) -> Optional[list[Stamp]]:
+        try:
+            value = await self.backend.get(self.key(user_id, day))
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            value = None
+        REPORT_CACHE_REQUESTS.labels('miss' if value is None else 'hit').inc()
+        if value is None:
+            return None
+        return [Stamp(datetime.fromisoformat(stamped_at), type_) for stamped_at, type_ in json.loads(value)]
+
+    async def set(self, user_id: str, day: date, stamps: list[Stamp]):
+        value = json.dumps([(i.stamped_at.isoformat(), i.type) for i in stamps])
+        try:
+            await self.backend.set(self.key(user_id, day), value)
+        except Exception as e:
+            logger.error(e, exc_info=True)
+
+    async def fetch(self,
+                    user_id: str,
+                    akashi: AkashiRequestClient,
+                    date_from: date,
+                    date_to: date,
+                    today: Optional[date] = None) -> dict[date, list[Stamp]]:
+        today = today or date.today()
+        days = days_between(date_from, min(date_to, today))
+        past = [i for i in days if i < today]
+        cached = await asyncio.gather(*(self.get(user_id, i) for i in past))
+        result = {day: stamps for day, stamps in zip(past, cached) if stamps is not None}
+        # キャッシュにない日と当日をまとめて1回で取得する
+        missing = [i for i in days if i not in result]
+        if not missing:
+            return result
+        res = await akashi.fetch_stamps(missing[0], missing[-1])
+        fetched: dict[date, list[Stamp]] = {i: [] for i in missing}
+        for stamp in res.stamps:
+            if (day := stamp.stamped_at.date()) in fetched:
+                fetched[day].append(stamp)
+        for day, stamps in fetched.items():
+            if day < today:
+                await self.set(user_id, day, stamps)
+        result.update(fetched)
+        return result
+
+
+async def build_report(cache: DayCache,
+                       user_id: str,
+                       akashi: AkashiRequestClient,
+                       text: str,
+                       today: Optional[date] = None) -> str:
+    today = today or date.today()
+    try:
+        date_from, date_to = parse_period(text, today)
+    except InvalidPeriodError:
+        return USAGE
+    if date_from > today:
+        return f'{date_from:%Y/%m/%d} 以降の勤務実績はまだありません'
+    stamps = await cache.fetch(user_id, akashi, date_from, date_to, today)
+    summaries = [DaySummary(day, stamps[day]) for day in sorted(stamps)]
+    return render(date_from, date_to, summaries)
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import zlib
+from contextlib import suppress
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Callable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .akashi import AkashiRequestClient
+from .async_crud import fetch_due_tokens, update_or_create
+from .models import DEFAULT_TEAM, scoped
+from .refresher import Summary, Target, TokenRefresher, is_reissue_retryable
+
+if TYPE_CHECKING:
+    from .tenant import TenantRegistry
+
+logger = logging.getLogger(__name__)
+
+# pg_try_advisory_lockのキー（このアプリのスケジューラーであることを示す任意の値）
+LOCK_KEY = 0x616b617368
+
+
+def offset_of(user_id: str, window: timedelta) -> timedelta:
+    # 一斉に再発行すると次の期限も揃ってしまうので、user_idのハッシュで再発行する時刻をずらす
+    return window * (zlib.crc32(user_id.encode()) / 2**32)
+
+
+def is_due(user_id: str, expires_at: Optional[datetime], now: datetime, lead_time: timedelta,
+           window: timedelta) -> bool:
+    # 期限がわからない（登録したばかりの）トークンはすぐに再発行する
+    if expires_at is None:
+        return True
+    return expires_at - lead_time - window + offset_of(user_id, window) <= now
+
+
+class LocalLeader:
+    """
+    dynoが1台の場合（SQLiteなど）は常にleaderとして扱う
+    """
+    async def acquire(self) -> bool:
+        return True
+
+    async def release(self):
+        pass
+
+
+class AdvisoryLockLeader:
+    """
+    Postgresのadvisory lockを取れたdynoだけをleaderにする
+    ロックはセッションに紐付くので、接続を持ち続け、切れた場合は次の実行時に取り直す
+    """
+    def __init__(self, dsn: str, key: int = LOCK_KEY):
+        self.dsn = dsn
+        self.key = key
+        self.connection = None
+
+    async def acquire(self) -> bool:
+        import asyncpg
+        if self.connection is not None and not self.connection.is_closed():
+            return True
+        try:
+            connection = await asyncpg.connect(self.dsn)
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            return False
+        if await connection.fetchval('SELECT pg_try_advisory_lock($1)', self.key):
+            self.connection = connection
+            return True
+        await connection.close()
+        return False
+
+    async def release(self):
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+
+
+class ReissueScheduler:
+    """
+    トークンの再発行をアプリのプロセス内で行う
+    各トークンはexpires_at - lead_time - windowからexpires_at - lead_timeまでの間の、user_idで決まる時刻に再発行する
+    interval秒ごとに期限の近いトークンをbatch_size件まで取得し、時刻を過ぎたものだけをTokenRefresherで再発行する
+    """
+    def __init__(self,
+                 session_factory: Callable[[], AsyncSession],
+                 refresher_factory: Callable[[], TokenRefresher],
+                 leader=None,
+                 interval: float = 300,
+                 lead_time: timedelta = timedelta(days=2),
+                 window: timedelta = timedelta(days=1),
+                 batch_size: int = 500):
+        self.session_factory = session_factory
+        self.refresher_factory = refresher_factory
+        self.leader = leader or LocalLeader()
+        self.interval = interval
+        self.lead_time = lead_time
+        self.window = window
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+
+    def start(self):
+        if self._task is None:
+            self._running = True
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        self._running = False
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            # 実行中の再発行の書き込みが終わるまで待つ
+            with suppress(asyncio.CancelledError):
+                await task
+        await self.leader.release()
+
+    async def run(self):
+        while True:
+            try:
+                if await self.leader.acquire():
+                    summary = await self.tick()
+                    if summary and summary.total:
+                        logger.info(str(summary))
+            except Exception as e:
+                logger.error(e, exc_info=True)
+            # 止める途中で書き込みに失敗した場合はキャンセルが例外に置き換わるので、フラグでも止める
+            if not self._running:
+                return
+            await asyncio.sleep(self.interval)
+
+    async def tick(self, now: Optional[datetime] = None) -> Optional[Summary]:
+        now = now or datetime.now()
+        async with self.session_factory() as db:
+            rows = await fetch_due_tokens(db, now + self.lead_time + self.window, self.batch_size)
+        targets = [
+            Target(id_, user_id, token, team_id) for id_, team_id, user_id, token, expires_at in rows
+            if is_due(user_id, expires_at, now, self.lead_time, self.window)
+        ]
+        if not targets:
+            return None
+        return await self.refresher_factory().run(targets)
+
+
+class JustInTimeReissuer:
+    """
+    リクエストの処理中に期限切れが近いトークンを見つけた場合に、その場で再発行する
+    失敗した場合は1回だけリトライし、それでも失敗した場合は元のトークンを使う
+    同じユーザーの再発行が同時に行われないように、処理中の再発行を共有する
+    """
+    def __init__(self,
+                 threshold: timedelta = timedelta(hours=1),
+                 retries: int = 1,
+                 tenants: Optional['TenantRegistry'] = None):
+        self.threshold = threshold
+        self.retries = retries
+        self.tenants = tenants
+        self._in_flight: dict[str, asyncio.Task] = {}
+
+    def needs_reissue(self, expires_at: Optional[datetime], now: Optional[datetime] = None) -> bool:
+        return expires_at is not None and expires_at - (now or datetime.now()) < self.threshold
+
+    async def reissue(self, db: AsyncSession, user_id: str, token: str, team_id: str = DEFAULT_TEAM) -> str:
+        key = scoped(team_id, user_id)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._reissue(db, user_id, token, team_id))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _reissue(self, db: AsyncSession, user_id: str, token: str, team_id: str) -> str:
+        if self.tenants:
+            akashi = await self.tenants.akashi(team_id, token)
+        else:
+            akashi = AkashiRequestClient(token)
+        attempt = 0
+        while True:
+            try:
+                response = await akashi.reissue_token()
+                break
+            except Exception as e:
+                # 遮断中や期限切れ（UnavailableError）はリトライしても成功しないので、すぐに元のトークンを使う
+                if attempt >= self.retries or not is_reissue_retryable(e):
+                    logger.error(e)
+                    return token
+            attempt += 1
+        await update_or_create(db, user_id, token=response.token, expires_at=response.expired_at, team_id=team_id)
+        return response.token
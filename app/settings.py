@@ -1,19 +1,116 @@
 from os import environ
+from tempfile import gettempdir
 from typing import Optional
 
 from pydantic import BaseSettings
 
 
 class Settings(BaseSettings):
+    AKASHI_BASE_URL: str = environ.get('AKASHI_BASE_URL', 'https://atnd.ak4.jp/api/cooperation')
     AKASHI_COMPANY_ID: Optional[str] = environ.get('AKASHI_COMPANY_ID')
     SLACK_BOT_TOKEN: Optional[str] = environ.get('SLACK_BOT_TOKEN')
     SLACK_CHANNEL_ID: Optional[str] = environ.get('SLACK_CHANNEL_ID')
     SLACK_SIGNING_SECRET: Optional[str] = environ.get('SLACK_SIGNING_SECRET')
+    SLACK_TEAM_ID: Optional[str] = environ.get('SLACK_TEAM_ID')
+    SLACK_DEFERRED_RESPONSE: bool = environ.get('SLACK_DEFERRED_RESPONSE', False)
+    SLACK_RESPONSE_BUDGET: float = environ.get('SLACK_RESPONSE_BUDGET', 2.5)
+    DEFERRED_MAX_CONCURRENCY: int = environ.get('DEFERRED_MAX_CONCURRENCY', 20)
+    DEFERRED_TIMEOUT: float = environ.get('DEFERRED_TIMEOUT', 20.0)
+    SLACK_MEMBERSHIP_TTL: int = environ.get('SLACK_MEMBERSHIP_TTL', 3600)
+    SLACK_NOTIFY_QUEUE_SIZE: int = environ.get('SLACK_NOTIFY_QUEUE_SIZE', 1000)
+    SLACK_NOTIFY_BATCH_SIZE: int = environ.get('SLACK_NOTIFY_BATCH_SIZE', 50)
+    PRESENCE_CONCURRENCY: int = environ.get('PRESENCE_CONCURRENCY', 20)
+    PRESENCE_TTL: float = environ.get('PRESENCE_TTL', 60)
+    PRESENCE_PROGRESS_INTERVAL: float = environ.get('PRESENCE_PROGRESS_INTERVAL', 1.0)
+
+
+class AdminSettings(BaseSettings):
+    ADMIN_TOKEN: Optional[str] = environ.get('ADMIN_TOKEN')
+    SERVER_TIMING: bool = environ.get('SERVER_TIMING', True)
+    PROFILE_DIR: str = environ.get('PROFILE_DIR', gettempdir())
+    PROFILE_INTERVAL: float = environ.get('PROFILE_INTERVAL', 0.005)
+
+
+class BreakerSettings(BaseSettings):
+    BREAKER_FAILURE_RATE: float = environ.get('BREAKER_FAILURE_RATE', 0.5)
+    BREAKER_WINDOW: int = environ.get('BREAKER_WINDOW', 20)
+    BREAKER_MIN_CALLS: int = environ.get('BREAKER_MIN_CALLS', 10)
+    BREAKER_SLOW_CALL: float = environ.get('BREAKER_SLOW_CALL', 2.0)
+    BREAKER_OPEN_SECONDS: float = environ.get('BREAKER_OPEN_SECONDS', 30)
+
+
+class CacheSettings(BaseSettings):
+    CACHE_BACKEND: str = environ.get('CACHE_BACKEND', 'memory')
+    REDIS_URL: Optional[str] = environ.get('REDIS_URL')
+    STAMP_CACHE_SIZE: int = environ.get('STAMP_CACHE_SIZE', 10000)
+    STAMP_CACHE_RECONCILE_TTL: int = environ.get('STAMP_CACHE_RECONCILE_TTL', 3600)
+    REPORT_CACHE_SIZE: int = environ.get('REPORT_CACHE_SIZE', 100000)
+    TOKEN_CACHE_SIZE: int = environ.get('TOKEN_CACHE_SIZE', 10000)
+    TOKEN_CACHE_TTL: int = environ.get('TOKEN_CACHE_TTL', 600)
+    IDEMPOTENCY_CACHE_SIZE: int = environ.get('IDEMPOTENCY_CACHE_SIZE', 10000)
+    IDEMPOTENCY_TTL: int = environ.get('IDEMPOTENCY_TTL', 300)
+    IDEMPOTENCY_LOCK_TTL: int = environ.get('IDEMPOTENCY_LOCK_TTL', 30)
 
 
 class DataBaseSettings(BaseSettings):
     DATABASE_URL: Optional[str] = environ.get('DATABASE_URL', 'sqlite:///./app.db')
+    DB_POOL_SIZE: int = environ.get('DB_POOL_SIZE', 5)
+    DB_MAX_OVERFLOW: int = environ.get('DB_MAX_OVERFLOW', 5)
+    DB_POOL_TIMEOUT: float = environ.get('DB_POOL_TIMEOUT', 10.0)
+    DB_POOL_RECYCLE: int = environ.get('DB_POOL_RECYCLE', 1800)
+    DB_POOL_PRE_PING: bool = environ.get('DB_POOL_PRE_PING', True)
+
+
+class HTTPSettings(BaseSettings):
+    HTTP_POOL_SIZE: int = environ.get('HTTP_POOL_SIZE', 100)
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = environ.get('HTTP_MAX_KEEPALIVE_CONNECTIONS', 20)
+    HTTP_KEEPALIVE_EXPIRY: float = environ.get('HTTP_KEEPALIVE_EXPIRY', 30.0)
+    HTTP_MAX_CONNECTIONS_PER_HOST: int = environ.get('HTTP_MAX_CONNECTIONS_PER_HOST', 50)
+    HTTP_CONNECT_TIMEOUT: float = environ.get('HTTP_CONNECT_TIMEOUT', 3.0)
+    HTTP_READ_TIMEOUT: float = environ.get('HTTP_READ_TIMEOUT', 10.0)
+
+
+class RefreshSettings(BaseSettings):
+    REFRESH_CONCURRENCY: int = environ.get('REFRESH_CONCURRENCY', 10)
+    REFRESH_RATE_LIMIT: float = environ.get('REFRESH_RATE_LIMIT', 20)
+    REFRESH_MAX_RETRIES: int = environ.get('REFRESH_MAX_RETRIES', 3)
+    REFRESH_BATCH_SIZE: int = environ.get('REFRESH_BATCH_SIZE', 100)
+    REFRESH_SCHEDULER: bool = environ.get('REFRESH_SCHEDULER', True)
+    REFRESH_INTERVAL: float = environ.get('REFRESH_INTERVAL', 300)
+    REFRESH_LEAD_TIME: int = environ.get('REFRESH_LEAD_TIME', 60 * 60 * 48)
+    REFRESH_WINDOW: int = environ.get('REFRESH_WINDOW', 60 * 60 * 24)
+    REFRESH_JIT_THRESHOLD: int = environ.get('REFRESH_JIT_THRESHOLD', 60 * 60)
+
+
+class TenantSettings(BaseSettings):
+    TENANT_CACHE_SIZE: int = environ.get('TENANT_CACHE_SIZE', 100)
+    TENANT_IDLE_TTL: float = environ.get('TENANT_IDLE_TTL', 600)
+    TENANT_POOL_SIZE: int = environ.get('TENANT_POOL_SIZE', 10)
+    TENANT_RATE_LIMIT: float = environ.get('TENANT_RATE_LIMIT', 20)
+
+
+class ReminderSettings(BaseSettings):
+    REMINDER_CONCURRENCY: int = environ.get('REMINDER_CONCURRENCY', 20)
+    REMINDER_RATE_LIMIT: float = environ.get('REMINDER_RATE_LIMIT', 20)
+    REMINDER_SLACK_RATE_LIMIT: float = environ.get('REMINDER_SLACK_RATE_LIMIT', 10)
+    REMINDER_PAGE_SIZE: int = environ.get('REMINDER_PAGE_SIZE', 500)
+    REMINDER_WEEKDAYS: str = environ.get('REMINDER_WEEKDAYS', '0,1,2,3,4')
+
+
+class SyncSettings(BaseSettings):
+    SYNC_CONCURRENCY: int = environ.get('SYNC_CONCURRENCY', 10)
+    SYNC_RATE_LIMIT: float = environ.get('SYNC_RATE_LIMIT', 20)
+    SYNC_LOOKBACK_DAYS: int = environ.get('SYNC_LOOKBACK_DAYS', 30)
+    SYNC_BATCH_SIZE: int = environ.get('SYNC_BATCH_SIZE', 1000)
 
 
 settings = Settings()
+admin_settings = AdminSettings()
+breaker_settings = BreakerSettings()
+cache_settings = CacheSettings()
 db_settings = DataBaseSettings()
+http_settings = HTTPSettings()
+refresh_settings = RefreshSettings()
+reminder_settings = ReminderSettings()
+sync_settings = SyncSettings()
+tenant_settings = TenantSettings()
@@ -0,0 +1,27 @@
+import time
+
+from slack_sdk.web.async_client import AsyncWebClient
+
+from .instrument import LabelCache, outcome_of
+from .metrics import SLACK_API_LATENCY
+from .timing import record
+
+
+class InstrumentedWebClient(AsyncWebClient):
+    """
+    Slack Web APIのメソッドごとの実行時間を記録する
+    """
+    latency = LabelCache(SLACK_API_LATENCY)
+
+    async def api_call(self, api_method: str, *args, **kwargs):
+        started = time.perf_counter()
+        error = None
+        try:
+            return await super().api_call(api_method, *args, **kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.latency(api_method, outcome_of(error)).observe(elapsed)
+            record('slack', elapsed)
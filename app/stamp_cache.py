@@ -0,0 +1,75 @@
+import json
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+from .akashi import AkashiRequestClient, Stamp
+from .cache import CacheBackend
+from .metrics import STAMP_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+def seconds_until_tomorrow(now: datetime) -> float:
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), time())
+    return (tomorrow - now).total_seconds()
+
+
+class StampCache:
+    """
+    ユーザーごとの当日最後の打刻をキャッシュする
+    打刻したときに更新し、日付が変わるかreconcile_ttl秒経つとAKASHIから取得し直す
+    """
+    def __init__(self, backend: CacheBackend, reconcile_ttl: float = 3600):
+        self.backend = backend
+        self.reconcile_ttl = reconcile_ttl
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @staticmethod
+    def key(user_id: str, day: date) -> str:
+        return f'last_stamp:{user_id}:{day.isoformat()}'
+
+    async def get(self, user_id: str, day: Optional[date] = None) -> tuple[bool, Optional[Stamp]]:
+        try:
+            value = await self.backend.get(self.key(user_id, day or date.today()))
+        except Exception as e:
+            # キャッシュが使えない場合はAKASHIから取得する
+            logger.error(e, exc_info=True)
+            value = None
+        if value is None:
+            self.misses += 1
+            STAMP_CACHE_REQUESTS.labels('miss').inc()
+            return False, None
+        self.hits += 1
+        STAMP_CACHE_REQUESTS.labels('hit').inc()
+        data = json.loads(value)
+        if data is None:
+            # 当日の打刻がまだない
+            return True, None
+        return True, Stamp(stamped_at=datetime.fromisoformat(data['stamped_at']), type=data['type'])
+
+    async def set(self, user_id: str, stamp: Optional[Stamp], now: Optional[datetime] = None):
+        now = now or datetime.now()
+        day = stamp.stamped_at.date() if stamp else now.date()
+        if day != now.date():
+            return
+        value = json.dumps({'stamped_at': stamp.stamped_at.isoformat(), 'type': stamp.type} if stamp else None)
+        ttl = min(self.reconcile_ttl, seconds_until_tomorrow(now))
+        try:
+            await self.backend.set(self.key(user_id, day), value, ttl)
+        except Exception as e:
+            logger.error(e, exc_info=True)
+
+    async def fetch_last_stamp(self, user_id: str, akashi: AkashiRequestClient) -> Optional[Stamp]:
+        hit, stamp = await self.get(user_id)
+        if hit:
+            return stamp
+        stamp = await akashi.fetch_last_stamp()
+        await self.set(user_id, stamp)
+        return stamp
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, Awaitable, Callable, Iterable, Iterator, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from .akashi import AkashiRequestClient, FetchedStampResponse
+from .crud import chunked, fetch_high_water_marks, insert_stamps, iter_tokens
+from .models import DEFAULT_TEAM, SOURCE_AKASHI
+from .refresher import TokenBucket, is_retryable
+from .utils import percentile
+
+if TYPE_CHECKING:
+    from .tenant import TenantRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class SyncTarget(NamedTuple):
+    user_id: str
+    token: str
+    team_id: str = DEFAULT_TEAM
+
+
+class SyncSummary:
+    def __init__(self):
+        self.users = 0
+        self.fetched = 0
+        self.inserted = 0
+        self.errors = 0
+        self.retries = 0
+        self.elapsed = 0.0
+        self.latencies: list[float] = []
+
+    @property
+    def throughput(self) -> float:
+        return self.users / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return '\n'.join([
+            f'打刻の同期が完了しました（対象：{self.users:,}人）',
+            f'取得：{self.fetched:,}件',
+            f'追加：{self.inserted:,}件',
+            f'エラー：{self.errors:,}件',
+            f'リトライ：{self.retries:,}回',
+            f'所要時間：{self.elapsed:.1f}秒（{self.throughput:.1f}人/秒）',
+            'レイテンシ：p50 {:.0f}ms / p95 {:.0f}ms / p99 {:.0f}ms'.format(
+                *(percentile(self.latencies, p) * 1000 for p in (50, 95, 99))),
+        ])
+
+
+class StampSyncer:
+    """
+    AKASHIの打刻をstampsテーブルに同期する
+    ユーザーごとに保存済みの最後の打刻の日から取得し、まだ保存していない打刻をbatch_size件ごとにまとめて登録する
+    """
+    def __init__(self,
+                 session_factory: Callable[[], Session],
+                 concurrency: int = 10,
+                 rate: float = 20,
+                 lookback_days: int = 30,
+                 max_retries: int = 3,
+                 backoff: float = 0.5,
+                 batch_size: int = 1000,
+                 page_size: int = 500,
+                 tenants: Optional['TenantRegistry'] = None):
+        self.session_factory = session_factory
+        self.tenants = tenants
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate)
+        self.lookback_days = lookback_days
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.batch_size = batch_size
+        # 保存済みの最後の打刻はpage_size人ずつまとめて取得する
+        self.page_size = page_size
+        self.summary = SyncSummary()
+        self._rows: list[dict] = []
+
+    async def run(self, targets: Iterable[SyncTarget], today: Optional[date] = None) -> SyncSummary:
+        started = time.perf_counter()
+        today = today or date.today()
+        # targetsがジェネレーターの場合は、キューが空いた分だけ読み込む
+        queue: asyncio.Queue = asyncio.Queue(self.concurrency * 2)
+        workers = [asyncio.create_task(self.worker(queue, today)) for _ in range(self.concurrency)]
+        try:
+            for chunk in chunked(targets, self.page_size):
+                marks = self.fetch_marks(chunk)
+                for target in chunk:
+                    await queue.put((target, marks.get((target.team_id, target.user_id))))
+                    self.summary.users += 1
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+        self.flush()
+        self.summary.elapsed = time.perf_counter() - started
+        return self.summary
+
+    def fetch_marks(self, targets: list[SyncTarget]) -> dict[tuple[str, str], datetime]:
+        # ユーザーIDはワークスペースをまたいで同じ場合があるので、ワークスペースごとに取得する
+        teams: dict[str, list[str]] = {}
+        for target in targets:
+            teams.setdefault(target.team_id, []).append(target.user_id)
+        marks = {}
+        db = self.session_factory()
+        try:
+            for team_id, user_ids in teams.items():
+                for user_id, mark in fetch_high_water_marks(db, user_ids, team_id=team_id).items():
+                    marks[(team_id, user_id)] = mark
+        finally:
+            db.close()
+        return marks
+
+    async def worker(self, queue: asyncio.Queue, today: date):
+        while True:
+            target, mark = await queue.get()
+            try:
+                await self.sync(target, mark, today)
+            except Exception as e:
+                logger.error(e, exc_info=True)
+            finally:
+                queue.task_done()
+
+    async def sync(self, target: SyncTarget, mark: Optional[datetime], today: date):
+        # 最後の打刻の日は丸ごと取得し直す（同じ打刻は登録時に無視される）
+        date_from = mark.date() if mark else today - timedelta(days=self.lookback_days)
+        started = time.perf_counter()
+        try:
+            if self.tenants:
+                akashi = await self.tenants.akashi(target.team_id, target.token)
+            else:
+                akashi = AkashiRequestClient(target.token)
+            res: FetchedStampResponse = await self.retry(lambda: akashi.fetch_stamps(date_from, today))
+        except Exception as e:
+            logger.error(e)
+            self.summary.errors += 1
+            return
+        finally:
+            self.summary.latencies.append(time.perf_counter() - started)
+        self.summary.fetched += len(res.stamps)
+        self._rows += [{
+            'team_id': target.team_id,
+            'user_id': target.user_id,
+            'stamped_at': i.stamped_at,
+            'type': i.type,
+            'source': SOURCE_AKASHI,
+        } for i in res.stamps]
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    async def retry(self, call: Callable[[], Awaitable]):
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                return await call()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+            self.summary.retries += 1
+            await asyncio.sleep(random.uniform(0, self.backoff * 2**attempt))
+            attempt += 1
+
+    def flush(self):
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        db = self.session_factory()
+        try:
+            self.summary.inserted += insert_stamps(db, rows)
+        finally:
+            db.close()
+
+
+def fetch_sync_targets(db: Session, page_size: int = 1000) -> Iterator[SyncTarget]:
+    # 同期が終わるまでdbを閉じないこと
+    for i in iter_tokens(db, page_size=page_size):
+        yield SyncTarget(i.user_id, i.token, i.team_id)
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from httpx import AsyncClient
+
+from .akashi import AkashiRequestClient
+from .async_crud import fetch_tenant
+from .db import get_async_sessionmaker
+from .membership import ChannelMembership
+from .metrics import TENANT_EVICTIONS, TENANTS_ACTIVE
+from .models import DEFAULT_TEAM, TenantConfig, scoped
+from .notifier import Notifier
+from .presence import PresenceBoard
+from .refresher import TokenBucket
+from .settings import settings, tenant_settings
+from .transport import LazyWebClient, create_client, create_transport
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownTenantError(LookupError):
+    pass
+
+
+class Tenant:
+    """
+    Slackのワークスペースごとのクライアントと設定
+    AKASHIへのリクエストはワークスペースごとの接続プールとレート制限で送るので、1つのワークスペースが他を待たせない
+    """
+    def __init__(self,
+                 team_id: str,
+                 company_id: Optional[str],
+                 slack,
+                 channel_id: Optional[str] = None,
+                 client: Optional[AsyncClient] = None,
+                 bucket: Optional[TokenBucket] = None,
+                 membership: Optional[ChannelMembership] = None,
+                 notifier: Optional[Notifier] = None,
+                 presence: Optional[PresenceBoard] = None):
+        self.team_id = team_id
+        self.company_id = company_id
+        self.slack = slack
+        self.channel_id = channel_id
+        # Noneの場合はプロセスで共有する接続プール（transport.get_client）を使う
+        self.client = client
+        self.bucket = bucket
+        self.membership = membership or ChannelMembership(slack, ttl=settings.SLACK_MEMBERSHIP_TTL)
+        self.notifier = notifier or Notifier(
+            slack,
+            maxsize=settings.SLACK_NOTIFY_QUEUE_SIZE,
+            batch_size=settings.SLACK_NOTIFY_BATCH_SIZE,
+            membership=self.membership,
+        )
+        self.presence = presence or PresenceBoard(
+            concurrency=settings.PRESENCE_CONCURRENCY,
+            ttl=settings.PRESENCE_TTL,
+            progress_interval=settings.PRESENCE_PROGRESS_INTERVAL,
+        )
+        self.last_used = time.monotonic()
+
+    def __repr__(self):
+        return f'Tenant(team_id={self.team_id!r}, company_id={self.company_id!r})'
+
+    @classmethod
+    def from_settings(cls, **kwargs) -> 'Tenant':
+        # 環境変数で設定したワークスペース
+        slack = kwargs.pop('slack', None) or LazyWebClient(settings.SLACK_BOT_TOKEN)
+        return cls(DEFAULT_TEAM, settings.AKASHI_COMPANY_ID, slack, settings.SLACK_CHANNEL_ID, **kwargs)
+
+    @classmethod
+    def from_config(cls, config: TenantConfig) -> 'Tenant':
+        pool_size = config.pool_size or tenant_settings.TENANT_POOL_SIZE
+        return cls(
+            config.team_id,
+            config.akashi_company_id,
+            LazyWebClient(config.slack_bot_token),
+            config.slack_channel_id,
+            client=create_client(create_transport(max_connections_per_host=pool_size, pool_size=pool_size)),
+            bucket=TokenBucket(config.rate_limit or tenant_settings.TENANT_RATE_LIMIT),
+        )
+
+    def scope(self, user_id: str) -> str:
+        return scoped(self.team_id, user_id)
+
+    def akashi(self, token: str) -> AkashiRequestClient:
+        return AkashiRequestClient(token, client=self.client, company_id=self.company_id, bucket=self.bucket)
+
+    def joined(self) -> bool:
+        if self.channel_id:
+            # 未確認の場合はバックグラウンドで参加しつつ処理を続ける
+            return self.membership.joined(self.channel_id) is not False
+        return True
+
+    def notify(self, text: str):
+        if self.channel_id:
+            self.notifier.notify(self.channel_id, text)
+
+    def start(self):
+        self.notifier.start()
+        if self.channel_id:
+            self.membership.schedule_refresh(self.channel_id)
+
+    async def close(self):
+        await self.notifier.stop()
+        if self.client is not None:
+            await self.client.aclose()
+
+
+class Entry(NamedTuple):
+    tenant: Optional[Tenant]
+    loaded_at: float
+
+
+class TenantRegistry:
+    """
+    team_idからTenantを引く
+    tenantsテーブルから最初に使うときに読み込み、idle_ttl秒使われなかったものとmaxsizeを超えた分は破棄する
+    登録されていないワークスペースはdefault（環境変数の設定）で処理する。team_idを指定した場合はそのワークスペースだけに限る
+    """
+    def __init__(self,
+                 loader: Callable[[str], Awaitable[Optional[TenantConfig]]],
+                 default: Tenant,
+                 team_id: Optional[str] = None,
+                 maxsize: int = 100,
+                 idle_ttl: float = 600):
+        self.loader = loader
+        self.default = default
+        self.team_id = team_id
+        self.maxsize = maxsize
+        self.idle_ttl = idle_ttl
+        self._entries: OrderedDict[str, Entry] = OrderedDict()
+        self._loading: dict[str, asyncio.Task] = {}
+        self._closing: set[asyncio.Task] = set()
+        TENANTS_ACTIVE.set_function(lambda: len(self.loaded()))
+
+    def loaded(self) -> list[Tenant]:
+        return [i.tenant for i in self._entries.values() if self.owns(i.tenant)]
+
+    def owns(self, tenant: Optional[Tenant]) -> bool:
+        return tenant is not None and tenant is not self.default
+
+    async def get(self, team_id: Optional[str]) -> Optional[Tenant]:
+        if not team_id:
+            return self.default
+        now = time.monotonic()
+        self.evict(now)
+        entry = self._entries.get(team_id)
+        if entry is None:
+            task = self._loading.get(team_id)
+            if task is None:
+                task = asyncio.get_running_loop().create_task(self.load(team_id))
+                self._loading[team_id] = task
+                task.add_done_callback(lambda _: self._loading.pop(team_id, None))
+            entry = await asyncio.shield(task)
+        if team_id in self._entries:
+            self._entries.move_to_end(team_id)
+        if entry.tenant is not None:
+            entry.tenant.last_used = now
+        return entry.tenant
+
+    async def akashi(self, team_id: str, token: str) -> AkashiRequestClient:
+        tenant = await self.get(team_id)
+        if tenant is None:
+            raise UnknownTenantError(team_id)
+        return tenant.akashi(token)
+
+    async def load(self, team_id: str) -> Entry:
+        config = await self.loader(team_id)
+        if config is not None:
+            tenant = Tenant.from_config(config)
+            tenant.start()
+        elif self.team_id is None or team_id == self.team_id:
+            tenant = self.default
+        else:
+            logger.warning('unknown team: %s', team_id)
+            tenant = None
+        entry = Entry(tenant, time.monotonic())
+        self._entries[team_id] = entry
+        self.evict(entry.loaded_at)
+        return entry
+
+    def expired(self, entry: Entry, now: float) -> bool:
+        # 未登録のワークスペースは後から登録される場合があるので、読み込んでからidle_ttl秒で読み直す
+        if self.owns(entry.tenant):
+            return now - entry.tenant.last_used > self.idle_ttl
+        return now - entry.loaded_at > self.idle_ttl
+
+    def evict(self, now: float):
+        expired = [team_id for team_id, entry in self._entries.items() if self.expired(entry, now)]
+        while len(self._entries) - len(expired) > self.maxsize:
+            # 最も長く使われていないものから破棄する
+            expired.append(next(i for i in self._entries if i not in expired))
+        for team_id in expired:
+            tenant = self._entries.pop(team_id).tenant
+            if self.owns(tenant):
+                TENANT_EVICTIONS.inc()
+                self.schedule_close(tenant)
+
+    def schedule_close(self, tenant: Tenant):
+        task = asyncio.get_running_loop().create_task(tenant.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def close(self):
+        tenants = self.loaded()
+        self._entries.clear()
+        await asyncio.gather(*(i.close() for i in tenants), *self._closing, return_exceptions=True)
+
+
+async def load_tenant(team_id: str) -> Optional[TenantConfig]:
+    async with get_async_sessionmaker()() as db:
+        return await fetch_tenant(db, team_id)
+
+
+def create_registry(default: Tenant) -> TenantRegistry:
+    return TenantRegistry(
+        load_tenant,
+        default,
+        team_id=settings.SLACK_TEAM_ID,
+        maxsize=tenant_settings.TENANT_CACHE_SIZE,
+        idle_ttl=tenant_settings.TENANT_IDLE_TTL,
+    )
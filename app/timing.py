@@ -0,0 +1,105 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+
+class Timings:
+    """
+    リクエストごとにフェーズ（署名の検証、DB、AKASHI、Slackなど）ごとの所要時間を集計する
+    """
+    __slots__ = ('started', 'phases')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def header(self) -> str:
+        total = time.perf_counter() - self.started
+        items = [f'{phase};dur={seconds * 1000:.1f}' for phase, seconds in self.phases.items()]
+        return ', '.join(items + [f'total;dur={total * 1000:.1f}'])
+
+
+current: ContextVar[Optional[Timings]] = ContextVar('timings', default=None)
+
+
+def record(phase: str, seconds: float):
+    timings = current.get()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+@contextmanager
+def measure(phase: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - started)
+
+
+# 処理を打ち切る時刻（time.perf_counter()の値）
+deadline: ContextVar[Optional[float]] = ContextVar('deadline', default=None)
+
+
+@contextmanager
+def budget(seconds: float, started: Optional[float] = None) -> Iterator[None]:
+    """
+    startedからseconds秒後を期限にする（外側の期限の方が早い場合はそちらを使う）
+    """
+    at = (started or time.perf_counter()) + seconds
+    outer = deadline.get()
+    token = deadline.set(min(at, outer) if outer is not None else at)
+    try:
+        yield
+    finally:
+        deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    at = deadline.get()
+    return at - time.perf_counter() if at is not None else None
+
+
+class ServerTimingMiddleware:
+    """
+    フェーズごとの所要時間をServer-Timingヘッダーで返し、ログにも出力する
+    profilerが有効な場合は、対象のリクエストの間だけサンプリングする
+    """
+    def __init__(self, app: ASGIApp, paths: tuple[str, ...] = ('/slash', '/actions'), header: bool = True,
+                 profiler=None):
+        self.app = app
+        self.paths = paths
+        self.header = header
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or scope['path'] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        timings = Timings()
+        token = current.set(timings)
+        profiled = self.profiler is not None and self.profiler.request_started()
+
+        async def send_wrapper(message: Message):
+            if message['type'] == 'http.response.start':
+                value = timings.header()
+                logger.info('%s %s', scope['path'], value)
+                if self.header:
+                    message['headers'] = list(message.get('headers', [])) + [(b'server-timing', value.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current.reset(token)
+            if profiled:
+                self.profiler.request_finished()
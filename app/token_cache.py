@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from sqlalchemy import func, select
+
+from .cache import LRUCache
+from .metrics import TOKEN_CACHE_EVICTIONS, TOKEN_CACHE_REQUESTS
+from .settings import cache_settings
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'user_tokens'
+# Postgresの通知は8000バイト未満に限られる
+MAX_PAYLOAD_BYTES = 7999
+
+
+class Credential(NamedTuple):
+    token: str
+    expires_at: Optional[datetime]
+
+
+class TokenCache:
+    """
+    user_id（他のワークスペースはmodels.scopedで作るキー）からAPIトークンを引くためのキャッシュ
+    トークンを書き換えたときはcrudから無効化され、他のdynoにはPostgresのNOTIFYで通知される
+    """
+    def __init__(self, maxsize: int = 10000, ttl: float = 600):
+        self.cache = LRUCache(maxsize, ttl)
+
+    def get(self, user_id: str) -> Optional[str]:
+        credential = self.get_credential(user_id)
+        return credential.token if credential else None
+
+    def get_credential(self, user_id: str) -> Optional[Credential]:
+        credential = self.cache.get(user_id)
+        TOKEN_CACHE_REQUESTS.labels('miss' if credential is None else 'hit').inc()
+        return credential
+
+    def set(self, user_id: str, token: str, expires_at: Optional[datetime] = None):
+        evictions = self.cache.evictions
+        self.cache.set(user_id, Credential(token, expires_at))
+        TOKEN_CACHE_EVICTIONS.inc(self.cache.evictions - evictions)
+
+    def invalidate(self, user_ids: Iterable[str]):
+        for user_id in user_ids:
+            self.cache.delete(user_id)
+
+    def clear(self):
+        self.cache.clear()
+
+
+token_cache = TokenCache(cache_settings.TOKEN_CACHE_SIZE, cache_settings.TOKEN_CACHE_TTL)
+
+
+def notify_statement(user_ids: list[str]):
+    # 同じトランザクションで実行するとコミット時に通知される
+    return select(func.pg_notify(CHANNEL, ','.join(user_ids)))
+
+
+def split_payloads(keys: Iterable[str], limit: int = MAX_PAYLOAD_BYTES) -> Iterator[list[str]]:
+    """
+    カンマでつないだ長さがlimitバイト以下になるようにキーを分ける
+    """
+    chunk: list[str] = []
+    size = 0
+    for key in keys:
+        length = len(key.encode())
+        if chunk and size + 1 + length > limit:
+            yield chunk
+            chunk, size = [], 0
+        size += length + (1 if chunk else 0)
+        chunk.append(key)
+    if chunk:
+        yield chunk
+
+
+def notify_statements(keys: Iterable[str]) -> Iterator:
+    for chunk in split_payloads(keys):
+        yield notify_statement(chunk)
+
+
+class TokenCacheListener:
+    """
+    他のdynoでトークンが変更されたらキャッシュを無効化する
+    接続が切れている間の通知は受け取れないので、再接続したときはキャッシュをすべて破棄する
+    """
+    def __init__(self, dsn: str, cache: TokenCache = token_cache, retry_interval: float = 5.0):
+        self.dsn = dsn
+        self.cache = cache
+        self.retry_interval = retry_interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def on_notify(self, connection, pid, channel, payload: str):
+        self.cache.invalidate(payload.split(','))
+
+    async def run(self):
+        # Postgresを使う場合にだけ必要なので、起動時には読み込まない
+        import asyncpg
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                await connection.add_listener(CHANNEL, self.on_notify)
+                self.cache.clear()
+                await closed.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(e, exc_info=True)
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            await asyncio.sleep(self.retry_interval)
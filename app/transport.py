@@ -0,0 +1,141 @@
+import asyncio
+from typing import Optional
+
+from httpx import AsyncClient, AsyncHTTPTransport, Limits, Request, Response, Timeout
+
+from .metrics import HTTP_POOL_HANDSHAKES, HTTP_POOL_REQUESTS
+from .settings import http_settings
+
+
+class PoolStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.handshakes = 0
+
+    def __repr__(self):
+        return f'PoolStats(hits={self.hits}, misses={self.misses}, handshakes={self.handshakes})'
+
+
+class PooledTransport(AsyncHTTPTransport):
+    """
+    ホストごとの同時接続数を制限し、コネクションの再利用状況を記録するトランスポート
+    """
+    def __init__(self, max_connections_per_host: Optional[int] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.max_connections_per_host = max_connections_per_host
+        self.stats = PoolStats()
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+
+    def semaphore(self, host: str) -> Optional[asyncio.Semaphore]:
+        if not self.max_connections_per_host:
+            return None
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.max_connections_per_host)
+        return self._semaphores[host]
+
+    async def handle_async_request(self, request: Request) -> Response:
+        host = request.url.host
+        connected = False
+
+        async def trace(event_name: str, info: dict):
+            nonlocal connected
+            if event_name == 'connection.connect_tcp.started':
+                connected = True
+            elif event_name == 'connection.start_tls.started':
+                self.stats.handshakes += 1
+                HTTP_POOL_HANDSHAKES.labels(host).inc()
+
+        request.extensions['trace'] = trace
+        semaphore = self.semaphore(host)
+        if semaphore:
+            async with semaphore:
+                response = await super().handle_async_request(request)
+        else:
+            response = await super().handle_async_request(request)
+        if connected:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+        HTTP_POOL_REQUESTS.labels(host, 'miss' if connected else 'hit').inc()
+        return response
+
+
+def create_transport(max_connections_per_host: Optional[int] = None,
+                     pool_size: Optional[int] = None,
+                     **kwargs) -> PooledTransport:
+    pool_size = pool_size or http_settings.HTTP_POOL_SIZE
+    return PooledTransport(
+        max_connections_per_host=max_connections_per_host or http_settings.HTTP_MAX_CONNECTIONS_PER_HOST,
+        limits=Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=min(pool_size, http_settings.HTTP_MAX_KEEPALIVE_CONNECTIONS),
+            keepalive_expiry=http_settings.HTTP_KEEPALIVE_EXPIRY,
+        ),
+        **kwargs,
+    )
+
+
+def create_client(transport: Optional[PooledTransport] = None) -> AsyncClient:
+    timeout = Timeout(
+        connect=http_settings.HTTP_CONNECT_TIMEOUT,
+        read=http_settings.HTTP_READ_TIMEOUT,
+        write=http_settings.HTTP_READ_TIMEOUT,
+        pool=http_settings.HTTP_CONNECT_TIMEOUT,
+    )
+    return AsyncClient(transport=transport or create_transport(), timeout=timeout)
+
+
+_client: Optional[AsyncClient] = None
+_stats = PoolStats()
+
+
+def get_client() -> AsyncClient:
+    # 接続プールを使い回すためプロセス内で一つのクライアントを共有する
+    global _client
+    if _client is None or _client.is_closed:
+        transport = create_transport()
+        transport.stats = _stats
+        _client = create_client(transport)
+    return _client
+
+
+def pool_stats() -> PoolStats:
+    return _stats
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+class LazyWebClient:
+    """
+    最初にメソッドを呼んだときにSlackのクライアントを作る
+    slack_sdkの非同期クライアントはaiohttpを読み込むので、起動時には読み込まない
+    """
+    def __init__(self, token: Optional[str]):
+        self.token = token
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from .slack_client import InstrumentedWebClient
+            self._client = InstrumentedWebClient(self.token)
+        return self._client
+
+    def __getattr__(self, name: str):
+        return getattr(self.client, name)
+
+    # base_urlの変更やテストでのpatchはクライアントに反映する
+    def __setattr__(self, name: str, value):
+        if name in ('token', '_client'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.client, name, value)
+
+    def __delattr__(self, name: str):
+        delattr(self.client, name)
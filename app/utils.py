@@ -0,0 +1,6 @@
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, round(p / 100 * (len(values) - 1)))
+    return values[index]
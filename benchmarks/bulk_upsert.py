@@ -0,0 +1,64 @@
+"""
+SQLiteで1件ずつのupdate_or_createとbulk_upsert_tokensの所要時間を比較する
+
+python -m benchmarks.bulk_upsert --rows 50000
+"""
+import argparse
+import tempfile
+import time
+from datetime import datetime, timedelta
+from os import path
+from uuid import uuid4
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.crud import bulk_upsert_tokens, create, fetch, update
+from app.db import Base
+
+
+def per_row(db, rows: list[dict]):
+    # 変更前のupdate_or_createと同じくSELECTしてから1件ずつコミットする
+    for row in rows:
+        instance = fetch(db, row['user_id'])
+        if instance:
+            update(db, instance, row['token'], row['expires_at'])
+        else:
+            create(db, row['user_id'], row['token'], row['expires_at'])
+
+
+def bulk(db, rows: list[dict]):
+    bulk_upsert_tokens(db, rows)
+
+
+def measure(directory: str, label: str, func, rows: list[dict]):
+    engine = create_engine(f'sqlite:///{path.join(directory, label)}.db')
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    result = []
+    # 1回目は作成、2回目は更新
+    for phase in ('insert', 'update'):
+        started = time.perf_counter()
+        func(db, rows)
+        result.append(f'{phase} {time.perf_counter() - started:7.2f}s')
+        rows = [dict(row, token=str(uuid4())) for row in rows]
+    db.close()
+    engine.dispose()
+    print(f'{label:<10}', ' / '.join(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=50000)
+    args = parser.parse_args()
+
+    expires_at = datetime.now() + timedelta(days=30)
+    rows = [{'user_id': f'U{i:010d}', 'token': str(uuid4()), 'expires_at': expires_at} for i in range(args.rows)]
+    print(f'rows: {args.rows:,}')
+    with tempfile.TemporaryDirectory() as directory:
+        measure(directory, 'bulk', bulk, rows)
+        measure(directory, 'per_row', per_row, rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+10,000件の打刻を含むレスポンスのデコード時間を、変更前のpydanticとdateutilによる処理と比較する
+
+python -m benchmarks.decode_stamps --stamps 10000
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+import orjson
+from dateutil.parser import parse
+from pydantic import BaseModel, validator
+
+from app.akashi import CLOCK_IN, CLOCK_OUT, AkashiAPIResponse, FetchedStampResponse
+
+
+class LegacyAPIResponse(BaseModel):
+    success: bool
+    response: Optional[dict]
+    code: Optional[str]
+    message: Optional[str]
+
+
+class LegacyStamp(BaseModel):
+    stamped_at: datetime
+    type: int
+
+    @validator('stamped_at', pre=True)
+    @classmethod
+    def parse_stamped_at(cls, value):
+        return value if isinstance(value, datetime) else parse(value)
+
+
+class LegacyFetchedStampResponse(BaseModel):
+    count: int
+    stamps: list[LegacyStamp]
+
+
+def before(content: bytes):
+    return LegacyFetchedStampResponse(**LegacyAPIResponse(**json.loads(content)).response)
+
+
+def after(content: bytes):
+    return FetchedStampResponse.decode(AkashiAPIResponse.decode(orjson.loads(content)).response)
+
+
+def build(count: int) -> bytes:
+    started_at = datetime(2021, 1, 1, 9)
+    stamps = [{
+        'stamped_at': (started_at + timedelta(hours=i)).strftime('%Y/%m/%d %H:%M:%S'),
+        'type': CLOCK_IN if i % 2 == 0 else CLOCK_OUT,
+    } for i in range(count)]
+    return json.dumps({'success': True, 'response': {'count': count, 'stamps': stamps}}).encode()
+
+
+def measure(label: str, func, content: bytes, repeat: int) -> float:
+    elapsed = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(content)
+        elapsed.append(time.perf_counter() - started)
+    best = min(elapsed)
+    print(f'{label:<7} {best * 1000:8.1f}ms')
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stamps', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    content = build(args.stamps)
+    assert [(i.stamped_at, i.type) for i in before(content).stamps] == \
+        [(i.stamped_at, i.type) for i in after(content).stamps]
+    print(f'stamps: {args.stamps:,} ({len(content):,} bytes)')
+    slow = measure('before', before, content, args.repeat)
+    fast = measure('after', after, content, args.repeat)
+    print(f'speedup {slow / fast:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
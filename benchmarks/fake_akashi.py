@@ -0,0 +1,117 @@
+import asyncio
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+from uuid import uuid4
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+DATETIME_FORMAT = '%Y/%m/%d %H:%M:%S'
+
+
+def create_app(latency: float = 0.05,
+               error_rate: float = 0.0,
+               api_error_rate: float = 0.0,
+               generate_stamps: bool = False) -> Starlette:
+    """
+    AKASHIの公開APIを模したサーバー
+    latency秒だけ応答を遅らせ、error_rateの割合で503を、api_error_rateの割合でAPIエラーを返す
+    generate_stampsの場合は、打刻の取得で期間内の平日ごとに4件の打刻を返す
+    """
+    async def inject():
+        return await inject_error(latency, error_rate, api_error_rate)
+
+    async def stamp(request: Request):
+        if error := await inject():
+            return error
+        form = await request.form()
+        return JSONResponse({
+            'success': True,
+            'response': {
+                'stampedAt': datetime.now().strftime(DATETIME_FORMAT),
+                'type': int(form['type'])
+            }
+        })
+
+    async def stamps(request: Request):
+        if error := await inject():
+            return error
+        stamps = []
+        if generate_stamps:
+            stamps = generate(datetime.strptime(request.query_params['start_date'], '%Y%m%d%H%M%S'),
+                              min(datetime.strptime(request.query_params['end_date'], '%Y%m%d%H%M%S'), datetime.now()))
+        return JSONResponse({'success': True, 'response': {'count': len(stamps), 'stamps': stamps}})
+
+    async def reissue(request: Request):
+        if error := await inject():
+            return error
+        return JSONResponse({
+            'success': True,
+            'response': {
+                'token': str(uuid4()),
+                'expired_at': (datetime.now() + timedelta(days=30)).strftime(DATETIME_FORMAT)
+            }
+        })
+
+    return Starlette(routes=[
+        Route('/api/cooperation/token/reissue/{company_id}', reissue, methods=['POST']),
+        Route('/api/cooperation/{company_id}/stamps', stamp, methods=['POST']),
+        Route('/api/cooperation/{company_id}/stamps', stamps, methods=['GET']),
+    ])
+
+
+async def inject_error(latency: float, error_rate: float, api_error_rate: float) -> Optional[Response]:
+    await asyncio.sleep(latency)
+    if random.random() < error_rate:
+        return Response(status_code=503)
+    if random.random() < api_error_rate:
+        return JSONResponse({'success': False, 'errors': [], 'code': 'AUTH', 'message': 'invalid token'})
+    return None
+
+
+def generate(start: datetime, end: datetime) -> list[dict]:
+    # 平日の9時に出勤、12時から13時まで休憩、18時に退勤
+    stamps = []
+    day = start.replace(hour=0, minute=0, second=0)
+    while day <= end:
+        if day.weekday() < 5:
+            stamps += [{
+                'stamped_at': (day + timedelta(hours=hour)).strftime(DATETIME_FORMAT),
+                'type': type_
+            } for hour, type_ in ((9, 11), (12, 31), (13, 32), (18, 12)) if day + timedelta(hours=hour) <= end]
+        day += timedelta(days=1)
+    return stamps
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def serve(app, **kwargs) -> Iterator[str]:
+    """
+    別スレッドでuvicornを起動し、ベースURLを返す
+    """
+    port = free_port()
+    config = uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning', **kwargs)
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    scheme = 'https' if kwargs.get('ssl_certfile') else 'http'
+    try:
+        yield f'{scheme}://127.0.0.1:{port}'
+    finally:
+        server.should_exit = True
+        thread.join()
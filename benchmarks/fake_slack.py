@@ -0,0 +1,37 @@
+import asyncio
+import random
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+
+def create_app(latency: float = 0.02, error_rate: float = 0.0, rate_limit_rate: float = 0.0) -> Starlette:
+    """
+    Slack Web APIを模したサーバー
+    latency秒だけ応答を遅らせ、error_rateの割合で`ok: false`を、rate_limit_rateの割合で429を返す
+    """
+    calls: dict[str, int] = {}
+
+    async def api(request: Request):
+        method = request.path_params['method']
+        calls[method] = calls.get(method, 0) + 1
+        await asyncio.sleep(latency)
+        if random.random() < rate_limit_rate:
+            return JSONResponse({'ok': False, 'error': 'ratelimited'}, status_code=429, headers={'Retry-After': '1'})
+        if random.random() < error_rate:
+            return JSONResponse({'ok': False, 'error': 'internal_error'})
+        return JSONResponse({'ok': True, 'channel': {'id': 'C0000000000', 'is_member': True}, 'ts': '1.000000'})
+
+    async def response_url(request: Request):
+        calls['response_url'] = calls.get('response_url', 0) + 1
+        await asyncio.sleep(latency)
+        return JSONResponse({'ok': True})
+
+    app = Starlette(routes=[
+        Route('/api/{method}', api, methods=['GET', 'POST']),
+        Route('/response/{id}', response_url, methods=['POST']),
+    ])
+    app.state.calls = calls
+    return app
@@ -0,0 +1,125 @@
+"""
+/slashと/actionsの典型的なボディについて、署名の検証とパースにかかるリクエストあたりの時間を比較する
+
+python -m benchmarks.ingest --requests 20000
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import urlencode
+
+from slack_sdk.signature import SignatureVerifier
+from starlette.requests import Request
+
+from app.ingest import SlackIngestMiddleware
+
+SECRET = 'benchmark-secret'
+
+SLASH_BODY = urlencode({
+    'token': 'gIkuvaNzQIHg97ATvDxqgjtO',
+    'team_id': 'T0001',
+    'team_domain': 'example',
+    'channel_id': 'C2147483705',
+    'channel_name': 'test',
+    'user_id': 'U2147483697',
+    'user_name': 'Steve',
+    'command': '/akashi',
+    'text': '',
+    'response_url': 'https://hooks.slack.com/commands/1234/5678',
+    'trigger_id': '13345224609.738474920.8088930838d88f008e0',
+}).encode()
+
+ACTIONS_BODY = urlencode({
+    'payload': json.dumps({
+        'type': 'interactive_message',
+        'actions': [{'name': 'stamp', 'type': 'button', 'value': '11'}],
+        'callback_id': 'stamp',
+        'team': {'id': 'T0001', 'domain': 'example'},
+        'channel': {'id': 'C2147483705', 'name': 'test'},
+        'user': {'id': 'U2147483697', 'name': 'Steve'},
+        'action_ts': '1458170917.164398',
+        'message_ts': '1458170866.000004',
+        'attachment_id': '1',
+        'token': 'xAB3yVzGS4BQ3O9FACTa8Ho4',
+        'response_url': 'https://hooks.slack.com/actions/T0001/123/xyz',
+        'trigger_id': '13345224609.738474920.8088930838d88f008e0',
+    })
+}).encode()
+
+
+def make_scope(path: str, body: bytes) -> dict:
+    timestamp = str(int(time.time()))
+    signature = 'v0=' + hmac.new(SECRET.encode(), f'v0:{timestamp}:'.encode() + body, hashlib.sha256).hexdigest()
+    return {
+        'type': 'http',
+        'method': 'POST',
+        'path': path,
+        'query_string': b'',
+        'headers': [
+            (b'host', b'example.herokuapp.com'),
+            (b'user-agent', b'Slackbot 1.0 (+https://api.slack.com/robots)'),
+            (b'accept', b'application/json,*/*'),
+            (b'accept-encoding', b'gzip,deflate'),
+            (b'content-type', b'application/x-www-form-urlencoded'),
+            (b'content-length', str(len(body)).encode()),
+            (b'x-slack-request-timestamp', timestamp.encode()),
+            (b'x-slack-signature', signature.encode()),
+        ],
+    }
+
+
+def make_receive(body: bytes):
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    return receive
+
+
+async def send(message):
+    pass
+
+
+async def before(scope: dict, body: bytes):
+    # 変更前のverify_signatureとハンドラーの処理
+    request = Request(scope, make_receive(body))
+    verifier = SignatureVerifier(SECRET)
+    assert verifier.is_valid_request(await request.body(), dict(request.headers))
+    form = await request.form()
+    if 'payload' in form:
+        json.loads(form['payload'])
+
+
+async def handler(scope, receive, send):
+    assert scope['state']['verified']
+
+
+async def measure(label: str, path: str, body: bytes, requests: int):
+    scope = make_scope(path, body)
+    middleware = SlackIngestMiddleware(handler, SECRET)
+    results = []
+    for name in ('before', 'after'):
+        started = time.perf_counter()
+        for _ in range(requests):
+            if name == 'before':
+                await before(dict(scope), body)
+            else:
+                await middleware(dict(scope), make_receive(body), send)
+        results.append(f'{name} {(time.perf_counter() - started) / requests * 1e6:6.1f}us')
+    print(f'{label:<8}', ' / '.join(results))
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f'requests: {args.requests:,}')
+    await measure('/slash', '/slash', SLASH_BODY, args.requests)
+    await measure('/actions', '/actions', ACTIONS_BODY, args.requests)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""
+メトリクスの記録にかかる1回あたりのコストを計測する
+
+python -m benchmarks.instrument_overhead --calls 200000
+"""
+import argparse
+import asyncio
+import time
+
+from app.akashi import akashi_method
+from app.instrument import RouteTimingMiddleware, query
+
+
+def plain():
+    return None
+
+
+async def plain_async():
+    return None
+
+
+async def app(scope, receive, send):
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+class App:
+    routes = []
+
+
+async def receive():
+    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+
+async def send(message):
+    pass
+
+
+def measure_sync(func, calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - started) / calls
+
+
+async def measure_async(func, calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        await func()
+    return (time.perf_counter() - started) / calls
+
+
+async def measure_asgi(asgi, calls: int) -> float:
+    scope = {'type': 'http', 'method': 'POST', 'path': '/slash', 'app': App()}
+    started = time.perf_counter()
+    for _ in range(calls):
+        await asgi(scope, receive, send)
+    return (time.perf_counter() - started) / calls
+
+
+def report(label: str, before: float, after: float):
+    print(f'{label:<16} plain {before * 1e9:7.0f}ns / instrumented {after * 1e9:7.0f}ns '
+          f'(+{(after - before) * 1e9:.0f}ns)')
+
+
+async def main(calls: int):
+    report('crud (sync)', measure_sync(plain, calls), measure_sync(query(plain), calls))
+    report('crud (async)', await measure_async(plain_async, calls), await measure_async(query(plain_async), calls))
+    report('akashi method', await measure_async(plain_async, calls),
+           await measure_async(akashi_method('benchmark')(plain_async), calls))
+    report('route', await measure_asgi(app, calls), await measure_asgi(RouteTimingMiddleware(app), calls))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=200000)
+    args = parser.parse_args()
+    asyncio.run(main(args.calls))
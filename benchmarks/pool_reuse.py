@@ -0,0 +1,82 @@
+"""
+TLSのAKASHIスタブに対して、リクエストごとにクライアントを作る場合と共有プールを使う場合のハンドシェイク回数を比較する
+
+python -m benchmarks.pool_reuse --requests 500 --concurrency 20
+"""
+import argparse
+import asyncio
+import subprocess
+import tempfile
+import time
+from os import path
+from uuid import uuid4
+
+from app.akashi import AkashiRequestClient
+from app.transport import PoolStats, create_client, create_transport
+from benchmarks.fake_akashi import create_app, serve
+
+
+def generate_certificate(directory: str) -> tuple[str, str]:
+    certfile = path.join(directory, 'cert.pem')
+    keyfile = path.join(directory, 'key.pem')
+    subprocess.run(
+        [
+            'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=127.0.0.1',
+            '-addext', 'subjectAltName=IP:127.0.0.1', '-keyout', keyfile, '-out', certfile
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return certfile, keyfile
+
+
+async def reissue(base_url: str, semaphore: asyncio.Semaphore, stats: PoolStats, certfile: str, shared=None):
+    async with semaphore:
+        if shared:
+            client = shared
+        else:
+            transport = create_transport(verify=certfile)
+            transport.stats = stats
+            client = create_client(transport)
+        akashi = AkashiRequestClient(str(uuid4()), client=client)
+        akashi.base_url = f'{base_url}/api/cooperation'
+        await akashi.reissue_token()
+        if not shared:
+            await client.aclose()
+
+
+async def run(base_url: str, certfile: str, requests: int, concurrency: int, pooled: bool) -> PoolStats:
+    stats = PoolStats()
+    semaphore = asyncio.Semaphore(concurrency)
+    shared = None
+    if pooled:
+        transport = create_transport(verify=certfile)
+        transport.stats = stats
+        shared = create_client(transport)
+    await asyncio.gather(*(reissue(base_url, semaphore, stats, certfile, shared) for _ in range(requests)))
+    if shared:
+        await shared.aclose()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.01)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = generate_certificate(directory)
+        app = create_app(latency=args.latency)
+        with serve(app, ssl_certfile=certfile, ssl_keyfile=keyfile) as base_url:
+            for label, pooled in (('client per request', False), ('shared pool', True)):
+                started = time.perf_counter()
+                stats = asyncio.run(run(base_url, certfile, args.requests, args.concurrency, pooled))
+                elapsed = time.perf_counter() - started
+                print(f'{label:<20} handshakes={stats.handshakes:>5,} hits={stats.hits:>5,} '
+                      f'misses={stats.misses:>5,} elapsed={elapsed:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+ローカルのAKASHIスタブに対して、/akashi whoの集計を1件ずつ実行した場合と並行して実行した場合を比較する
+
+python -m benchmarks.presence --users 300
+"""
+import argparse
+import asyncio
+import time
+from uuid import uuid4
+
+from app.akashi import AkashiRequestClient
+from app.presence import PresenceBoard, status_of
+from app.transport import close_client
+from benchmarks.fake_akashi import create_app, serve
+
+
+async def fetch(user_id: str, token: str):
+    return await AkashiRequestClient(token).fetch_last_stamp()
+
+
+async def sequential(targets: list[tuple[str, str]]) -> float:
+    started = time.perf_counter()
+    for user_id, token in targets:
+        status_of(await fetch(user_id, token))
+    return time.perf_counter() - started
+
+
+async def fan_out(targets: list[tuple[str, str]], concurrency: int) -> tuple[float, float, float]:
+    board = PresenceBoard(concurrency=concurrency, progress_interval=0.5)
+    first = None
+
+    async def load_targets():
+        return targets
+
+    async def respond(message):
+        nonlocal first
+        first = first or time.perf_counter() - started
+
+    started = time.perf_counter()
+    snapshot = await board.collect(load_targets, fetch)
+    await board.stream(snapshot, respond)
+    elapsed = time.perf_counter() - started
+    # 2回目はスナップショットを使い回す
+    cached = time.perf_counter()
+    board.fresh().render()
+    return first, elapsed, time.perf_counter() - cached
+
+
+async def run(args):
+    targets = [(f'U{i:010d}', str(uuid4())) for i in range(args.users)]
+    if not args.skip_sequential:
+        print(f'sequential:            {await sequential(targets):.2f}s')
+    first, elapsed, cached = await fan_out(targets, args.concurrency)
+    print(f'fan-out (concurrency {args.concurrency}): {elapsed:.2f}s (first message {first:.2f}s)')
+    print(f'cached snapshot:       {cached * 1000:.2f}ms')
+    await close_client()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.1, help='AKASHIスタブの応答遅延（秒）')
+    parser.add_argument('--skip-sequential', action='store_true')
+    args = parser.parse_args()
+
+    with serve(create_app(latency=args.latency)) as base_url:
+        AkashiRequestClient.base_url = f'{base_url}/api/cooperation'
+        asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
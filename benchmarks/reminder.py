@@ -0,0 +1,109 @@
+"""
+ローカルのAKASHIとSlackのスタブに対して打刻のリマインドを送り、1人ずつ順に処理した場合と所要時間を比べる
+
+python -m benchmarks.reminder --users 5000
+python -m benchmarks.reminder --users 5000 --rate-limit-rate 0.05   # Slackが一部のDMに429を返す
+"""
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+from datetime import datetime
+from os import path
+from uuid import uuid4
+
+from slack_sdk.web.async_client import AsyncWebClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from app.akashi import AkashiRequestClient
+from app.db import Base
+from app.models import UserToken
+from app.reminder import CLOCK_IN, DirectMessageSender, ReminderDispatcher, build_message
+from app.tenant import Tenant, TenantRegistry
+from app.transport import close_client
+from benchmarks import fake_akashi, fake_slack
+from benchmarks.fake_akashi import serve
+
+SAMPLE = 100
+
+
+def prepare(database: str, users: int) -> sessionmaker:
+    engine = create_engine(f'sqlite:///{database}')
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    db.bulk_insert_mappings(UserToken, [{
+        'user_id': f'U{i:010d}',
+        'token': str(uuid4()),
+        'created_at': datetime.now()
+    } for i in range(users)])
+    db.commit()
+    db.close()
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{database}', poolclass=NullPool)
+    return sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def naive(AsyncSessionLocal: sessionmaker, tenant: Tenant) -> float:
+    # 全員を読み込み、1人ずつ打刻を取得してDMを送る。SAMPLE人だけ処理して1人あたりの時間を返す
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(UserToken.__table__.select())).all()
+    started = time.perf_counter()
+    for row in rows[:SAMPLE]:
+        stamp = await tenant.akashi(row.token).fetch_last_stamp()
+        if text := build_message(CLOCK_IN, stamp):
+            await tenant.slack.chat_postMessage(channel=row.user_id, text=text)
+    return (time.perf_counter() - started) / min(SAMPLE, len(rows))
+
+
+async def no_tenant(team_id: str):
+    return None
+
+
+async def run(AsyncSessionLocal: sessionmaker, slack_url: str, args):
+    tenant = Tenant.from_settings(slack=AsyncWebClient('xoxb-benchmark', base_url=f'{slack_url}/api/'))
+    tenants = TenantRegistry(no_tenant, tenant)
+    per_user = await naive(AsyncSessionLocal, tenant)
+    dispatcher = ReminderDispatcher(
+        AsyncSessionLocal,
+        tenants,
+        DirectMessageSender(rate=args.slack_rate),
+        CLOCK_IN,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        page_size=args.page_size,
+        progress_interval=1.0,
+        on_progress=lambda summary: print(summary.progress(), flush=True),
+    )
+    summary = await dispatcher.run()
+    print(summary)
+    print(f'Slackの429：{dispatcher.sender.rate_limited:,}件')
+    print(f'1人ずつ処理した場合の見込み：{per_user * summary.users:.1f}秒（{SAMPLE}人の平均から推定）')
+    await close_client()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=1000, help='AKASHIへのリクエスト数の上限（件/秒）')
+    parser.add_argument('--slack-rate', type=float, default=1000, help='Slackへの送信数の上限（件/秒）')
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--akashi-latency', type=float, default=0.05, help='AKASHIスタブの応答遅延（秒）')
+    parser.add_argument('--slack-latency', type=float, default=0.02, help='Slackスタブの応答遅延（秒）')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Slackスタブが429を返す割合')
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as directory:
+        AsyncSessionLocal = prepare(path.join(directory, 'bench.db'), args.users)
+        slack_app = fake_slack.create_app(latency=args.slack_latency, rate_limit_rate=args.rate_limit_rate)
+        with serve(fake_akashi.create_app(latency=args.akashi_latency)) as akashi_url, serve(slack_app) as slack_url:
+            AkashiRequestClient.base_url = f'{akashi_url}/api/cooperation'
+            asyncio.run(run(AsyncSessionLocal, slack_url, args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+ローカルのAKASHIスタブに対して同時に打刻リクエストを送り、レイテンシを計測する
+
+python -m benchmarks.stamp_load --concurrency 200 --latency 0.05
+"""
+import argparse
+import asyncio
+import time
+from uuid import uuid4
+
+from app.akashi import CLOCK_IN, AkashiRequestClient
+from app.transport import close_client
+from app.utils import percentile
+from benchmarks.fake_akashi import create_app, serve
+
+
+async def stamp(base_url: str) -> float:
+    akashi = AkashiRequestClient(str(uuid4()))
+    akashi.base_url = f'{base_url}/api/cooperation'
+    started = time.perf_counter()
+    await akashi.stamp(CLOCK_IN)
+    return time.perf_counter() - started
+
+
+async def run(base_url: str, concurrency: int) -> list[float]:
+    # 1回目はコネクションの確立を含むので捨てる
+    await stamp(base_url)
+    latencies = await asyncio.gather(*(stamp(base_url) for _ in range(concurrency)))
+    await close_client()
+    return list(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05, help='AKASHIスタブの応答遅延（秒）')
+    args = parser.parse_args()
+
+    with serve(create_app(latency=args.latency)) as base_url:
+        started = time.perf_counter()
+        latencies = asyncio.run(run(base_url, args.concurrency))
+        elapsed = time.perf_counter() - started
+
+    print(f'requests: {len(latencies):,} '
+          f'(concurrency {args.concurrency}, upstream latency {args.latency * 1000:.0f}ms)')
+    print(f'elapsed:  {elapsed:.3f}s')
+    for p in (50, 95, 99):
+        print(f'p{p}:      {percentile(latencies, p) * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+ローカルのAKASHIスタブから打刻を同期し、初回と2回目（差分のみ）のスループットを表示する
+
+python -m benchmarks.stamp_sync --users 1000 --days 30
+"""
+import argparse
+import asyncio
+import logging
+import tempfile
+from datetime import datetime
+from os import path
+from uuid import uuid4
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from app.akashi import AkashiRequestClient
+from app.db import Base
+from app.models import UserStamp, UserToken
+from app.syncer import StampSyncer, fetch_sync_targets
+from app.transport import close_client
+from benchmarks.fake_akashi import create_app, serve
+
+
+def prepare(database_url: str, users: int) -> sessionmaker:
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+    SessionLocal = sessionmaker(bind=engine)
+    db = SessionLocal()
+    db.bulk_insert_mappings(UserToken, [{
+        'user_id': f'U{i:010d}',
+        'token': str(uuid4()),
+        'created_at': datetime.now()
+    } for i in range(users)])
+    db.commit()
+    db.close()
+    return SessionLocal
+
+
+async def run(SessionLocal: sessionmaker, args):
+    db = SessionLocal()
+    syncer = StampSyncer(
+        SessionLocal,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        lookback_days=args.days,
+        backoff=0.05,
+        batch_size=args.batch_size,
+    )
+    summary = await syncer.run(fetch_sync_targets(db))
+    db.close()
+    return summary
+
+
+async def sync_twice(SessionLocal: sessionmaker, args):
+    for label in ('initial', 'incremental'):
+        summary = await run(SessionLocal, args)
+        print(f'[{label}]')
+        print(summary)
+    await close_client()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=1000, help='AKASHIへのリクエスト数の上限（件/秒）')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.02, help='AKASHIスタブの応答遅延（秒）')
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as directory:
+        SessionLocal = prepare(f'sqlite:///{path.join(directory, "bench.db")}', args.users)
+        app = create_app(latency=args.latency, generate_stamps=True)
+        with serve(app) as base_url:
+            AkashiRequestClient.base_url = f'{base_url}/api/cooperation'
+            asyncio.run(sync_twice(SessionLocal, args))
+        db = SessionLocal()
+        print(f'stamps: {db.query(func.count(UserStamp.id)).scalar():,}')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
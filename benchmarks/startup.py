@@ -0,0 +1,94 @@
+"""
+dynoがスリープから復帰したときの起動時間を計測する
+`import app`にかかる時間と、uvicornを起動してから最初の/slashに応答するまでの時間を別プロセスで計測する
+
+python -m benchmarks.startup --runs 5
+python -m benchmarks.startup --budget 3.0 --fail-over-budget   # CIで予算を超えた場合は終了コード1を返す
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from os import path
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+
+from benchmarks.fake_akashi import free_port
+from benchmarks.suite import SECRET, signed
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+IMPORT_APP = 'import time; started = time.perf_counter(); import app; print(time.perf_counter() - started)'
+EXPECTED = 'APIトークンが登録されていません'
+
+
+def environment(directory: str) -> dict:
+    return {
+        **os.environ,
+        'DATABASE_URL': f'sqlite:///{path.join(directory, "startup.db")}',
+        'SLACK_SIGNING_SECRET': SECRET,
+        'SLACK_BOT_TOKEN': 'xoxb-benchmark',
+        'AKASHI_COMPANY_ID': 'benchmark',
+    }
+
+
+def import_time(env: dict) -> float:
+    result = subprocess.run([sys.executable, '-c', IMPORT_APP], env=env, cwd=ROOT, check=True, capture_output=True)
+    return float(result.stdout)
+
+
+def first_response(env: dict, timeout: float = 30) -> float:
+    """
+    uvicornを起動してから、未登録のユーザーの`/akashi report`に応答するまでの時間
+    DBへの最初の接続を含み、AKASHIやSlackへのリクエストは含まない
+    """
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app:api', '--port', str(port), '--log-level', 'warning'],
+        env=env,
+        cwd=ROOT,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            content, headers = signed({'user_id': 'U0000000000', 'trigger_id': '', 'text': 'report'})
+            try:
+                with urlopen(Request(f'http://127.0.0.1:{port}/slash', data=content, headers=headers)) as res:
+                    text = res.read().decode()
+            except (ConnectionError, URLError):
+                time.sleep(0.005)
+                continue
+            if EXPECTED not in text:
+                raise RuntimeError(f'unexpected response: {text}')
+            return time.perf_counter() - started
+        raise TimeoutError(f'no response within {timeout}s')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=3.0, help='最初の応答までの時間の上限（秒）')
+    parser.add_argument('--fail-over-budget', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = environment(directory)
+        subprocess.run([sys.executable, 'migrate.py'], env=env, cwd=ROOT, check=True)
+        imports = [import_time(env) for _ in range(args.runs)]
+        responses = [first_response(env) for _ in range(args.runs)]
+
+    print(f'import app:     median {statistics.median(imports):.3f}s  max {max(imports):.3f}s')
+    print(f'first /slash:   median {statistics.median(responses):.3f}s  max {max(responses):.3f}s')
+    if max(responses) > args.budget:
+        print(f'OVER BUDGET first /slash took {max(responses):.3f}s (budget {args.budget:.1f}s)')
+        if args.fail_over_budget:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
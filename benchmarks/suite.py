@@ -0,0 +1,272 @@
+"""
+ローカルのAKASHIとSlackのスタブに対して、uvicornで起動したアプリに署名付きのリクエストを送る負荷試験
+
+python -m benchmarks.suite --users 500
+python -m benchmarks.suite --save-baseline        # 結果をbaseline.jsonに保存する
+python -m benchmarks.suite --fail-on-regression   # ベースラインより悪化した場合は終了コード1を返す
+
+シナリオ
+-   clock_in_burst: 9時の出勤のように全ユーザーが同時に/slashと/actionsを送る
+-   token_refresh: 全ユーザーのトークンを再発行する夜間のバッチ
+-   degraded_akashi: AKASHIが遅延し、一部のリクエストが失敗する状態での出勤
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from os import path
+from typing import Optional
+from urllib.parse import urlencode
+from uuid import uuid4
+
+import aiohttp
+
+from benchmarks import fake_akashi, fake_slack
+from benchmarks.fake_akashi import serve
+
+SECRET = 'benchmark-signing-secret'
+BASELINE = path.join(path.dirname(__file__), 'baseline.json')
+# 値が大きいほど悪い指標と、小さいほど悪い指標
+LOWER_IS_BETTER = ('p50', 'p95', 'p99', 'errors', 'over_3s')
+HIGHER_IS_BETTER = ('throughput', )
+# 結果を比較できる実行条件（ベースラインと異なる場合は比較しない）
+PARAMETERS = ('users', 'concurrency', 'akashi_latency', 'slack_latency')
+
+
+def configure(directory: str):
+    # appは読み込み時に環境変数から設定を読むので、importより前に設定する
+    os.environ.update({
+        'DATABASE_URL': f'sqlite:///{path.join(directory, "suite.db")}',
+        'SLACK_SIGNING_SECRET': SECRET,
+        'SLACK_BOT_TOKEN': 'xoxb-benchmark',
+        'SLACK_CHANNEL_ID': 'C0000000000',
+        'AKASHI_COMPANY_ID': 'benchmark',
+        'SERVER_TIMING': 'false',
+    })
+
+
+def prepare_users(users: int) -> list[str]:
+    from app.db import SessionLocal, migrate
+    from app.models import UserToken
+    migrate()
+    db = SessionLocal()
+    user_ids = [f'U{i:010d}' for i in range(users)]
+    db.bulk_insert_mappings(UserToken, [{
+        'user_id': user_id,
+        'token': str(uuid4()),
+        'created_at': datetime.now()
+    } for user_id in user_ids])
+    db.commit()
+    db.close()
+    return user_ids
+
+
+def signed(body: dict) -> tuple[bytes, dict]:
+    content = urlencode(body).encode()
+    timestamp = str(int(time.time()))
+    digest = hmac.new(SECRET.encode(), f'v0:{timestamp}:'.encode() + content, hashlib.sha256).hexdigest()
+    return content, {
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'X-Slack-Request-Timestamp': timestamp,
+        'X-Slack-Signature': f'v0={digest}',
+    }
+
+
+class Result:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: list[float] = []
+        self.errors = 0
+        self.elapsed = 0.0
+
+    def to_dict(self) -> dict:
+        from app.utils import percentile
+        return {
+            'requests': len(self.latencies),
+            'errors': self.errors,
+            'throughput': round(len(self.latencies) / self.elapsed, 1) if self.elapsed else 0.0,
+            'p50': round(percentile(self.latencies, 50) * 1000, 1),
+            'p95': round(percentile(self.latencies, 95) * 1000, 1),
+            'p99': round(percentile(self.latencies, 99) * 1000, 1),
+            'over_3s': sum(1 for i in self.latencies if i > 3),
+        }
+
+
+async def send(session: aiohttp.ClientSession, result: Result, url: str, body: dict):
+    content, headers = signed(body)
+    started = time.perf_counter()
+    try:
+        async with session.post(url, data=content, headers=headers) as res:
+            text = await res.text()
+        # アプリはエラーでも200で文言を返すので、本文でも判定する
+        if res.status != 200 or 'エラー' in text or 'タイムアウト' in text:
+            result.errors += 1
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        result.errors += 1
+    result.latencies.append(time.perf_counter() - started)
+
+
+async def clock_in(base_url: str, slack_url: str, user_ids: list[str], concurrency: int, name: str) -> Result:
+    result = Result(name)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def user(client: aiohttp.ClientSession, user_id: str):
+        async with semaphore:
+            await send(client, result, f'{base_url}/slash', {
+                'user_id': user_id,
+                'trigger_id': str(uuid4()),
+                'text': '',
+                'response_url': f'{slack_url}/response/{user_id}',
+            })
+            payload = {
+                'callback_id': 'stamp',
+                'user': {'id': user_id},
+                'actions': [{'value': '11'}],
+                'response_url': f'{slack_url}/response/{user_id}',
+            }
+            await send(client, result, f'{base_url}/actions', {'payload': json.dumps(payload)})
+
+    # 負荷をかける側のオーバーヘッドを抑えるためにaiohttpを使う
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30)) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(user(client, i) for i in user_ids))
+        result.elapsed = time.perf_counter() - started
+    return result
+
+
+async def token_refresh(concurrency: int) -> Result:
+    from app.db import SessionLocal
+    from app.refresher import TokenRefresher, fetch_targets
+    from app.transport import close_client
+
+    db = SessionLocal()
+    refresher = TokenRefresher(SessionLocal, concurrency=concurrency, rate=10000, backoff=0.05, batch_size=500)
+    summary = await refresher.run(fetch_targets(db, datetime.now()))
+    db.close()
+    await close_client()
+    result = Result('token_refresh')
+    result.latencies = summary.latencies
+    result.errors = summary.errors + summary.deleted
+    result.elapsed = summary.elapsed
+    return result
+
+
+def run_scenarios(args) -> dict[str, dict]:
+    from app import api, slack
+    from app.akashi import AkashiRequestClient
+
+    user_ids = prepare_users(args.users)
+    results = {}
+    with serve(fake_slack.create_app(latency=args.slack_latency)) as slack_url:
+        slack.base_url = f'{slack_url}/api/'
+        # 夜間のバッチはアプリとは別のイベントループで実行するので、アプリを起動する前に実行する
+        with serve(fake_akashi.create_app(latency=args.akashi_latency)) as akashi_url:
+            AkashiRequestClient.base_url = f'{akashi_url}/api/cooperation'
+            results['token_refresh'] = asyncio.run(token_refresh(args.concurrency)).to_dict()
+        scenarios = (
+            ('clock_in_burst', {'latency': args.akashi_latency}),
+            ('degraded_akashi', {'latency': 1.5, 'error_rate': 0.05, 'api_error_rate': 0.01}),
+        )
+        with serve(api) as app_url:
+            for name, options in scenarios:
+                with serve(fake_akashi.create_app(**options)) as akashi_url:
+                    AkashiRequestClient.base_url = f'{akashi_url}/api/cooperation'
+                    result = asyncio.run(clock_in(app_url, slack_url, user_ids, args.concurrency, name))
+                results[name] = result.to_dict()
+    return results
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], threshold: float) -> list[str]:
+    regressions = []
+    for name, metrics in results.items():
+        for key, value in metrics.items():
+            base = baseline.get(name, {}).get(key)
+            if base is None:
+                continue
+            if key in LOWER_IS_BETTER and value > base * (1 + threshold) and value - base > 1:
+                regressions.append(f'{name}.{key}: {base} -> {value}')
+            if key in HIGHER_IS_BETTER and value < base * (1 - threshold):
+                regressions.append(f'{name}.{key}: {base} -> {value}')
+    return regressions
+
+
+def parameters_of(args) -> dict:
+    return {name: getattr(args, name) for name in PARAMETERS}
+
+
+def mismatched(parameters: dict, baseline_parameters: dict) -> list[str]:
+    return [
+        f'{name}: {baseline_parameters.get(name)} -> {parameters[name]}' for name in PARAMETERS
+        if baseline_parameters.get(name) != parameters[name]
+    ]
+
+
+def print_results(results: dict[str, dict], baseline: Optional[dict]):
+    print(f'{"scenario":<16} {"requests":>8} {"errors":>6} {"req/s":>8} {"p50":>8} {"p95":>8} {"p99":>8} {">3s":>5}')
+    for name, m in results.items():
+        print(f'{name:<16} {m["requests"]:>8} {m["errors"]:>6} {m["throughput"]:>8.1f} '
+              f'{m["p50"]:>6.0f}ms {m["p95"]:>6.0f}ms {m["p99"]:>6.0f}ms {m["over_3s"]:>5}')
+        if baseline and name in baseline:
+            b = baseline[name]
+            print(f'{"  (baseline)":<16} {b["requests"]:>8} {b["errors"]:>6} {b["throughput"]:>8.1f} '
+                  f'{b["p50"]:>6.0f}ms {b["p95"]:>6.0f}ms {b["p99"]:>6.0f}ms {b["over_3s"]:>5}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--akashi-latency', type=float, default=0.05, help='AKASHIスタブの応答遅延（秒）')
+    parser.add_argument('--slack-latency', type=float, default=0.02, help='Slackスタブの応答遅延（秒）')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.2, help='悪化とみなす割合')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+    # 注入したエラーのログを抑制する
+    logging.disable(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure(directory)
+        results = run_scenarios(args)
+
+    parameters = parameters_of(args)
+    if args.save_baseline:
+        print_results(results, None)
+        with open(args.baseline, 'w') as f:
+            json.dump({'parameters': parameters, 'results': results}, f, indent=2)
+            f.write('\n')
+        print(f'baseline saved to {args.baseline}')
+        return
+    baseline = None
+    if path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        # 実行条件が異なる結果と比べると誤った悪化を報告するので、比較しない
+        if differences := mismatched(parameters, baseline.get('parameters', {})):
+            print_results(results, None)
+            for difference in differences:
+                print(f'PARAMETER MISMATCH {difference}')
+            print('baseline was recorded with different parameters; skipped comparison')
+            if args.fail_on_regression:
+                sys.exit(2)
+            return
+        baseline = baseline['results']
+    print_results(results, baseline)
+    regressions = compare(results, baseline or {}, args.threshold)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
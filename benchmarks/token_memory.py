@@ -0,0 +1,90 @@
+"""
+トークンを一度にすべて読み込む場合と、idをキーにページごとに読み込む場合で、再発行の対象を読み込むときのピークのRSSを比較する
+計測はモードごとに別のプロセスで行う
+
+python -m benchmarks.token_memory --tokens 100000
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from os import path
+from uuid import uuid4
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.crud import fetch_by_expires_at
+from app.db import Base
+from app.models import UserToken
+from app.refresher import Target, fetch_targets
+
+MODES = ('all', 'stream')
+
+
+def prepare(database: str, tokens: int):
+    engine = create_engine(f'sqlite:///{database}')
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    db.bulk_insert_mappings(UserToken, [{
+        'user_id': f'U{i:010d}',
+        'token': str(uuid4()),
+        'created_at': datetime.now()
+    } for i in range(tokens)])
+    db.commit()
+    db.close()
+
+
+def peak_rss() -> int:
+    # Linuxではキロバイト単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(database: str, mode: str, page_size: int) -> dict:
+    db = sessionmaker(bind=create_engine(f'sqlite:///{database}'))()
+    baseline = peak_rss()
+    started = time.perf_counter()
+    if mode == 'all':
+        # 変更前のfetch_targets：ORMのオブジェクトをすべて読み込み、セッションを閉じるまで保持する
+        targets = [Target(i.id, i.user_id, i.token, i.team_id) for i in fetch_by_expires_at(db, datetime.now())]
+    else:
+        targets = fetch_targets(db, datetime.now(), page_size)
+    count = sum(1 for _ in targets)
+    elapsed = time.perf_counter() - started
+    db.close()
+    return {'count': count, 'elapsed': elapsed, 'peak': peak_rss(), 'growth': peak_rss() - baseline}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokens', type=int, default=100000)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--measure', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.database, args.measure, args.page_size)))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = path.join(directory, 'bench.db')
+        prepare(database, args.tokens)
+        print(f'{"mode":<8} {"tokens":>8} {"seconds":>8} {"peak RSS":>10} {"growth":>10}')
+        for mode in MODES:
+            command = [
+                sys.executable, '-m', 'benchmarks.token_memory', '--measure', mode, '--database', database,
+                '--page-size', str(args.page_size)
+            ]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output)
+            print(f'{mode:<8} {result["count"]:>8,} {result["elapsed"]:>8.2f} '
+                  f'{result["peak"] / 1024:>8.1f}MB {result["growth"] / 1024:>8.1f}MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+ローカルのAKASHIスタブに対してトークンの一括再発行を実行する
+
+python -m benchmarks.token_refresh --tokens 10000 --concurrency 50 --rate 1000
+"""
+import argparse
+import asyncio
+import logging
+import tempfile
+from datetime import datetime
+from os import path
+from uuid import uuid4
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.akashi import AkashiRequestClient
+from app.db import Base
+from app.models import UserToken
+from app.refresher import TokenRefresher, fetch_targets
+from app.transport import close_client
+from benchmarks.fake_akashi import create_app, serve
+
+
+def prepare(database_url: str, tokens: int) -> sessionmaker:
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+    SessionLocal = sessionmaker(bind=engine)
+    db = SessionLocal()
+    db.bulk_insert_mappings(UserToken, [{
+        'user_id': f'U{i:010d}',
+        'token': str(uuid4()),
+        'created_at': datetime.now()
+    } for i in range(tokens)])
+    db.commit()
+    db.close()
+    return SessionLocal
+
+
+async def run(SessionLocal: sessionmaker, args):
+    db = SessionLocal()
+    refresher = TokenRefresher(
+        SessionLocal,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        backoff=0.05,
+        batch_size=args.batch_size,
+    )
+    summary = await refresher.run(fetch_targets(db, datetime.now()))
+    db.close()
+    await close_client()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokens', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=1000, help='AKASHIへのリクエスト数の上限（件/秒）')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.02, help='AKASHIスタブの応答遅延（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.01, help='AKASHIスタブが503を返す割合')
+    parser.add_argument('--api-error-rate', type=float, default=0.01, help='AKASHIスタブがAPIエラーを返す割合')
+    args = parser.parse_args()
+    # 注入したエラーのログを抑制する
+    logging.disable(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as directory:
+        SessionLocal = prepare(f'sqlite:///{path.join(directory, "bench.db")}', args.tokens)
+        app = create_app(latency=args.latency, error_rate=args.error_rate, api_error_rate=args.api_error_rate)
+        with serve(app) as base_url:
+            AkashiRequestClient.base_url = f'{base_url}/api/cooperation'
+            summary = asyncio.run(run(SessionLocal, args))
+    print(summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+from app.db import migrate
+
+if __name__ == '__main__':
+    # Herokuのrelease phaseで実行し、アプリの起動時にはテーブルを作成しない
+    migrate()
@@ -0,0 +1,37 @@
+import argparse
+
+from app.crud import update_or_create_tenant
+from app.db import SessionLocal
+
+
+def main():
+    """
+    Slackのワークスペースを登録する（登録済みの場合は更新する）
+    起動中のアプリにはそのワークスペースがTENANT_IDLE_TTL秒使われなかった後に反映される
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('team_id', help='SlackのワークスペースのID（T0123456789）')
+    parser.add_argument('--company-id', required=True, help='AKASHIの企業ID')
+    parser.add_argument('--bot-token', required=True, help='ワークスペースにインストールしたSlackAppのBot User OAuth Token')
+    parser.add_argument('--channel-id', help='打刻を通知するチャンネル')
+    parser.add_argument('--rate-limit', type=float, help='AKASHIに送るリクエスト数の上限（件/秒）')
+    parser.add_argument('--pool-size', type=int, help='AKASHIへの同時接続数の上限')
+    args = parser.parse_args()
+    db = SessionLocal()
+    try:
+        update_or_create_tenant(
+            db,
+            args.team_id,
+            akashi_company_id=args.company_id,
+            slack_bot_token=args.bot_token,
+            slack_channel_id=args.channel_id,
+            rate_limit=args.rate_limit,
+            pool_size=args.pool_size,
+        )
+    finally:
+        db.close()
+    print(f'{args.team_id} を登録しました')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import argparse
+import asyncio
+import logging
+from datetime import date
+
+from app.db import get_async_sessionmaker
+from app.reminder import CLOCK_IN, KINDS, DirectMessageSender, ReminderDispatcher
+from app.settings import reminder_settings
+from app.tenant import Tenant, create_registry
+from app.transport import close_client
+
+logger = logging.getLogger(__name__)
+
+
+async def main(kind: str):
+    """
+    打刻を忘れているユーザーにDMを送るスクリプト
+    clock_inは出勤の打刻がないユーザー、clock_outは勤務中か休憩中のままのユーザーが対象
+    """
+    tenants = create_registry(Tenant.from_settings())
+    dispatcher = ReminderDispatcher(
+        get_async_sessionmaker(),
+        tenants,
+        DirectMessageSender(rate=reminder_settings.REMINDER_SLACK_RATE_LIMIT),
+        kind,
+        concurrency=reminder_settings.REMINDER_CONCURRENCY,
+        rate=reminder_settings.REMINDER_RATE_LIMIT,
+        page_size=reminder_settings.REMINDER_PAGE_SIZE,
+        on_progress=lambda summary: print(summary.progress(), flush=True),
+    )
+    summary = await dispatcher.run()
+    print(summary)
+    await tenants.close()
+    await close_client()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('kind', choices=KINDS)
+    args = parser.parse_args()
+    weekdays = [int(i) for i in reminder_settings.REMINDER_WEEKDAYS.split(',') if i.strip()]
+    # 休日は出勤のリマインドを送らない（退勤のリマインドは休日に出勤した人にも送る）
+    if args.kind == CLOCK_IN and date.today().weekday() not in weekdays:
+        print('本日はリマインドの対象外です')
+    else:
+        asyncio.run(main(args.kind))
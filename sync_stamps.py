@@ -0,0 +1,39 @@
+import asyncio
+import logging
+
+from app.db import SessionLocal
+from app.settings import sync_settings
+from app.syncer import StampSyncer, fetch_sync_targets
+from app.tenant import Tenant, create_registry
+from app.transport import close_client
+
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    """
+    登録済みのユーザーの打刻をAKASHIから取得してstampsテーブルに保存するスクリプト
+    初回はSYNC_LOOKBACK_DAYS日前から、以降は保存済みの最後の打刻の日から取得する
+    """
+    tenants = create_registry(Tenant.from_settings())
+    syncer = StampSyncer(
+        SessionLocal,
+        concurrency=sync_settings.SYNC_CONCURRENCY,
+        rate=sync_settings.SYNC_RATE_LIMIT,
+        lookback_days=sync_settings.SYNC_LOOKBACK_DAYS,
+        batch_size=sync_settings.SYNC_BATCH_SIZE,
+        tenants=tenants,
+    )
+    # 対象はページごとに読み込むので、同期が終わるまでdbを閉じない
+    db = SessionLocal()
+    try:
+        summary = await syncer.run(fetch_sync_targets(db))
+    finally:
+        db.close()
+    print(summary)
+    await tenants.close()
+    await close_client()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
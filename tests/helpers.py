@@ -1,10 +1,19 @@
+import tempfile
+from os import path
+
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
 from app.db import Base
 
-engine = create_engine('sqlite:///:memory:', connect_args={"check_same_thread": False})
+# 同期と非同期のセッションから同じDBを参照するためファイルを使う
+database = path.join(tempfile.mkdtemp(), 'test.db')
+engine = create_engine(f'sqlite:///{database}', connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 session = SessionLocal()
+async_engine = create_async_engine(f'sqlite+aiosqlite:///{database}', poolclass=NullPool)
+AsyncSessionLocal = sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 Base.metadata.create_all(engine)
@@ -1,18 +1,26 @@
+import asyncio
+import json
+import time
 from datetime import date, datetime
 from http import HTTPStatus
-from unittest import TestCase, mock
+from unittest import IsolatedAsyncioTestCase, TestCase, mock
 from uuid import uuid4
 
+from httpx import ReadTimeout
+
 from app.akashi import (BREAK, CLOCK_IN, CLOCK_OUT, LEAVE_DIRECTLY, RESTART,
                         STRAIGHT_TO, AkashiRequestClient, APIError,
                         FetchedStampResponse, NewStampResponse,
                         ReissuedTokenResponse, RequestFailedError, Stamp,
-                        annotate_stamp_type)
+                        UnavailableError, annotate_stamp_type, parse_datetime)
+from app.breaker import OPEN
+from app.refresher import TokenBucket
+from app.timing import budget
 
 dummy_token = str(uuid4())
 
 
-def get_stamp_response(*args, **kwargs):
+async def get_stamp_response(*args, **kwargs):
     return mocked_response({
         'success': True,
         'response': {
@@ -30,7 +38,7 @@ def get_stamp_response(*args, **kwargs):
     })
 
 
-def get_error_response(*args, **kwargs):
+async def get_error_response(*args, **kwargs):
     return mocked_response(
         status_code=HTTPStatus.OK,
         json_data={
@@ -42,7 +50,7 @@ def get_error_response(*args, **kwargs):
     )
 
 
-def get_new_stamp_response(*args, **kwargs):
+async def get_new_stamp_response(*args, **kwargs):
     return mocked_response(
         status_code=HTTPStatus.OK,
         json_data={
@@ -55,7 +63,7 @@ def get_new_stamp_response(*args, **kwargs):
     )
 
 
-def get_reissued_token_response(*args, **kwargs):
+async def get_reissued_token_response(*args, **kwargs):
     return mocked_response(
         status_code=HTTPStatus.OK,
         json_data={
@@ -68,7 +76,7 @@ def get_reissued_token_response(*args, **kwargs):
     )
 
 
-def get_not_found_response(*args, **kwargs):
+async def get_not_found_response(*args, **kwargs):
     return mocked_response(status_code=HTTPStatus.NOT_FOUND, json_data={})
 
 
@@ -82,7 +90,11 @@ def mocked_response(json_data: dict = {}, status_code: int = HTTPStatus.OK):
             return self.json_data
 
         @property
-        def ok(self):
+        def content(self):
+            return json.dumps(self.json_data).encode()
+
+        @property
+        def is_success(self):
             return self.status_code == HTTPStatus.OK
 
     return MockedResponse(json_data, status_code)
@@ -102,10 +114,27 @@ class StampTest(TestCase):
         stamp = Stamp(stamped_at='2020/01/01 00:00:00', type=CLOCK_IN)
         self.assertEqual(stamp.stamped_at, datetime(2020, 1, 1))
 
+    def test_equality(self):
+        self.assertEqual(Stamp('2020/01/01 09:00:00', CLOCK_IN), Stamp(datetime(2020, 1, 1, 9), CLOCK_IN))
+        self.assertNotEqual(Stamp('2020/01/01 09:00:00', CLOCK_IN), Stamp('2020/01/01 09:00:00', CLOCK_OUT))
+
+
+class ParseDatetimeTest(TestCase):
+    def test_fixed_format(self):
+        self.assertEqual(parse_datetime('2020/01/02 03:04:05'), datetime(2020, 1, 2, 3, 4, 5))
+
+    def test_fallback(self):
+        self.assertEqual(parse_datetime('2020-01-02T03:04:05'), datetime(2020, 1, 2, 3, 4, 5))
+        self.assertEqual(parse_datetime('2020/1/2 3:04:05'), datetime(2020, 1, 2, 3, 4, 5))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            parse_datetime('2020/13/02 03:04:05')
+
 
 class NewStampResponseTest(TestCase):
     def test_stamped_at(self):
-        response = NewStampResponse(**{'stampedAt': '2020/01/01 00:00:00', 'type': BREAK})
+        response = NewStampResponse.decode({'stampedAt': '2020/01/01 00:00:00', 'type': BREAK})
         self.assertEqual(response.stamped_at, datetime(2020, 1, 1))
 
 
@@ -115,47 +144,110 @@ class ReissuedTokenResponseTest(TestCase):
         self.assertEqual(response.expired_at, datetime(2020, 1, 1))
 
 
-class AkashiRequestClientTest(TestCase):
+class AkashiRequestClientTest(IsolatedAsyncioTestCase):
     akashi: AkashiRequestClient
 
     @classmethod
     def setUpClass(cls):
         cls.akashi = AkashiRequestClient(dummy_token)
 
-    @mock.patch('app.akashi.AkashiRequestClient.fetch_stamps', lambda *x: FetchedStampResponse(count=0, stamps=[]))
-    def test_fetch_last_stamp_case_none(self, *args):
-        self.assertIsNone(self.akashi.fetch_last_stamp())
+    @mock.patch('app.akashi.AkashiRequestClient.fetch_stamps',
+                new_callable=mock.AsyncMock,
+                return_value=FetchedStampResponse(count=0, stamps=[]))
+    async def test_fetch_last_stamp_case_none(self, *args):
+        self.assertIsNone(await self.akashi.fetch_last_stamp())
 
-    @mock.patch('requests.Session.request', get_stamp_response)
-    def test_fetch_last_stamp_case_clocked_in(self):
+    @mock.patch('httpx.AsyncClient.request', get_stamp_response)
+    async def test_fetch_last_stamp_case_clocked_in(self):
         expected = Stamp(stamped_at='2020/01/01 18:00:00', type=CLOCK_OUT)
-        self.assertEqual(self.akashi.fetch_last_stamp(), expected)
+        self.assertEqual(await self.akashi.fetch_last_stamp(), expected)
 
-    @mock.patch('requests.Session.request', get_stamp_response)
-    def test_fetch_stamps(self):
+    @mock.patch('httpx.AsyncClient.request', get_stamp_response)
+    async def test_fetch_stamps(self):
         expected = [
             Stamp(stamped_at='2020/01/01 09:00:00', type=CLOCK_IN),
             Stamp(stamped_at='2020/01/01 18:00:00', type=CLOCK_OUT)
         ]
-        res = self.akashi.fetch_stamps(date(2020, 1, 1), date(2020, 1, 1))
+        res = await self.akashi.fetch_stamps(date(2020, 1, 1), date(2020, 1, 1))
         self.assertEqual(res.stamps, expected)
 
-    @mock.patch('requests.Session.request', get_error_response)
-    def test_request_case_error(self):
+    @mock.patch('app.akashi.AkashiRequestClient.get', new_callable=mock.AsyncMock)
+    async def test_fetch_stamps_default_date_to(self, get):
+        get.return_value = {'count': 0, 'stamps': []}
+        with mock.patch('app.akashi.date') as mocked_date:
+            mocked_date.today.return_value = date(2021, 3, 1)
+            await self.akashi.fetch_stamps(date(2021, 2, 1))
+        self.assertEqual(get.await_args.kwargs['end_date'], '20210301235959')
+
+    @mock.patch('httpx.AsyncClient.request', get_error_response)
+    async def test_request_case_error(self):
         with self.assertRaises(APIError):
-            self.akashi.fetch_last_stamp()
+            await self.akashi.fetch_last_stamp()
 
-    @mock.patch('requests.Session.request', get_new_stamp_response)
-    def test_new_stamp(self):
-        stamp = self.akashi.stamp(CLOCK_IN)
+    @mock.patch('httpx.AsyncClient.request', get_new_stamp_response)
+    async def test_new_stamp(self):
+        stamp = await self.akashi.stamp(CLOCK_IN)
         self.assertEqual(stamp.type, CLOCK_IN)
 
-    @mock.patch('requests.Session.request', get_reissued_token_response)
-    def test_reissue_token(self):
-        reissued_token_response = self.akashi.reissue_token()
+    @mock.patch('httpx.AsyncClient.request', get_reissued_token_response)
+    async def test_reissue_token(self):
+        reissued_token_response = await self.akashi.reissue_token()
         self.assertIsInstance(reissued_token_response.expired_at, datetime)
 
-    @mock.patch('requests.Session.request', get_not_found_response)
-    def test_not_found(self):
+    @mock.patch('httpx.AsyncClient.request', get_not_found_response)
+    async def test_not_found(self):
         with self.assertRaises(RequestFailedError):
-            self.akashi.fetch_last_stamp()
+            await self.akashi.fetch_last_stamp()
+
+    @mock.patch('httpx.AsyncClient.request')
+    async def test_deadline(self, request):
+        request.side_effect = get_stamp_response
+        with budget(2.5):
+            await self.akashi.fetch_last_stamp()
+        with budget(1, started=time.perf_counter() - 2):
+            with self.assertRaises(UnavailableError):
+                await self.akashi.fetch_last_stamp()
+
+    @mock.patch('httpx.AsyncClient.request')
+    async def test_deadline_cuts_off_request(self, request):
+        async def slow(*args, **kwargs):
+            await asyncio.sleep(1)
+
+        request.side_effect = slow
+        calls = len(self.akashi.breaker.calls)
+        started = time.perf_counter()
+        # httpxのタイムアウトは段階ごとにかかるので、期限で全体を打ち切る
+        with budget(0.1):
+            with self.assertRaises(UnavailableError):
+                await self.akashi.fetch_last_stamp()
+        self.assertLess(time.perf_counter() - started, 0.5)
+        # こちらの期限による打ち切りはAKASHIの失敗として数えない
+        self.assertEqual(len(self.akashi.breaker.calls), calls)
+
+    @mock.patch('httpx.AsyncClient.request', side_effect=ReadTimeout('timed out'))
+    async def test_timeout(self, request):
+        with self.assertRaises(UnavailableError):
+            await self.akashi.fetch_last_stamp()
+        self.assertTrue(self.akashi.breaker.calls[-1])
+        self.akashi.breaker.reset()
+
+    @mock.patch('httpx.AsyncClient.request', get_stamp_response)
+    async def test_circuit_open(self):
+        self.akashi.breaker.reset(OPEN)
+        try:
+            with self.assertRaises(UnavailableError):
+                await self.akashi.fetch_last_stamp()
+        finally:
+            self.akashi.breaker.reset()
+
+    @mock.patch('httpx.AsyncClient.request')
+    async def test_rate_limited(self, request):
+        request.side_effect = get_stamp_response
+        akashi = AkashiRequestClient(dummy_token, company_id='company', bucket=TokenBucket(rate=1, capacity=1))
+        await akashi.fetch_last_stamp()
+        self.assertIn('/company/stamps', request.call_args.kwargs['url'])
+        # 上限に達した場合は期限まで待って諦める
+        with budget(0.1):
+            with self.assertRaises(UnavailableError):
+                await akashi.fetch_last_stamp()
+        self.assertEqual(request.call_count, 1)
@@ -1,34 +1,40 @@
+import asyncio
 import json
+from datetime import datetime
 from http import HTTPStatus
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import AsyncMock, patch
 
-from fastapi import Request
 from fastapi.testclient import TestClient
 
-from app import api, get_db, verify_signature
-from app.akashi import CLOCK_IN, CLOCK_OUT, NewStampResponse, Stamp
-from app.crud import fetch, fetch_all
-from app.settings import settings
+from app import api, default_tenant, get_db, presence_board, tenant_registry
+from app.akashi import CLOCK_IN, CLOCK_OUT, AkashiRequestClient, NewStampResponse, Stamp, UnavailableError
+from app.breaker import OPEN
+from app.crud import fetch, fetch_all, fetch_stamp_history
+from app.models import SOURCE_SLACK, TenantConfig
+from app.settings import admin_settings, settings
 from tests.factories import UserTokenFactory
-from tests.helpers import Base, engine, session
+from tests.helpers import AsyncSessionLocal, Base, engine, session
 from tests.test_akashi import dummy_token, get_error_response, mocked_response
 
 
-async def override_verification(request: Request = None):
-    return True
-
-
-def get_test_db():
-    try:
-        return session
-    except:
-        session.close()
+async def get_test_db():
+    async with AsyncSessionLocal() as db:
+        yield db
 
 
 client = TestClient(api)
-api.dependency_overrides[verify_signature] = override_verification
 api.dependency_overrides[get_db] = get_test_db
+# 署名が正しいリクエストとして扱う（SlackIngestMiddlewareは署名が正しい場合だけボディをパースする）
+verification = patch('app.ingest.SignatureVerifier.is_valid', return_value=True)
+
+
+def setUpModule():
+    verification.start()
+
+
+def tearDownModule():
+    verification.stop()
 
 
 def test_root():
@@ -43,21 +49,50 @@ class SlashTest(TestCase):
     def tearDown(self):
         Base.metadata.drop_all(engine)
 
-    @patch('app.slack.dialog_open', lambda trigger_id, dialog: True)
-    def test_slash_case_token_unregistered(self):
+    @patch('app.slack.dialog_open', new_callable=AsyncMock)
+    def test_slash_case_token_unregistered(self, *args):
         res = client.post('/slash', data={'user_id': '', 'trigger_id': ''})
         assert res.status_code == HTTPStatus.OK
         assert res.text == ''
 
     @patch('app.akashi.AkashiRequestClient.fetch_last_stamp',
-           lambda *args: Stamp(type=CLOCK_OUT, stamped_at='2020/01/01 19:00:00'))
-    def test_slash_case_already_clocked_out(self):
+           new_callable=AsyncMock,
+           return_value=Stamp(type=CLOCK_OUT, stamped_at='2020/01/01 19:00:00'))
+    def test_slash_case_already_clocked_out(self, *args):
         instance = UserTokenFactory.create()
         res = client.post('/slash', data={'user_id': instance.user_id, 'trigger_id': ''})
         assert res.text == 'すでに勤務を終了しています。'
 
+    @patch('app.build_report', new_callable=AsyncMock, return_value='report')
+    def test_slash_report(self, build_report):
+        instance = UserTokenFactory.create()
+        res = client.post('/slash', data={'user_id': instance.user_id, 'trigger_id': '', 'text': 'report month'})
+        assert res.text == 'report'
+        assert build_report.await_args.args[1] == instance.user_id
+        assert build_report.await_args.args[3] == 'month'
+
+    def test_slash_report_case_token_unregistered(self):
+        res = client.post('/slash', data={'user_id': 'U1', 'trigger_id': '', 'text': 'report'})
+        assert res.text == 'APIトークンが登録されていません。`/akashi`から登録してください'
+
+    @patch('app.deferred_runner.respond', new_callable=AsyncMock)
+    @patch('app.fetch_last_stamp',
+           new_callable=AsyncMock,
+           return_value=Stamp(type=CLOCK_IN, stamped_at='2020/01/01 09:00:00'))
+    def test_slash_who(self, fetch_last_stamp, respond):
+        presence_board._snapshot = None
+        instance = UserTokenFactory.create()
+        res = client.post('/slash', data={'user_id': 'U1', 'trigger_id': '', 'text': 'who', 'response_url': 'url'})
+        assert res.text == '集計中…'
+        fetch_last_stamp.assert_awaited_once_with(default_tenant, instance.user_id, instance.token)
+        assert respond.await_args.args == ('url', {'text': f'*:office: 勤務中*（1人）\n<@{instance.user_id}>'})
+        # 集計結果はしばらく使い回す
+        res = client.post('/slash', data={'user_id': 'U1', 'trigger_id': '', 'text': 'who', 'response_url': 'url'})
+        assert res.json() == {'text': f'*:office: 勤務中*（1人）\n<@{instance.user_id}>'}
+        fetch_last_stamp.assert_awaited_once()
+
     @patch('app.joined', lambda *x, **y: False)
-    def test_not_joined(self):
+    def test_not_joined(self, *args):
         res = client.post('/slash', data={'user_id': '', 'trigger_id': ''})
         assert res.text, ':warning:エラーが発生しました\n'\
             f'- 環境変数の`SLACK_CHANNEL_ID`を確認してください（現在の値：{settings.SLACK_CHANNEL_ID}）\n'\
@@ -66,6 +101,34 @@ class SlashTest(TestCase):
             '- SlackAppのOAuth scopeに`channels:join`が追加されていることを確認してください'
 
 
+class AdminTest(TestCase):
+    def test_forbidden(self):
+        self.assertEqual(client.post('/admin/profile').status_code, HTTPStatus.FORBIDDEN)
+        with patch.object(admin_settings, 'ADMIN_TOKEN', 'secret'):
+            res = client.post('/admin/profile', headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(res.status_code, HTTPStatus.FORBIDDEN)
+
+    @patch.object(admin_settings, 'ADMIN_TOKEN', 'secret')
+    def test_start_profile(self):
+        headers = {'Authorization': 'Bearer secret'}
+        with patch('app.request_profiler.arm') as arm:
+            res = client.post('/admin/profile?requests=5', headers=headers)
+        self.assertEqual(res.status_code, HTTPStatus.ACCEPTED)
+        arm.assert_called_once_with(5)
+        self.assertEqual(client.post('/admin/profile?requests=0', headers=headers).status_code, HTTPStatus.BAD_REQUEST)
+
+
+class EventsTest(TestCase):
+    def test_url_verification(self):
+        res = client.post('/events', json={'type': 'url_verification', 'challenge': 'challenge'})
+        self.assertEqual(res.json(), {'challenge': 'challenge'})
+
+    @patch('app.channel_membership.invalidate')
+    def test_channel_left(self, invalidate):
+        client.post('/events', json={'type': 'event_callback', 'event': {'type': 'channel_left', 'channel': 'C1'}})
+        invalidate.assert_called_once_with('C1')
+
+
 class ActionsTest(TestCase):
     def setUp(self):
         Base.metadata.create_all(engine)
@@ -73,8 +136,8 @@ class ActionsTest(TestCase):
     def tearDown(self):
         Base.metadata.drop_all(engine)
 
-    @patch('app.slack.api_call', lambda *x, **y: True)
-    def test_register_valid_api_token(self):
+    @patch('app.slack.api_call', new_callable=AsyncMock)
+    def test_register_valid_api_token(self, *args):
         user_id = 'xxxxxxxx'
         data = {
             'payload': json.dumps({
@@ -89,10 +152,10 @@ class ActionsTest(TestCase):
         }
         res = client.post('/actions', data=data)
         self.assertEqual(res.text, '')
-        self.assertEqual(len(fetch_all(get_test_db())), 1)
+        self.assertEqual(len(fetch_all(session)), 1)
 
-    @patch('app.slack.api_call', lambda *x, **y: True)
-    def test_update_valid_api_token(self):
+    @patch('app.slack.api_call', new_callable=AsyncMock)
+    def test_update_valid_api_token(self, *args):
         instance = UserTokenFactory()
         data = {
             'payload': json.dumps({
@@ -107,10 +170,10 @@ class ActionsTest(TestCase):
         }
         res = client.post('/actions', data=data)
         self.assertEqual(res.text, '')
-        self.assertEqual(fetch(get_test_db(), instance.user_id).id, instance.id)
+        self.assertEqual(fetch(session, instance.user_id).id, instance.id)
 
-    @patch('app.slack.api_call', lambda *x, **y: True)
-    def test_register_invalid_api_token(self):
+    @patch('app.slack.api_call', new_callable=AsyncMock)
+    def test_register_invalid_api_token(self, *args):
         user_id = 'xxxxxxxx'
         data = {
             'payload': json.dumps({
@@ -125,14 +188,15 @@ class ActionsTest(TestCase):
         }
         res = client.post('/actions', data=data)
         self.assertEqual(res.text, '')
-        self.assertIsNone(fetch(get_test_db(), user_id=user_id))
+        self.assertIsNone(fetch(session, user_id=user_id))
 
-    @patch('app.slack.api_call', lambda *x, **y: True)
+    @patch('app.slack.api_call', new_callable=AsyncMock)
     @patch(
         'app.akashi.AkashiRequestClient.stamp',
-        lambda *x, **y: NewStampResponse(stampedAt='2021/05/08 00:00:00', type=CLOCK_IN),
+        new_callable=AsyncMock,
+        return_value=NewStampResponse(stamped_at='2021/05/08 00:00:00', type=CLOCK_IN),
     )
-    def test_stamp(self):
+    def test_stamp(self, *args):
         user_tokens = UserTokenFactory()
         data = {
             'payload': json.dumps({
@@ -147,6 +211,118 @@ class ActionsTest(TestCase):
         }
         res = client.post('/actions', data=data)
         self.assertEqual(res.text, '勤務を開始:office:しました（時刻：2021-05-08 00:00:00）')
+        self.assertIn('db;dur=', res.headers['server-timing'])
+        history = fetch_stamp_history(session, user_tokens.user_id, datetime(2021, 5, 8))
+        self.assertEqual([(i.type, i.source) for i in history], [(CLOCK_IN, SOURCE_SLACK)])
+
+    @patch.object(settings, 'SLACK_DEFERRED_RESPONSE', True)
+    @patch('app.deferred_runner.respond', new_callable=AsyncMock)
+    @patch(
+        'app.akashi.AkashiRequestClient.stamp',
+        new_callable=AsyncMock,
+        return_value=NewStampResponse(stamped_at='2021/05/08 00:00:00', type=CLOCK_IN),
+    )
+    def test_stamp_deferred(self, stamp, respond):
+        user_tokens = UserTokenFactory()
+        data = {
+            'payload': json.dumps({
+                'callback_id': 'stamp',
+                'user': {
+                    'id': user_tokens.user_id
+                },
+                'actions': [{
+                    'value': CLOCK_IN
+                }],
+                'response_url': 'https://hooks.slack.com/actions/xxx'
+            })
+        }
+        res = client.post('/actions', data=data)
+        self.assertEqual(res.text, '処理中…')
+        respond.assert_awaited_once_with('https://hooks.slack.com/actions/xxx',
+                                         '勤務を開始:office:しました（時刻：2021-05-08 00:00:00）', True)
+
+    @patch(
+        'app.akashi.AkashiRequestClient.stamp',
+        new_callable=AsyncMock,
+        return_value=NewStampResponse(stamped_at='2021/05/08 00:00:00', type=CLOCK_IN),
+    )
+    def test_stamp_duplicated(self, stamp):
+        user_tokens = UserTokenFactory()
+        payload = {
+            'callback_id': 'stamp',
+            'user': {
+                'id': user_tokens.user_id
+            },
+            'actions': [{
+                'value': CLOCK_IN
+            }],
+            'message_ts': '1620432000.000100',
+        }
+        for action_ts in ('1620432001.000000', '1620432001.500000'):
+            res = client.post('/actions', data={'payload': json.dumps({**payload, 'action_ts': action_ts})})
+            self.assertEqual(res.text, '勤務を開始:office:しました（時刻：2021-05-08 00:00:00）')
+        stamp.assert_awaited_once()
+
+    @patch('app.akashi.AkashiRequestClient.stamp', new_callable=AsyncMock)
+    def test_stamp_retry_after_failure(self, stamp):
+        stamp.side_effect = [
+            UnavailableError('deadline exceeded'),
+            NewStampResponse(stamped_at='2021/05/08 00:00:00', type=CLOCK_IN)
+        ]
+        user_tokens = UserTokenFactory()
+        payload = {
+            'callback_id': 'stamp',
+            'user': {
+                'id': user_tokens.user_id
+            },
+            'actions': [{
+                'value': CLOCK_IN
+            }],
+            'message_ts': '1620432000.000100',
+        }
+        # 失敗した結果は再利用せずに、同じボタンでもう一度打刻する
+        res = client.post('/actions', data={'payload': json.dumps(payload)})
+        self.assertEqual(res.text, 'AKASHIが応答していません。時間をおいて再度お試しください')
+        res = client.post('/actions', data={'payload': json.dumps(payload)})
+        self.assertEqual(res.text, '勤務を開始:office:しました（時刻：2021-05-08 00:00:00）')
+        self.assertEqual(stamp.await_count, 2)
+
+    @patch(
+        'app.akashi.AkashiRequestClient.stamp',
+        new_callable=AsyncMock,
+        return_value=NewStampResponse(stamped_at='2021/05/08 00:00:00', type=CLOCK_IN),
+    )
+    def test_stamp_tenant(self, stamp):
+        user_tokens = UserTokenFactory(team_id='T1')
+        payload = {'callback_id': 'stamp', 'user': {'id': user_tokens.user_id}, 'actions': [{'value': CLOCK_IN}]}
+        config = TenantConfig(team_id='T1', akashi_company_id='company', slack_bot_token='xoxb-tenant')
+        loader = AsyncMock(side_effect=lambda team_id: config if team_id == 'T1' else None)
+        try:
+            with patch.object(tenant_registry, 'loader', loader), patch.object(tenant_registry, 'team_id', 'T0'):
+                res = client.post('/actions', data={'payload': json.dumps({**payload, 'team': {'id': 'T1'}})})
+                self.assertEqual(res.text, '勤務を開始:office:しました（時刻：2021-05-08 00:00:00）')
+                history = fetch_stamp_history(session, user_tokens.user_id, datetime(2021, 5, 8), team_id='T1')
+                self.assertEqual(len(history), 1)
+                # SLACK_TEAM_IDを設定した場合は、登録していない他のワークスペースからは使えない
+                res = client.post('/actions', data={'payload': json.dumps({**payload, 'team': {'id': 'T2'}})})
+                self.assertEqual(res.text, 'このワークスペースでは利用できません')
+        finally:
+            asyncio.get_event_loop().run_until_complete(tenant_registry.close())
+        stamp.assert_awaited_once()
+
+    @patch('app.akashi.AkashiRequestClient.stamp', new_callable=AsyncMock)
+    def test_stamp_circuit_open(self, stamp):
+        user_tokens = UserTokenFactory()
+        data = {'payload': json.dumps({'callback_id': 'stamp', 'user': {'id': user_tokens.user_id}})}
+        AkashiRequestClient.breaker.reset(OPEN)
+        try:
+            res = client.post('/actions', data=data)
+            self.assertEqual(res.text, 'AKASHIが応答していません。時間をおいて再度お試しください')
+            res = client.post('/slash', data={'user_id': user_tokens.user_id, 'trigger_id': ''})
+            self.assertEqual(res.text, 'AKASHIが応答していません。時間をおいて再度お試しください')
+        finally:
+            AkashiRequestClient.breaker.reset()
+        stamp.assert_not_awaited()
 
     @patch('app.akashi.AkashiRequestClient.request_', get_error_response)
     def test_stamp_failed(self):
@@ -166,8 +342,9 @@ class ActionsTest(TestCase):
         self.assertEqual(res.text, 'APIトークンを確認してください')
 
     @patch('app.akashi.AkashiRequestClient.request_',
-           lambda *x, **y: mocked_response({}, status_code=HTTPStatus.NOT_FOUND))
-    def test_stamp_akashi_api_server_error(self):
+           new_callable=AsyncMock,
+           return_value=mocked_response({}, status_code=HTTPStatus.NOT_FOUND))
+    def test_stamp_akashi_api_server_error(self, *args):
         user_tokens = UserTokenFactory()
         data = {
             'payload': json.dumps({
@@ -0,0 +1,84 @@
+from datetime import datetime
+from string import ascii_letters
+from unittest import IsolatedAsyncioTestCase
+from uuid import uuid4
+
+from rstr import rstr
+
+from sqlalchemy.dialects import postgresql
+
+from app.async_crud import (bulk_delete_by_user_ids, bulk_upsert_tokens,
+                            delete, due_tokens_statement, fetch, fetch_all,
+                            fetch_by_expires_at, fetch_due_tokens,
+                            fetch_token_page, fetch_token_pairs,
+                            update_or_create)
+from tests.factories import UserTokenFactory
+from tests.helpers import AsyncSessionLocal, Base, engine
+
+
+class AsyncCRUDTest(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        Base.metadata.create_all(engine)
+        self.db = AsyncSessionLocal()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        Base.metadata.drop_all(engine)
+
+    async def test_fetch_none(self):
+        self.assertIsNone(await fetch(self.db, rstr(ascii_letters, 11)))
+
+    async def test_fetch(self):
+        instance = UserTokenFactory.create()
+        fetched = await fetch(self.db, instance.user_id)
+        self.assertEqual(instance.id, fetched.id)
+
+    async def test_delete(self):
+        instance = UserTokenFactory.create()
+        await delete(self.db, await fetch(self.db, instance.user_id))
+        self.assertEqual(len(await fetch_all(self.db)), 0)
+
+    async def test_update_or_create_case_update(self):
+        instance = UserTokenFactory.create(expires_at=datetime(2021, 1, 1))
+        token = str(uuid4())
+        updated = await update_or_create(self.db, instance.user_id, token=token)
+        self.assertEqual(updated.id, instance.id)
+        self.assertEqual(updated.token, token)
+        self.assertEqual(updated.expires_at, datetime(2021, 1, 1))
+
+    async def test_update_or_create_case_create(self):
+        await update_or_create(self.db, user_id=rstr(ascii_letters, 11), token=str(uuid4()))
+        self.assertEqual(len(await fetch_all(self.db)), 1)
+
+    async def test_fetch_by_expires_at(self):
+        instance_1 = UserTokenFactory.create()
+        instance_2 = UserTokenFactory.create(expires_at=datetime(2021, 1, 1))
+        fetched = await fetch_by_expires_at(self.db, datetime(2021, 1, 1))
+        self.assertEqual([i.id for i in fetched], [instance_1.id])
+        self.assertNotIn(instance_2.id, [i.id for i in fetched])
+
+    async def test_fetch_token_pairs(self):
+        instance = UserTokenFactory.create()
+        self.assertEqual(await fetch_token_pairs(self.db), [(instance.user_id, instance.token)])
+
+    async def test_fetch_token_page(self):
+        instances = UserTokenFactory.create_batch(5)
+        first = await fetch_token_page(self.db, 0, 3)
+        self.assertEqual([i.user_id for i in first], [i.user_id for i in instances[:3]])
+        second = await fetch_token_page(self.db, first[-1].id, 3)
+        self.assertEqual([i.user_id for i in second], [i.user_id for i in instances[3:]])
+
+    async def test_fetch_due_tokens(self):
+        UserTokenFactory.create_batch(2, expires_at=datetime(2021, 1, 1))
+        unknown = UserTokenFactory.create()
+        rows = await fetch_due_tokens(self.db, datetime(2021, 1, 2), 1)
+        self.assertEqual([i.user_id for i in rows], [unknown.user_id])
+        # PostgresでもNULLを先に並べる
+        sql = str(due_tokens_statement(datetime(2021, 1, 2), 1).compile(dialect=postgresql.dialect()))
+        self.assertIn('NULLS FIRST', sql)
+
+    async def test_bulk(self):
+        rows = [{'user_id': rstr(ascii_letters, 11), 'token': str(uuid4())} for _ in range(5)]
+        self.assertEqual(await bulk_upsert_tokens(self.db, rows, chunk_size=2), 5)
+        self.assertEqual(await bulk_delete_by_user_ids(self.db, [row['user_id'] for row in rows[:3]]), 3)
+        self.assertEqual(len(await fetch_all(self.db)), 2)
@@ -0,0 +1,54 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from app.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+class CircuitBreakerTest(TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker('test', failure_rate=0.5, window=4, min_calls=4, slow_call=1.0, open_seconds=30)
+
+    def test_open_on_failure_rate(self):
+        for success in (True, False, True):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(success, 0.1)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.record(False, 0.1)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertTrue(self.breaker.is_open)
+        self.assertFalse(self.breaker.allow())
+
+    def test_slow_call_is_failure(self):
+        for _ in range(4):
+            self.breaker.record(True, 1.5)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_half_open(self):
+        self.breaker.reset(OPEN)
+        with patch('app.breaker.time.monotonic', return_value=self.breaker.opened_at + 31):
+            self.assertFalse(self.breaker.is_open)
+            # 試すのは1件だけ
+            self.assertTrue(self.breaker.allow())
+            self.assertEqual(self.breaker.state, HALF_OPEN)
+            self.assertFalse(self.breaker.allow())
+            self.breaker.record(True, 0.1)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_release(self):
+        self.breaker.reset(OPEN)
+        with patch('app.breaker.time.monotonic', return_value=self.breaker.opened_at + 31):
+            self.assertTrue(self.breaker.allow())
+            # 結果がわからない場合は記録せず、次の呼び出しで試す
+            self.breaker.release()
+            self.assertEqual(self.breaker.state, HALF_OPEN)
+            self.assertTrue(self.breaker.allow())
+        self.assertEqual(list(self.breaker.calls), [])
+
+    def test_half_open_failure(self):
+        self.breaker.reset(OPEN)
+        with patch('app.breaker.time.monotonic', return_value=self.breaker.opened_at + 31):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(False, 0.1)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
@@ -0,0 +1,51 @@
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from fakeredis import FakeAsyncRedis
+
+from app.cache import LRUCache, MemoryBackend, RedisBackend, create_backend
+
+
+class LRUCacheTest(TestCase):
+    def test_evict_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_expired(self):
+        cache = LRUCache(ttl=-1)
+        cache.set('a', 1)
+        self.assertNotIn('a', cache)
+        self.assertEqual(len(cache), 0)
+
+    def test_ttl_per_entry(self):
+        cache = LRUCache(ttl=-1)
+        cache.set('a', 1, ttl=60)
+        self.assertEqual(cache.get('a'), 1)
+
+
+class BackendTest(IsolatedAsyncioTestCase):
+    async def check_backend(self, backend):
+        self.assertIsNone(await backend.get('key'))
+        await backend.set('key', 'value', ttl=60)
+        self.assertEqual(await backend.get('key'), 'value')
+        await backend.delete('key')
+        self.assertIsNone(await backend.get('key'))
+        self.assertTrue(await backend.add('key', 'first', ttl=60))
+        self.assertFalse(await backend.add('key', 'second', ttl=60))
+        self.assertEqual(await backend.get('key'), 'first')
+
+    async def test_memory(self):
+        await self.check_backend(MemoryBackend())
+
+    async def test_redis(self):
+        await self.check_backend(RedisBackend(client=FakeAsyncRedis(decode_responses=True)))
+
+    def test_create_backend(self):
+        self.assertIsInstance(create_backend('memory'), MemoryBackend)
+        with self.assertRaises(ValueError):
+            create_backend('unknown')
@@ -5,8 +5,12 @@ from uuid import uuid4
 
 from rstr import rstr
 
-from app.crud import (delete, fetch, fetch_all, fetch_by_expires_at,
-                      update_or_create)
+from app.akashi import CLOCK_IN, CLOCK_OUT
+from app.crud import (bulk_delete_by_user_ids, bulk_upsert_tokens, chunked,
+                      delete, fetch, fetch_all, fetch_by_expires_at,
+                      fetch_high_water_marks, fetch_stamp_history,
+                      insert_stamps, iter_tokens, update_or_create)
+from app.models import SOURCE_AKASHI, SOURCE_SLACK
 from tests.factories import UserTokenFactory
 from tests.helpers import Base, engine, session
 
@@ -45,6 +49,44 @@ class CRUDTest(TestCase):
         update_or_create(session, user_id=rstr(ascii_letters, 11), token=str(uuid4()))
         self.assertEqual(len(fetch_all(session)), 1)
 
+    def test_update_or_create_per_team(self):
+        user_id = rstr(ascii_letters, 11)
+        update_or_create(session, user_id=user_id, token=str(uuid4()))
+        token = str(uuid4())
+        update_or_create(session, user_id=user_id, token=token, team_id='T1')
+        self.assertEqual(len(fetch_all(session)), 2)
+        self.assertEqual(fetch(session, user_id, team_id='T1').token, token)
+        self.assertEqual(bulk_delete_by_user_ids(session, [user_id], team_id='T1'), 1)
+        self.assertIsNotNone(fetch(session, user_id))
+
+    def test_update_or_create_case_upsert(self):
+        expires_at = datetime(2021, 1, 1)
+        instance = UserTokenFactory.create(expires_at=expires_at)
+        token = str(uuid4())
+        updated = update_or_create(session, instance.user_id, token=token)
+        self.assertEqual(updated.id, instance.id)
+        self.assertEqual(updated.token, token)
+        self.assertEqual(updated.expires_at, expires_at)
+
+    def test_update_or_create_case_no_token(self):
+        with self.assertRaises(Exception):
+            update_or_create(session, user_id=rstr(ascii_letters, 11))
+
+    def test_bulk_upsert_tokens(self):
+        instance = UserTokenFactory.create()
+        rows = [{'user_id': instance.user_id, 'token': str(uuid4()), 'expires_at': datetime(2021, 2, 1)}]
+        rows += [{'user_id': rstr(ascii_letters, 11), 'token': str(uuid4())} for _ in range(4)]
+        self.assertEqual(bulk_upsert_tokens(session, rows, chunk_size=2), 5)
+        session.expire_all()
+        self.assertEqual(len(fetch_all(session)), 5)
+        self.assertEqual(fetch(session, instance.user_id).token, rows[0]['token'])
+        self.assertEqual(fetch(session, instance.user_id).expires_at, datetime(2021, 2, 1))
+
+    def test_bulk_delete_by_user_ids(self):
+        instances = UserTokenFactory.create_batch(3)
+        self.assertEqual(bulk_delete_by_user_ids(session, [i.user_id for i in instances[:2]], chunk_size=1), 2)
+        self.assertEqual(len(fetch_all(session)), 1)
+
     def test_fetch_by_expires_at(self):
         instance_1 = UserTokenFactory.create()
         instance_2 = UserTokenFactory.create(expires_at=datetime(2020, 12, 31, 23, 59, 59))
@@ -53,3 +95,45 @@ class CRUDTest(TestCase):
         self.assertIn(instance_1, instances)
         self.assertIn(instance_2, instances)
         self.assertNotIn(instance_3, instances)
+
+    def test_iter_tokens(self):
+        instances = UserTokenFactory.create_batch(4)
+        expired = UserTokenFactory.create(expires_at=datetime(2021, 1, 1))
+        rows = list(iter_tokens(session, page_size=2))
+        self.assertEqual([i.user_id for i in rows], [i.user_id for i in [*instances, expired]])
+        self.assertEqual(rows[0], (instances[0].id, instances[0].team_id, instances[0].user_id, instances[0].token))
+        rows = list(iter_tokens(session, datetime(2021, 1, 1), page_size=2))
+        self.assertEqual([i.user_id for i in rows], [i.user_id for i in instances])
+
+    def test_insert_stamps(self):
+        rows = [
+            {'user_id': 'U1', 'stamped_at': datetime(2021, 1, 4, 9), 'type': CLOCK_IN, 'source': SOURCE_SLACK},
+            {'user_id': 'U1', 'stamped_at': datetime(2021, 1, 4, 18), 'type': CLOCK_OUT, 'source': SOURCE_AKASHI},
+            {'user_id': 'U2', 'stamped_at': datetime(2021, 1, 5, 9), 'type': CLOCK_IN, 'source': SOURCE_AKASHI},
+        ]
+        self.assertEqual(insert_stamps(session, rows, chunk_size=2), 3)
+        # 同じ打刻は無視される
+        self.assertEqual(insert_stamps(session, [dict(rows[0], source=SOURCE_AKASHI)]), 0)
+        history = fetch_stamp_history(session, 'U1', datetime(2021, 1, 4))
+        self.assertEqual([(i.type, i.source) for i in history], [(CLOCK_IN, SOURCE_SLACK), (CLOCK_OUT, SOURCE_AKASHI)])
+        self.assertEqual(len(fetch_stamp_history(session, 'U1', datetime(2021, 1, 4), datetime(2021, 1, 4, 12))), 1)
+        # Slackから記録した打刻は同期済みの位置に含めない
+        insert_stamps(session, [dict(rows[2], stamped_at=datetime(2021, 1, 6, 9), source=SOURCE_SLACK)])
+        self.assertEqual(fetch_high_water_marks(session, ['U1', 'U2', 'U3'], chunk_size=1), {
+            'U1': datetime(2021, 1, 4, 18),
+            'U2': datetime(2021, 1, 5, 9),
+        })
+
+    def test_insert_stamps_per_team(self):
+        # Enterprise Gridでは同じユーザーIDが複数のワークスペースにいる
+        row = {'user_id': 'U1', 'stamped_at': datetime(2021, 1, 4, 9), 'type': CLOCK_IN, 'source': SOURCE_AKASHI}
+        self.assertEqual(insert_stamps(session, [row, dict(row, team_id='T1', stamped_at=datetime(2021, 1, 5, 9))]), 2)
+        self.assertEqual(len(fetch_stamp_history(session, 'U1', datetime(2021, 1, 1))), 1)
+        self.assertEqual(len(fetch_stamp_history(session, 'U1', datetime(2021, 1, 1), team_id='T1')), 1)
+        self.assertEqual(fetch_high_water_marks(session, ['U1']), {'U1': datetime(2021, 1, 4, 9)})
+        self.assertEqual(fetch_high_water_marks(session, ['U1'], team_id='T1'), {'U1': datetime(2021, 1, 5, 9)})
+
+
+def test_chunked():
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunked([], 2)) == []
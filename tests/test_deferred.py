@@ -0,0 +1,59 @@
+import asyncio
+import time
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.deferred import DeferredRunner, to_message
+
+
+def test_to_message():
+    assert to_message(None) is None
+    assert to_message('text') == {'text': 'text'}
+    assert to_message({'attachments': []}) == {'attachments': []}
+
+
+class DeferredRunnerTest(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.runner = DeferredRunner(max_concurrency=2, timeout=0.05)
+
+    @patch('app.deferred.get_client')
+    async def test_post_result(self, get_client):
+        post = get_client.return_value.post = AsyncMock(return_value=MagicMock())
+
+        async def job():
+            return '勤務を開始:office:しました'
+
+        await self.runner.run('https://hooks.slack.com/xxx', job, time.perf_counter(), replace_original=True)
+        post.assert_awaited_once_with(
+            'https://hooks.slack.com/xxx',
+            json={
+                'text': '勤務を開始:office:しました',
+                'replace_original': True
+            },
+        )
+
+    @patch('app.deferred.DeferredRunner.respond', new_callable=AsyncMock)
+    async def test_timeout(self, respond):
+        async def job():
+            await asyncio.sleep(1)
+
+        await self.runner.run('https://hooks.slack.com/xxx', job, time.perf_counter())
+        respond.assert_awaited_once_with('https://hooks.slack.com/xxx',
+                                         'タイムアウトしました。時間をおいて再度お試しください', False)
+
+    @patch('app.deferred.DeferredRunner.respond', new_callable=AsyncMock)
+    async def test_bounded_concurrency(self, respond):
+        running = 0
+        max_running = 0
+
+        async def job():
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        # GCの停止でタイムアウトしないように、この試験ではタイムアウトを長くする
+        runner = DeferredRunner(max_concurrency=2, timeout=5)
+        await asyncio.gather(*(runner.run('', job, time.perf_counter()) for _ in range(10)))
+        self.assertEqual(max_running, 2)
@@ -0,0 +1,74 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from fakeredis import FakeAsyncRedis
+
+from app.cache import MemoryBackend, RedisBackend
+from app.idempotency import PENDING, Idempotency, Unconfirmed, interaction_key, settle
+
+
+def test_interaction_key():
+    payload = {'user': {'id': 'U1'}, 'actions': [{'value': '11'}], 'action_ts': '2.0', 'trigger_id': 't'}
+    assert interaction_key(payload) == 'idempotency:U1:2.0:11'
+    # ダブルクリックは同じメッセージのボタンなのでmessage_tsで判定する
+    assert interaction_key({**payload, 'message_ts': '1.0'}) == 'idempotency:U1:1.0:11'
+    assert interaction_key({'user': {'id': 'U1'}, 'actions': [{'value': '11'}]}) is None
+
+
+class IdempotencyTest(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.backend = MemoryBackend()
+        self.idempotency = Idempotency(self.backend, ttl=60, lock_ttl=1, poll_interval=0.01)
+        self.calls = 0
+
+    async def job(self):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return f'result {self.calls}'
+
+    async def test_concurrent(self):
+        results = await asyncio.gather(*(self.idempotency.run('key', self.job) for _ in range(5)))
+        self.assertEqual(results, ['result 1'] * 5)
+        self.assertEqual(self.calls, 1)
+
+    async def test_replay(self):
+        self.assertEqual(await self.idempotency.run('key', self.job), 'result 1')
+        self.assertEqual(await self.idempotency.run('key', self.job), 'result 1')
+        self.assertEqual(await self.idempotency.run('other', self.job), 'result 2')
+
+    async def test_other_worker(self):
+        # 別のdynoはbackendを共有するだけなので、完了をポーリングで待つ
+        other = Idempotency(self.backend, ttl=60, lock_ttl=1, poll_interval=0.01)
+        results = await asyncio.gather(self.idempotency.run('key', self.job), other.run('key', self.job))
+        self.assertEqual(results, ['result 1', 'result 1'])
+        self.assertEqual(self.calls, 1)
+
+    async def test_release_on_error(self):
+        async def fail():
+            raise RuntimeError()
+
+        with self.assertRaises(RuntimeError):
+            await self.idempotency.run('key', fail)
+        self.assertEqual(await self.idempotency.run('key', self.job), 'result 1')
+
+    async def test_unconfirmed(self):
+        async def fail():
+            raise Unconfirmed('error')
+
+        # 結果は返すが保存しないので、次は実行する
+        self.assertEqual(await settle(lambda: self.idempotency.run('key', fail)), 'error')
+        self.assertEqual(await settle(lambda: self.idempotency.run('key', self.job)), 'result 1')
+        self.assertEqual(await settle(lambda: self.idempotency.run('key', fail)), 'result 1')
+
+    async def test_backend_error_while_waiting(self):
+        # 別のdynoが処理中に保存先が使えなくなった場合は、重複を防がずに実行する
+        await self.backend.add('key', PENDING, 60)
+        with patch.object(self.backend, 'get', side_effect=ConnectionError()):
+            self.assertEqual(await self.idempotency.run('key', self.job), 'result 1')
+
+    async def test_redis(self):
+        idempotency = Idempotency(RedisBackend(client=FakeAsyncRedis(decode_responses=True)), ttl=60)
+        self.assertEqual(await idempotency.run('key', self.job), 'result 1')
+        self.assertEqual(await idempotency.run('key', self.job), 'result 1')
+        self.assertEqual(self.calls, 1)
@@ -0,0 +1,97 @@
+import hashlib
+import hmac
+import json
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.parse import urlencode
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.ingest import SignatureVerifier, SlackIngestMiddleware, parse_body
+
+SECRET = 'secret'
+
+
+def sign(body: bytes, timestamp: int, secret: str = SECRET) -> dict:
+    digest = hmac.new(secret.encode(), f'v0:{timestamp}:'.encode() + body, hashlib.sha256).hexdigest()
+    return {'X-Slack-Request-Timestamp': str(timestamp), 'X-Slack-Signature': f'v0={digest}'}
+
+
+class SignatureVerifierTest(TestCase):
+    def setUp(self):
+        self.verifier = SignatureVerifier(SECRET)
+        self.body = b'user_id=U1'
+        self.timestamp = int(time.time())
+
+    def verify(self, headers: dict, body: bytes = None) -> bool:
+        return self.verifier.is_valid(body or self.body, headers['X-Slack-Request-Timestamp'].encode(),
+                                      headers['X-Slack-Signature'].encode())
+
+    def test_valid(self):
+        self.assertTrue(self.verify(sign(self.body, self.timestamp)))
+
+    def test_tampered_body(self):
+        self.assertFalse(self.verify(sign(self.body, self.timestamp), body=b'user_id=U2'))
+
+    def test_wrong_secret(self):
+        self.assertFalse(self.verify(sign(self.body, self.timestamp, secret='other')))
+
+    def test_expired(self):
+        self.assertFalse(self.verify(sign(self.body, self.timestamp - 60 * 10)))
+
+    def test_invalid_timestamp(self):
+        self.assertFalse(self.verifier.is_valid(self.body, b'abc', b'v0=00'))
+
+    def test_no_secret(self):
+        verifier = SignatureVerifier('')
+        headers = sign(self.body, self.timestamp, secret='')
+        self.assertFalse(verifier.is_valid(self.body, headers['X-Slack-Request-Timestamp'].encode(),
+                                           headers['X-Slack-Signature'].encode()))
+
+
+def test_parse_body():
+    payload = {'callback_id': 'stamp'}
+    body = urlencode({'payload': json.dumps(payload)}).encode()
+    form, parsed = parse_body(body, b'application/x-www-form-urlencoded')
+    assert parsed == payload
+    assert form == {'payload': json.dumps(payload)}
+    assert parse_body(b'{"type": "url_verification"}', b'application/json') == (None, {'type': 'url_verification'})
+
+
+async def echo(request: Request):
+    body = await request.body()
+    return JSONResponse({
+        'verified': request.state.verified,
+        'form': request.state.form,
+        'payload': request.state.payload,
+        'body': body.decode(),
+    })
+
+
+class SlackIngestMiddlewareTest(TestCase):
+    def setUp(self):
+        app = Starlette(routes=[Route('/slash', echo, methods=['POST'])])
+        app.add_middleware(SlackIngestMiddleware, signing_secret=SECRET)
+        self.client = TestClient(app)
+
+    def post(self, path: str, body: bytes, headers: dict):
+        headers = dict(headers, **{'Content-Type': 'application/x-www-form-urlencoded'})
+        return self.client.post(path, data=body, headers=headers)
+
+    def test_signed(self):
+        body = b'user_id=U1&text='
+        res = self.post('/slash', body, sign(body, int(time.time())))
+        self.assertEqual(res.json(), {'verified': True, 'form': {'user_id': 'U1', 'text': ''}, 'payload': None,
+                                      'body': body.decode()})
+
+    def test_unsigned(self):
+        with patch('app.ingest.parse_body') as parse:
+            res = self.post('/slash', b'user_id=U1', {})
+        self.assertEqual(res.json(), {'verified': False, 'form': None, 'payload': None, 'body': 'user_id=U1'})
+        # 署名が正しくないリクエストはパースしない
+        parse.assert_not_called()
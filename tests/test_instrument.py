@@ -0,0 +1,101 @@
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import AsyncMock, patch
+
+from prometheus_client import REGISTRY
+from slack_sdk.errors import SlackApiError
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.akashi import AkashiAPIResponse, APIError, akashi_method
+from app.instrument import RouteTimingMiddleware, query
+from app.slack_client import InstrumentedWebClient
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TimedTest(IsolatedAsyncioTestCase):
+    def test_sync(self):
+        @query
+        def sync_query():
+            return 1
+
+        before = sample('db_query_duration_seconds_count', function='sync_query')
+        self.assertEqual(sync_query(), 1)
+        self.assertEqual(sample('db_query_duration_seconds_count', function='sync_query'), before + 1)
+
+    async def test_async(self):
+        @query
+        async def async_query():
+            return 1
+
+        before = sample('db_query_duration_seconds_count', function='async_query')
+        self.assertEqual(await async_query(), 1)
+        self.assertEqual(sample('db_query_duration_seconds_count', function='async_query'), before + 1)
+
+    async def test_nested(self):
+        # 内側の関数は外側の時間に含まれるので、外側だけを記録する
+        @query
+        async def inner_query():
+            return 1
+
+        @query
+        async def outer_query():
+            return await inner_query() + 1
+
+        inner = sample('db_query_duration_seconds_count', function='inner_query')
+        outer = sample('db_query_duration_seconds_count', function='outer_query')
+        with patch('app.instrument.record') as record:
+            self.assertEqual(await outer_query(), 2)
+        self.assertEqual(sample('db_query_duration_seconds_count', function='inner_query'), inner)
+        self.assertEqual(sample('db_query_duration_seconds_count', function='outer_query'), outer + 1)
+        self.assertEqual(record.call_count, 1)
+        self.assertEqual(await inner_query(), 1)
+        self.assertEqual(sample('db_query_duration_seconds_count', function='inner_query'), inner + 1)
+
+    async def test_akashi_method(self):
+        @akashi_method('test_method')
+        async def call(error=None):
+            if error:
+                raise error
+
+        before = sample('akashi_request_duration_seconds_count', method='test_method', outcome='api_error')
+        await call()
+        with self.assertRaises(APIError):
+            await call(APIError(AkashiAPIResponse(success=False), 'token'))
+        self.assertEqual(sample('akashi_request_duration_seconds_count', method='test_method', outcome='ok'), 1)
+        self.assertEqual(sample('akashi_request_duration_seconds_count', method='test_method', outcome='api_error'),
+                         before + 1)
+
+    @patch('slack_sdk.web.async_client.AsyncWebClient.api_call', new_callable=AsyncMock)
+    async def test_slack_client(self, api_call):
+        client = InstrumentedWebClient('xoxb-test')
+        api_call.side_effect = [{'ok': True}, SlackApiError('not_in_channel', {'ok': False})]
+        before = sample('slack_api_duration_seconds_count', method='test.method', outcome='slack_error')
+        await client.api_call('test.method')
+        with self.assertRaises(SlackApiError):
+            await client.api_call('test.method')
+        self.assertEqual(sample('slack_api_duration_seconds_count', method='test.method', outcome='slack_error'),
+                         before + 1)
+
+
+class RouteTimingMiddlewareTest(TestCase):
+    def setUp(self):
+        app = Starlette(routes=[Route('/timed', lambda request: Response('ok'))])
+        app.add_middleware(RouteTimingMiddleware)
+        self.client = TestClient(app)
+
+    def test_route(self):
+        before = sample('http_request_duration_seconds_count', route='/timed', method='GET', status='200')
+        self.client.get('/timed')
+        self.assertEqual(sample('http_request_duration_seconds_count', route='/timed', method='GET', status='200'),
+                         before + 1)
+
+    def test_unknown_route(self):
+        before = sample('http_request_duration_seconds_count', route='other', method='GET', status='404')
+        self.client.get('/unknown/path')
+        self.assertEqual(sample('http_request_duration_seconds_count', route='other', method='GET', status='404'),
+                         before + 1)
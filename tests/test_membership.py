@@ -0,0 +1,48 @@
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock
+
+from slack_sdk.errors import SlackApiError
+
+from app.membership import ChannelMembership
+
+
+class ChannelMembershipTest(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.client = AsyncMock()
+        self.membership = ChannelMembership(self.client, ttl=60)
+
+    async def test_unknown_schedules_refresh(self):
+        self.assertIsNone(self.membership.joined('C1'))
+        await self.membership._tasks['C1']
+        self.assertTrue(self.membership.joined('C1'))
+        self.client.conversations_join.assert_awaited_once_with(channel='C1')
+
+    async def test_cached(self):
+        await self.membership.refresh('C1')
+        for _ in range(3):
+            self.assertTrue(self.membership.joined('C1'))
+        self.assertEqual(self.client.conversations_join.await_count, 1)
+
+    async def test_expired(self):
+        await self.membership.refresh('C1')
+        self.membership.ttl = -1
+        self.assertTrue(self.membership.joined('C1'))
+        await self.membership._tasks['C1']
+        self.assertEqual(self.client.conversations_join.await_count, 2)
+
+    async def test_join_failed(self):
+        self.client.conversations_join.side_effect = SlackApiError('channel_not_found', {'ok': False})
+        self.assertFalse(await self.membership.refresh('C1'))
+        self.assertFalse(self.membership.joined('C1'))
+
+    async def test_network_error_is_not_cached(self):
+        self.client.conversations_join.side_effect = ConnectionError()
+        self.assertIsNone(await self.membership.refresh('C1'))
+        self.assertNotIn('C1', self.membership._joined)
+
+    async def test_invalidate(self):
+        await self.membership.refresh('C1')
+        self.membership.invalidate('C1')
+        self.assertIsNone(self.membership._joined.get('C1'))
+        await self.membership._tasks['C1']
+        self.assertEqual(self.client.conversations_join.await_count, 2)
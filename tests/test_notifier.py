@@ -0,0 +1,74 @@
+from http import HTTPStatus
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, patch
+
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.async_slack_response import AsyncSlackResponse
+
+from app.membership import ChannelMembership
+from app.notifier import Notifier
+
+
+def not_in_channel_error() -> SlackApiError:
+    response = AsyncSlackResponse(
+        client=None,
+        http_verb='POST',
+        api_url='',
+        req_args={},
+        data={'ok': False, 'error': 'not_in_channel'},
+        headers={},
+        status_code=HTTPStatus.OK,
+    )
+    return SlackApiError('not_in_channel', response)
+
+
+def rate_limited_error(retry_after: int = 1) -> SlackApiError:
+    response = AsyncSlackResponse(
+        client=None,
+        http_verb='POST',
+        api_url='',
+        req_args={},
+        data={'ok': False, 'error': 'ratelimited'},
+        headers={'Retry-After': str(retry_after)},
+        status_code=HTTPStatus.TOO_MANY_REQUESTS,
+    )
+    return SlackApiError('ratelimited', response)
+
+
+class NotifierTest(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.client = AsyncMock()
+        self.notifier = Notifier(self.client, maxsize=2, batch_size=10)
+
+    async def test_drop_when_queue_is_full(self):
+        self.assertTrue(self.notifier.notify('C1', 'a'))
+        self.assertTrue(self.notifier.notify('C1', 'b'))
+        self.assertFalse(self.notifier.notify('C1', 'c'))
+        self.assertEqual(self.notifier.dropped, 1)
+        self.assertEqual(self.notifier.depth, 2)
+
+    async def test_drain_in_batch(self):
+        self.notifier.maxsize = 10
+        for text in ('a', 'b'):
+            self.notifier.notify('C1', text)
+        self.notifier.notify('C2', 'c')
+        self.notifier.start()
+        await self.notifier.stop()
+        self.assertEqual(self.client.chat_postMessage.await_count, 2)
+        self.client.chat_postMessage.assert_any_await(channel='C1', text='a\nb')
+        self.client.chat_postMessage.assert_any_await(channel='C2', text='c')
+        self.assertEqual(self.notifier.depth, 0)
+
+    @patch('app.notifier.asyncio.sleep', new_callable=AsyncMock)
+    async def test_retry_after_rate_limited(self, sleep: AsyncMock):
+        self.client.chat_postMessage.side_effect = [rate_limited_error(3), None]
+        await self.notifier.send('C1', 'a')
+        sleep.assert_awaited_once_with(3)
+        self.assertEqual(self.client.chat_postMessage.await_count, 2)
+
+    async def test_rejoin_when_not_in_channel(self):
+        self.notifier.membership = ChannelMembership(self.client)
+        self.client.chat_postMessage.side_effect = [not_in_channel_error(), None]
+        await self.notifier.send('C1', 'a')
+        self.client.conversations_join.assert_awaited_once_with(channel='C1')
+        self.assertEqual(self.client.chat_postMessage.await_count, 2)
@@ -0,0 +1,114 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from app.akashi import BREAK, CLOCK_IN, CLOCK_OUT, RESTART, Stamp
+from app.presence import (CLOCKED_OUT, NOT_STARTED, ON_BREAK, UNKNOWN, WORKING, PresenceBoard, Snapshot,
+                          status_of)
+
+
+def test_status_of():
+    assert status_of(None) == NOT_STARTED
+    assert status_of(Stamp(stamped_at='2020/01/01 09:00:00', type=CLOCK_IN)) == WORKING
+    assert status_of(Stamp(stamped_at='2020/01/01 12:00:00', type=BREAK)) == ON_BREAK
+    assert status_of(Stamp(stamped_at='2020/01/01 13:00:00', type=RESTART)) == WORKING
+    assert status_of(Stamp(stamped_at='2020/01/01 18:00:00', type=CLOCK_OUT)) == CLOCKED_OUT
+
+
+class SnapshotTest(IsolatedAsyncioTestCase):
+    # Python 3.9ではasyncio.Eventが作成時にイベントループを取得するので、ループの中で作る
+    async def test_render(self):
+        snapshot = Snapshot(3)
+        snapshot.statuses.update({'U2': WORKING, 'U1': WORKING})
+        assert snapshot.render() == {'text': '集計中…（2/3人）\n*:office: 勤務中*（2人）\n<@U1> <@U2>'}
+        snapshot.statuses['U3'] = UNKNOWN
+        snapshot.done.set()
+        assert snapshot.render() == {
+            'text': '*:office: 勤務中*（2人）\n<@U1> <@U2>\n*:warning: 取得できませんでした*（1人）\n<@U3>'
+        }
+        assert Snapshot(0).render() == {'text': '集計中…（0/0人）\nAPIトークンを登録しているユーザーがいません'}
+
+
+class PresenceBoardTest(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.board = PresenceBoard(concurrency=3, ttl=60, progress_interval=0.01)
+        self.targets = [(f'U{i}', f'token{i}') for i in range(10)]
+
+    async def load_targets(self):
+        return self.targets
+
+    async def test_bounded_concurrency(self):
+        running = 0
+        max_running = 0
+
+        async def fetch(user_id, token):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            if user_id == 'U0':
+                raise Exception('error')
+            return Stamp(stamped_at='2020/01/01 09:00:00', type=CLOCK_IN)
+
+        snapshot = await self.board.collect(self.load_targets, fetch)
+        await snapshot.done.wait()
+        self.assertEqual(max_running, 3)
+        self.assertEqual(snapshot.statuses['U0'], UNKNOWN)
+        self.assertEqual(snapshot.statuses['U1'], WORKING)
+        self.assertIs(self.board.fresh(), snapshot)
+
+    async def test_share_in_flight(self):
+        calls = 0
+
+        async def fetch(user_id, token):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+
+        first = await self.board.collect(self.load_targets, fetch)
+        self.assertIsNone(self.board.fresh())
+        second = await self.board.collect(self.load_targets, fetch)
+        self.assertIs(first, second)
+        await first.done.wait()
+        self.assertEqual(calls, 10)
+
+    async def test_expired(self):
+        async def fetch(user_id, token):
+            return None
+
+        snapshot = await self.board.collect(self.load_targets, fetch)
+        await snapshot.done.wait()
+        with patch('app.presence.time.monotonic', return_value=snapshot.taken_at + 61):
+            self.assertIsNone(self.board.fresh())
+
+    async def test_stream(self):
+        async def fetch(user_id, token):
+            await asyncio.sleep(0.01)
+
+        messages = []
+
+        async def respond(message):
+            messages.append(message['text'])
+
+        snapshot = await self.board.collect(self.load_targets, fetch)
+        await self.board.stream(snapshot, respond)
+        self.assertGreater(len(messages), 1)
+        self.assertTrue(messages[0].startswith('集計中…'))
+        self.assertFalse(messages[-1].startswith('集計中…'))
+
+    async def test_stream_limit(self):
+        # response_urlは5回までしか使えないので、途中経過は4回までにする
+        async def fetch(user_id, token):
+            await asyncio.sleep(0.05)
+
+        messages = []
+
+        async def respond(message):
+            messages.append(message['text'])
+
+        self.board.progress_interval = 0.005
+        snapshot = await self.board.collect(self.load_targets, fetch)
+        await self.board.stream(snapshot, respond)
+        self.assertEqual(len(messages), 5)
+        self.assertFalse(messages[-1].startswith('集計中…'))
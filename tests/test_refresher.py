@@ -0,0 +1,177 @@
+import asyncio
+from contextlib import suppress
+from datetime import datetime
+from http import HTTPStatus
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, patch
+from uuid import uuid4
+
+from httpx import ConnectError, ReadTimeout
+
+from app.akashi import AkashiAPIResponse, APIError, ReissuedTokenResponse, RequestFailedError, UnavailableError
+from app.crud import bulk_upsert_tokens, fetch, fetch_all
+from app.refresher import TokenBucket, TokenRefresher, fetch_targets, is_reissue_retryable, is_retryable
+from tests.factories import UserTokenFactory
+from tests.helpers import AsyncSessionLocal, Base, SessionLocal, engine, session
+
+
+def reissued() -> ReissuedTokenResponse:
+    return ReissuedTokenResponse(token=str(uuid4()), expired_at='2021/02/01 00:00:00')
+
+
+def api_error() -> APIError:
+    return APIError(AkashiAPIResponse(success=False, code='code', message='error'), str(uuid4()))
+
+
+def server_error() -> RequestFailedError:
+    return RequestFailedError(status_code=HTTPStatus.SERVICE_UNAVAILABLE, url='')
+
+
+def test_is_retryable():
+    assert is_retryable(server_error())
+    assert is_retryable(ReadTimeout(''))
+    assert is_retryable(UnavailableError('timed out'))
+    assert not is_retryable(RequestFailedError(status_code=HTTPStatus.NOT_FOUND, url=''))
+    assert not is_retryable(api_error())
+
+
+def test_is_reissue_retryable():
+    assert is_reissue_retryable(server_error())
+    assert is_reissue_retryable(ConnectError(''))
+    # 再発行済みの可能性がある場合はリトライしない
+    assert not is_reissue_retryable(ReadTimeout(''))
+    assert not is_reissue_retryable(UnavailableError('timed out'))
+    assert not is_reissue_retryable(api_error())
+
+
+class TokenBucketTest(IsolatedAsyncioTestCase):
+    async def test_acquire(self):
+        bucket = TokenBucket(rate=100, capacity=1)
+        await bucket.acquire()
+        await bucket.acquire()
+        self.assertLess(bucket.tokens, 1)
+
+
+class TokenRefresherTest(IsolatedAsyncioTestCase):
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        self.refresher = TokenRefresher(SessionLocal, concurrency=2, rate=1000, backoff=0, batch_size=2)
+
+    def tearDown(self):
+        Base.metadata.drop_all(engine)
+
+    async def test_run(self):
+        updated, deleted, failed = UserTokenFactory.create_batch(3)
+        responses = {
+            updated.token: [reissued()],
+            deleted.token: [api_error()],
+            failed.token: [RequestFailedError(status_code=HTTPStatus.BAD_REQUEST, url='')],
+        }
+
+        async def reissue_token(akashi):
+            response = responses[akashi._AkashiRequestClient__token].pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        with patch('app.akashi.AkashiRequestClient.reissue_token', reissue_token):
+            summary = await self.refresher.run(fetch_targets(session, datetime(2021, 1, 1)))
+        session.expire_all()
+        self.assertEqual((summary.total, summary.updated, summary.deleted, summary.errors), (3, 1, 1, 1))
+        self.assertEqual(len(fetch_all(session)), 2)
+        self.assertEqual(fetch(session, updated.user_id).expires_at, datetime(2021, 2, 1))
+        self.assertEqual(len(summary.latencies), 3)
+
+    @patch('app.refresher.bulk_delete_by_user_ids')
+    @patch('app.refresher.bulk_upsert_tokens')
+    @patch('app.akashi.AkashiRequestClient.reissue_token', new_callable=AsyncMock)
+    async def test_run_async_session(self, reissue_token: AsyncMock, bulk_upsert_tokens, bulk_delete_by_user_ids):
+        # アプリの中で実行する場合は同期のセッションでイベントループを止めない
+        updated, deleted = UserTokenFactory.create_batch(2)
+        reissue_token.side_effect = [reissued(), api_error()]
+        refresher = TokenRefresher(AsyncSessionLocal, concurrency=1, rate=1000, backoff=0, batch_size=1)
+        summary = await refresher.run(fetch_targets(session, datetime(2021, 1, 1)))
+        session.expire_all()
+        self.assertEqual((summary.updated, summary.deleted), (1, 1))
+        self.assertEqual([i.user_id for i in fetch_all(session)], [updated.user_id])
+        self.assertEqual(fetch(session, updated.user_id).expires_at, datetime(2021, 2, 1))
+        bulk_upsert_tokens.assert_not_called()
+        bulk_delete_by_user_ids.assert_not_called()
+
+    @patch('app.akashi.AkashiRequestClient.reissue_token', new_callable=AsyncMock)
+    async def test_retry(self, reissue_token: AsyncMock):
+        instance = UserTokenFactory.create()
+        token = instance.token
+        reissue_token.side_effect = [server_error(), ConnectError(''), reissued()]
+        summary = await self.refresher.run(fetch_targets(session, datetime(2021, 1, 1)))
+        session.expire_all()
+        self.assertEqual((summary.updated, summary.retries), (1, 2))
+        self.assertNotEqual(fetch(session, instance.user_id).token, token)
+
+    @patch('app.akashi.AkashiRequestClient.reissue_token', new_callable=AsyncMock)
+    async def test_no_retry_on_timeout(self, reissue_token: AsyncMock):
+        UserTokenFactory.create()
+        reissue_token.side_effect = [ReadTimeout(''), reissued()]
+        summary = await self.refresher.run(fetch_targets(session, datetime(2021, 1, 1)))
+        self.assertEqual((summary.errors, summary.retries), (1, 0))
+        self.assertEqual(reissue_token.await_count, 1)
+
+    @patch('app.akashi.AkashiRequestClient.reissue_token', new_callable=AsyncMock)
+    async def test_keep_token_on_api_error_after_retry(self, reissue_token: AsyncMock):
+        # 前のリクエストで再発行済みの可能性があるので削除しない
+        UserTokenFactory.create()
+        reissue_token.side_effect = [server_error(), api_error()]
+        summary = await self.refresher.run(fetch_targets(session, datetime(2021, 1, 1)))
+        self.assertEqual((summary.errors, summary.deleted), (1, 0))
+        self.assertEqual(len(fetch_all(session)), 1)
+
+    @patch('app.akashi.AkashiRequestClient.reissue_token', new_callable=AsyncMock)
+    async def test_give_up(self, reissue_token: AsyncMock):
+        UserTokenFactory.create()
+        reissue_token.side_effect = server_error()
+        summary = await self.refresher.run(fetch_targets(session, datetime(2021, 1, 1)))
+        self.assertEqual((summary.errors, summary.retries), (1, 3))
+        self.assertEqual(len(fetch_all(session)), 1)
+
+    async def test_cancel(self):
+        # 止められた場合も、再発行済みのトークンは書き込んでから終わる
+        reissued_tokens = UserTokenFactory.create_batch(3)
+        pending = UserTokenFactory.create()
+
+        async def reissue_token(akashi):
+            if akashi._AkashiRequestClient__token == pending.token:
+                await asyncio.Event().wait()
+            return reissued()
+
+        refresher = TokenRefresher(SessionLocal, concurrency=4, rate=1000, batch_size=100)
+        with patch('app.akashi.AkashiRequestClient.reissue_token', reissue_token):
+            task = asyncio.create_task(refresher.run(fetch_targets(session, datetime(2021, 1, 1))))
+            while refresher.summary.updated < 3:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        session.expire_all()
+        for instance in reissued_tokens:
+            self.assertEqual(fetch(session, instance.user_id).expires_at, datetime(2021, 2, 1))
+        self.assertIsNone(fetch(session, pending.user_id).expires_at)
+
+    @patch('app.akashi.AkashiRequestClient.reissue_token', new_callable=AsyncMock)
+    async def test_flush_failure(self, reissue_token: AsyncMock):
+        # 書き込みに失敗したトークンは捨てずに次のflushで書き込む
+        UserTokenFactory.create_batch(2)
+        reissue_token.side_effect = [reissued(), reissued()]
+        calls = []
+
+        def upsert(db, rows):
+            calls.append(len(rows))
+            if len(calls) == 1:
+                raise RuntimeError('db')
+            return bulk_upsert_tokens(db, rows)
+
+        refresher = TokenRefresher(SessionLocal, concurrency=1, rate=1000, batch_size=2)
+        with patch('app.refresher.bulk_upsert_tokens', upsert):
+            await refresher.run(fetch_targets(session, datetime(2021, 1, 1)))
+        session.expire_all()
+        self.assertEqual(calls, [2, 2])
+        self.assertEqual({i.expires_at for i in fetch_all(session)}, {datetime(2021, 2, 1)})
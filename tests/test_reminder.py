@@ -0,0 +1,88 @@
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, patch
+
+from slack_sdk.errors import SlackApiError
+
+from app.akashi import BREAK, CLOCK_IN, CLOCK_OUT, Stamp
+from app.reminder import CLOCK_IN as CLOCK_IN_REMINDER
+from app.reminder import CLOCK_OUT as CLOCK_OUT_REMINDER
+from app.reminder import DirectMessageSender, ReminderDispatcher, build_message
+from app.tenant import Tenant, TenantRegistry
+from tests.factories import UserTokenFactory
+from tests.helpers import AsyncSessionLocal, Base, engine
+from tests.test_notifier import not_in_channel_error, rate_limited_error
+
+
+def stamp(type_: int) -> Stamp:
+    return Stamp(datetime(2021, 1, 4, 9).strftime('%Y/%m/%d %H:%M:%S'), type_)
+
+
+def test_build_message():
+    assert build_message(CLOCK_IN_REMINDER, None)
+    assert build_message(CLOCK_IN_REMINDER, stamp(CLOCK_IN)) is None
+    assert build_message(CLOCK_OUT_REMINDER, None) is None
+    assert build_message(CLOCK_OUT_REMINDER, stamp(CLOCK_OUT)) is None
+    assert build_message(CLOCK_OUT_REMINDER, stamp(CLOCK_IN)).startswith('09:00の「勤務を開始')
+    assert build_message(CLOCK_OUT_REMINDER, stamp(BREAK))
+
+
+class DirectMessageSenderTest(IsolatedAsyncioTestCase):
+    async def test_retry_after(self):
+        client = AsyncMock()
+        client.chat_postMessage.side_effect = [rate_limited_error(3), None]
+        sender = DirectMessageSender(rate=1000)
+        with patch('app.reminder.asyncio.sleep') as sleep:
+            await sender.send(client, 'U0', 'text')
+        self.assertEqual(client.chat_postMessage.call_count, 2)
+        self.assertAlmostEqual(sleep.call_args.args[0], 3, places=1)
+        self.assertEqual(sender.rate_limited, 1)
+
+    async def test_give_up(self):
+        client = AsyncMock()
+        client.chat_postMessage.side_effect = not_in_channel_error()
+        with self.assertRaises(SlackApiError):
+            await DirectMessageSender(rate=1000).send(client, 'U0', 'text')
+        self.assertEqual(client.chat_postMessage.call_count, 1)
+
+
+class ReminderDispatcherTest(IsolatedAsyncioTestCase):
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        self.slack = AsyncMock()
+        self.tenant = Tenant.from_settings(slack=self.slack)
+
+        async def loader(team_id):
+            return None
+
+        self.tenants = TenantRegistry(loader, self.tenant, team_id='T0')
+
+    def tearDown(self):
+        Base.metadata.drop_all(engine)
+
+    def dispatcher(self, kind: str) -> ReminderDispatcher:
+        return ReminderDispatcher(AsyncSessionLocal,
+                                  self.tenants,
+                                  DirectMessageSender(rate=1000),
+                                  kind,
+                                  concurrency=2,
+                                  rate=1000,
+                                  page_size=2)
+
+    async def test_clock_in(self):
+        instances = UserTokenFactory.create_batch(5)
+        UserTokenFactory.create(team_id='T1')
+        stamps = {i.token: stamp(CLOCK_IN) for i in instances[:2]}
+        self.tenant.akashi = lambda token: SimpleNamespace(fetch_last_stamp=AsyncMock(return_value=stamps.get(token)))
+        summary = await self.dispatcher(CLOCK_IN_REMINDER).run()
+        self.assertEqual((summary.users, summary.checked, summary.reminded, summary.skipped), (6, 5, 3, 1))
+        channels = sorted(i.kwargs['channel'] for i in self.slack.chat_postMessage.call_args_list)
+        self.assertEqual(channels, sorted(i.user_id for i in instances[2:]))
+
+    async def test_error(self):
+        UserTokenFactory.create_batch(3)
+        self.tenant.akashi = lambda token: SimpleNamespace(fetch_last_stamp=AsyncMock(side_effect=RuntimeError))
+        summary = await self.dispatcher(CLOCK_OUT_REMINDER).run()
+        self.assertEqual((summary.checked, summary.errors), (0, 3))
+        self.slack.chat_postMessage.assert_not_called()
@@ -0,0 +1,86 @@
+from datetime import date, datetime, timedelta
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import AsyncMock
+
+from app.akashi import BREAK, CLOCK_IN, CLOCK_OUT, RESTART, FetchedStampResponse, Stamp
+from app.cache import MemoryBackend
+from app.report import USAGE, DayCache, DaySummary, InvalidPeriodError, build_report, parse_period
+
+
+class ParsePeriodTest(TestCase):
+    today = date(2021, 2, 17)  # 水曜日
+
+    def test_week(self):
+        self.assertEqual(parse_period('', self.today), (date(2021, 2, 15), date(2021, 2, 21)))
+        self.assertEqual(parse_period('week', self.today), (date(2021, 2, 15), date(2021, 2, 21)))
+
+    def test_month(self):
+        self.assertEqual(parse_period('month', self.today), (date(2021, 2, 1), date(2021, 2, 28)))
+
+    def test_year_month(self):
+        self.assertEqual(parse_period('2020-12', self.today), (date(2020, 12, 1), date(2020, 12, 31)))
+
+    def test_invalid(self):
+        for text in ('year', '2021-13', '2021/01'):
+            with self.assertRaises(InvalidPeriodError):
+                parse_period(text, self.today)
+
+
+class DaySummaryTest(TestCase):
+    def test_worked_time(self):
+        summary = DaySummary(date(2021, 1, 4), [
+            Stamp('2021/01/04 09:00:00', CLOCK_IN),
+            Stamp('2021/01/04 12:00:00', BREAK),
+            Stamp('2021/01/04 13:00:00', RESTART),
+            Stamp('2021/01/04 18:30:00', CLOCK_OUT),
+        ])
+        self.assertEqual(summary.break_time, timedelta(hours=1))
+        self.assertEqual(summary.worked_time, timedelta(hours=8, minutes=30))
+        self.assertEqual(str(summary), '01/04 月  09:00 - 18:30  休憩 1:00  労働 8:30')
+
+    def test_not_clocked_out(self):
+        summary = DaySummary(date(2021, 1, 4), [Stamp('2021/01/04 09:00:00', CLOCK_IN)])
+        self.assertIsNone(summary.worked_time)
+        self.assertEqual(str(summary), '01/04 月  09:00 - --:--  休憩 0:00  労働 -:--')
+
+
+def stamps_between(date_from: date, date_to: date) -> FetchedStampResponse:
+    stamps = []
+    day = date_from
+    while day <= date_to:
+        stamps.append(Stamp(datetime.combine(day, datetime.min.time()) + timedelta(hours=9), CLOCK_IN))
+        stamps.append(Stamp(datetime.combine(day, datetime.min.time()) + timedelta(hours=18), CLOCK_OUT))
+        day += timedelta(days=1)
+    return FetchedStampResponse(len(stamps), stamps)
+
+
+class DayCacheTest(IsolatedAsyncioTestCase):
+    today = date(2021, 2, 17)
+
+    def setUp(self):
+        self.cache = DayCache(MemoryBackend())
+        self.akashi = AsyncMock()
+        self.akashi.fetch_stamps.side_effect = stamps_between
+
+    async def test_past_days_are_cached(self):
+        await self.cache.fetch('U1', self.akashi, date(2021, 2, 1), date(2021, 2, 28), self.today)
+        self.akashi.fetch_stamps.assert_awaited_once_with(date(2021, 2, 1), self.today)
+        result = await self.cache.fetch('U1', self.akashi, date(2021, 2, 1), date(2021, 2, 28), self.today)
+        # 2回目は当日だけ取得する
+        self.akashi.fetch_stamps.assert_awaited_with(self.today, self.today)
+        self.assertEqual(len(result), 17)
+        self.assertEqual(len(result[date(2021, 2, 1)]), 2)
+
+    async def test_past_range(self):
+        await self.cache.fetch('U1', self.akashi, date(2021, 1, 1), date(2021, 1, 31), self.today)
+        await self.cache.fetch('U1', self.akashi, date(2021, 1, 1), date(2021, 1, 31), self.today)
+        self.akashi.fetch_stamps.assert_awaited_once_with(date(2021, 1, 1), date(2021, 1, 31))
+
+    async def test_build_report(self):
+        report = await build_report(self.cache, 'U1', self.akashi, 'week', self.today)
+        self.assertIn('2021/02/15 - 2021/02/21 の勤務実績', report)
+        self.assertIn('合計 27:00（3日）', report)
+
+    async def test_build_report_usage(self):
+        self.assertEqual(await build_report(self.cache, 'U1', self.akashi, 'year', self.today), USAGE)
+        self.akashi.fetch_stamps.assert_not_awaited()
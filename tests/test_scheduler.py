@@ -0,0 +1,133 @@
+import asyncio
+from datetime import datetime, timedelta
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, MagicMock, patch
+from uuid import uuid4
+
+from app.akashi import ReissuedTokenResponse, UnavailableError
+from app.crud import fetch
+from app.scheduler import JustInTimeReissuer, ReissueScheduler, is_due, offset_of
+from app.token_cache import token_cache
+from tests.factories import UserTokenFactory
+from tests.helpers import AsyncSessionLocal, Base, engine, session
+from tests.test_refresher import api_error, server_error
+
+NOW = datetime(2021, 1, 1, 12)
+LEAD_TIME = timedelta(days=2)
+WINDOW = timedelta(days=1)
+
+
+def test_offset_of():
+    offset = offset_of('U0000000001', WINDOW)
+    assert timedelta(0) <= offset < WINDOW
+    assert offset_of('U0000000001', WINDOW) == offset
+    assert offset_of('U0000000002', WINDOW) != offset
+
+
+def test_is_due():
+    assert is_due('U1', None, NOW, LEAD_TIME, WINDOW)
+    assert is_due('U1', NOW + LEAD_TIME, NOW, LEAD_TIME, WINDOW)
+    assert not is_due('U1', NOW + LEAD_TIME + WINDOW, NOW, LEAD_TIME, WINDOW)
+    # 再発行する時刻はユーザーごとに異なる
+    expires_at = NOW + timedelta(days=10)
+    due_at = expires_at - LEAD_TIME - WINDOW + offset_of('U1', WINDOW)
+    assert is_due('U1', expires_at, due_at, LEAD_TIME, WINDOW)
+    assert not is_due('U1', expires_at, due_at - timedelta(seconds=1), LEAD_TIME, WINDOW)
+
+
+class ReissueSchedulerTest(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        Base.metadata.create_all(engine)
+        self.refresher = MagicMock()
+        self.refresher.run = AsyncMock()
+        self.scheduler = ReissueScheduler(AsyncSessionLocal, lambda: self.refresher, interval=0.01, lead_time=LEAD_TIME,
+                                          window=WINDOW)
+
+    async def asyncTearDown(self):
+        await self.scheduler.stop()
+        Base.metadata.drop_all(engine)
+
+    async def test_tick(self):
+        unknown = UserTokenFactory.create()
+        expiring = UserTokenFactory.create(expires_at=NOW + timedelta(days=1))
+        UserTokenFactory.create(expires_at=NOW + timedelta(days=10))
+        await self.scheduler.tick(NOW)
+        targets = self.refresher.run.await_args.args[0]
+        self.assertEqual({i.user_id for i in targets}, {unknown.user_id, expiring.user_id})
+
+    async def test_nothing_due(self):
+        UserTokenFactory.create(expires_at=NOW + timedelta(days=10))
+        self.assertIsNone(await self.scheduler.tick(NOW))
+        self.refresher.run.assert_not_awaited()
+
+    async def test_follower(self):
+        UserTokenFactory.create()
+        self.scheduler.leader = MagicMock(acquire=AsyncMock(return_value=False), release=AsyncMock())
+        self.scheduler.start()
+        await asyncio.sleep(0.05)
+        self.assertGreater(self.scheduler.leader.acquire.await_count, 1)
+        self.refresher.run.assert_not_awaited()
+
+    async def test_stop(self):
+        # 実行中の再発行が書き込みを終えるまで待ってから止める
+        UserTokenFactory.create()
+        finished = []
+
+        async def run(targets):
+            try:
+                await asyncio.Event().wait()
+            finally:
+                await asyncio.sleep(0)
+                finished.append(len(targets))
+
+        self.refresher.run.side_effect = run
+        self.scheduler.start()
+        while not self.refresher.run.await_count:
+            await asyncio.sleep(0.01)
+        await self.scheduler.stop()
+        self.assertEqual(finished, [1])
+
+
+class JustInTimeReissuerTest(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        Base.metadata.create_all(engine)
+        self.db = AsyncSessionLocal()
+        self.reissuer = JustInTimeReissuer(threshold=timedelta(hours=1))
+        token_cache.clear()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        Base.metadata.drop_all(engine)
+
+    def test_needs_reissue(self):
+        self.assertFalse(self.reissuer.needs_reissue(None, NOW))
+        self.assertFalse(self.reissuer.needs_reissue(NOW + timedelta(hours=2), NOW))
+        self.assertTrue(self.reissuer.needs_reissue(NOW + timedelta(minutes=30), NOW))
+        self.assertTrue(self.reissuer.needs_reissue(NOW - timedelta(minutes=30), NOW))
+
+    @patch('app.akashi.AkashiRequestClient.reissue_token', new_callable=AsyncMock)
+    async def test_reissue_with_retry(self, reissue_token):
+        token = str(uuid4())
+        reissued = ReissuedTokenResponse(token=token, expired_at='2021/02/01 00:00:00')
+        reissue_token.side_effect = [server_error(), reissued]
+        instance = UserTokenFactory.create(expires_at=datetime.now())
+        results = await asyncio.gather(*(self.reissuer.reissue(self.db, instance.user_id, instance.token)
+                                         for _ in range(3)))
+        self.assertEqual(results, [token] * 3)
+        self.assertEqual(reissue_token.await_count, 2)
+        session.expire_all()
+        self.assertEqual(fetch(session, instance.user_id).expires_at, datetime(2021, 2, 1))
+
+    @patch('app.akashi.AkashiRequestClient.reissue_token', new_callable=AsyncMock)
+    async def test_keep_token_on_failure(self, reissue_token):
+        reissue_token.side_effect = [server_error(), server_error(), api_error()]
+        instance = UserTokenFactory.create(expires_at=datetime.now())
+        self.assertEqual(await self.reissuer.reissue(self.db, instance.user_id, instance.token), instance.token)
+        self.assertEqual(reissue_token.await_count, 2)
+
+    @patch('app.akashi.AkashiRequestClient.reissue_token', new_callable=AsyncMock)
+    async def test_no_retry_when_unavailable(self, reissue_token):
+        reissue_token.side_effect = [UnavailableError('circuit open'), server_error()]
+        instance = UserTokenFactory.create(expires_at=datetime.now())
+        self.assertEqual(await self.reissuer.reissue(self.db, instance.user_id, instance.token), instance.token)
+        self.assertEqual(reissue_token.await_count, 1)
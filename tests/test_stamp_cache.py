@@ -0,0 +1,58 @@
+from datetime import datetime
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock
+
+from fakeredis import FakeAsyncRedis
+
+from app.akashi import BREAK, CLOCK_IN, Stamp
+from app.cache import MemoryBackend, RedisBackend
+from app.stamp_cache import StampCache, seconds_until_tomorrow
+
+
+def test_seconds_until_tomorrow():
+    assert seconds_until_tomorrow(datetime(2021, 1, 1, 23, 59, 0)) == 60
+
+
+class StampCacheTest(IsolatedAsyncioTestCase):
+    backend = MemoryBackend
+
+    def setUp(self):
+        self.cache = StampCache(self.backend())
+        self.akashi = AsyncMock()
+
+    async def test_miss_then_hit(self):
+        stamp = Stamp(stamped_at=datetime.now().replace(microsecond=0), type=CLOCK_IN)
+        self.akashi.fetch_last_stamp.return_value = stamp
+        self.assertEqual(await self.cache.fetch_last_stamp('U1', self.akashi), stamp)
+        self.assertEqual(await self.cache.fetch_last_stamp('U1', self.akashi), stamp)
+        self.akashi.fetch_last_stamp.assert_awaited_once()
+        self.assertEqual(self.cache.hit_ratio, 0.5)
+
+    async def test_no_stamp_today_is_cached(self):
+        self.akashi.fetch_last_stamp.return_value = None
+        self.assertIsNone(await self.cache.fetch_last_stamp('U1', self.akashi))
+        self.assertIsNone(await self.cache.fetch_last_stamp('U1', self.akashi))
+        self.akashi.fetch_last_stamp.assert_awaited_once()
+
+    async def test_update_on_write(self):
+        stamp = Stamp(stamped_at=datetime.now().replace(microsecond=0), type=BREAK)
+        await self.cache.set('U1', stamp)
+        self.assertEqual(await self.cache.fetch_last_stamp('U1', self.akashi), stamp)
+        self.akashi.fetch_last_stamp.assert_not_awaited()
+
+    async def test_reconcile(self):
+        self.cache.reconcile_ttl = -1
+        self.akashi.fetch_last_stamp.return_value = None
+        await self.cache.fetch_last_stamp('U1', self.akashi)
+        await self.cache.fetch_last_stamp('U1', self.akashi)
+        self.assertEqual(self.akashi.fetch_last_stamp.await_count, 2)
+
+    async def test_ignore_stamp_of_another_day(self):
+        await self.cache.set('U1', Stamp(stamped_at=datetime(2021, 1, 1), type=CLOCK_IN))
+        hit, _ = await self.cache.get('U1')
+        self.assertFalse(hit)
+
+
+class RedisStampCacheTest(StampCacheTest):
+    def backend(self):
+        return RedisBackend(client=FakeAsyncRedis(decode_responses=True))
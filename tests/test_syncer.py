@@ -0,0 +1,109 @@
+from datetime import date, datetime
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from app.akashi import CLOCK_IN, CLOCK_OUT, FetchedStampResponse, Stamp
+from app.crud import fetch_high_water_marks, fetch_stamp_history, insert_stamps
+from app.models import SOURCE_AKASHI, SOURCE_SLACK
+from app.syncer import StampSyncer, fetch_sync_targets
+from tests.factories import UserTokenFactory
+from tests.helpers import Base, SessionLocal, engine, session
+from tests.test_refresher import api_error, server_error
+
+STAMPS = [
+    Stamp('2021/01/04 09:00:00', CLOCK_IN),
+    Stamp('2021/01/04 18:00:00', CLOCK_OUT),
+    Stamp('2021/01/05 09:00:00', CLOCK_IN),
+]
+
+
+class StampSyncerTest(IsolatedAsyncioTestCase):
+    today = date(2021, 1, 5)
+
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        self.syncer = StampSyncer(SessionLocal,
+                                  concurrency=2,
+                                  rate=1000,
+                                  lookback_days=30,
+                                  backoff=0,
+                                  batch_size=2,
+                                  page_size=1)
+        self.calls = []
+
+        async def fetch_stamps(akashi, date_from, date_to):
+            self.calls.append((date_from, date_to))
+            stamps = [i for i in STAMPS if date_from <= i.stamped_at.date() <= date_to]
+            return FetchedStampResponse(len(stamps), stamps)
+
+        self.fetch_stamps = fetch_stamps
+
+    def tearDown(self):
+        Base.metadata.drop_all(engine)
+
+    async def test_initial_sync(self):
+        instance = UserTokenFactory.create()
+        with patch('app.akashi.AkashiRequestClient.fetch_stamps', self.fetch_stamps):
+            summary = await self.syncer.run(fetch_sync_targets(session), self.today)
+        self.assertEqual(self.calls, [(date(2020, 12, 6), self.today)])
+        self.assertEqual((summary.users, summary.fetched, summary.inserted), (1, 3, 3))
+        self.assertEqual(len(fetch_stamp_history(session, instance.user_id, datetime(2021, 1, 1))), 3)
+
+    async def test_incremental_sync(self):
+        instance = UserTokenFactory.create()
+        today = date(2021, 1, 6)
+        insert_stamps(session, [{
+            'user_id': instance.user_id,
+            'stamped_at': datetime(2021, 1, 4, 9),
+            'type': CLOCK_IN,
+            'source': SOURCE_AKASHI,
+        }, {
+            'user_id': instance.user_id,
+            'stamped_at': datetime(2021, 1, 6, 9),
+            'type': CLOCK_IN,
+            'source': SOURCE_SLACK,
+        }])
+        with patch('app.akashi.AkashiRequestClient.fetch_stamps', self.fetch_stamps):
+            summary = await self.syncer.run(fetch_sync_targets(session), today)
+        # AKASHIから同期した最後の打刻の日から取得し、保存済みの打刻は無視する
+        # Slackから記録した打刻の日から取得すると、AKASHIだけにある1/5の打刻が抜ける
+        self.assertEqual(self.calls, [(date(2021, 1, 4), today)])
+        self.assertEqual((summary.fetched, summary.inserted), (3, 2))
+        history = fetch_stamp_history(session, instance.user_id, datetime(2021, 1, 1))
+        self.assertEqual([(i.stamped_at, i.source) for i in history], [
+            (datetime(2021, 1, 4, 9), SOURCE_AKASHI),
+            (datetime(2021, 1, 4, 18), SOURCE_AKASHI),
+            (datetime(2021, 1, 5, 9), SOURCE_AKASHI),
+            (datetime(2021, 1, 6, 9), SOURCE_SLACK),
+        ])
+        marks = fetch_high_water_marks(session, [instance.user_id])
+        self.assertEqual(marks, {instance.user_id: datetime(2021, 1, 5, 9)})
+
+    async def test_same_user_in_other_team(self):
+        instance = UserTokenFactory.create()
+        UserTokenFactory.create(user_id=instance.user_id, team_id='T1')
+        insert_stamps(session, [{
+            'team_id': 'T1',
+            'user_id': instance.user_id,
+            'stamped_at': datetime(2021, 1, 5, 9),
+            'type': CLOCK_IN,
+            'source': SOURCE_AKASHI,
+        }])
+        with patch('app.akashi.AkashiRequestClient.fetch_stamps', self.fetch_stamps):
+            summary = await self.syncer.run(fetch_sync_targets(session), self.today)
+        # 他のワークスペースの最後の打刻で、取得する期間を短くしない
+        self.assertEqual(sorted(self.calls), [(date(2020, 12, 6), self.today), (date(2021, 1, 5), self.today)])
+        self.assertEqual(summary.inserted, 3)
+        self.assertEqual(len(fetch_stamp_history(session, instance.user_id, datetime(2021, 1, 1))), 3)
+        self.assertEqual(len(fetch_stamp_history(session, instance.user_id, datetime(2021, 1, 1), team_id='T1')), 1)
+
+    async def test_errors(self):
+        UserTokenFactory.create_batch(2)
+        responses = [api_error(), server_error(), server_error(), server_error(), server_error()]
+
+        async def fetch_stamps(akashi, date_from, date_to):
+            raise responses.pop(0)
+
+        with patch('app.akashi.AkashiRequestClient.fetch_stamps', fetch_stamps):
+            summary = await self.syncer.run(fetch_sync_targets(session), self.today)
+        self.assertEqual((summary.errors, summary.retries, summary.inserted), (2, 3, 0))
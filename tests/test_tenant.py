@@ -0,0 +1,61 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock
+
+from app.models import TenantConfig
+from app.refresher import TokenBucket
+from app.tenant import Tenant, TenantRegistry, UnknownTenantError
+
+
+def config(team_id: str) -> TenantConfig:
+    return TenantConfig(team_id=team_id, akashi_company_id=f'company-{team_id}', slack_bot_token='xoxb-tenant')
+
+
+def test_tenant():
+    tenant = Tenant.from_config(config('T1'))
+    assert tenant.scope('U1') == 'T1:U1'
+    akashi = tenant.akashi('token')
+    assert akashi.company_id == 'company-T1'
+    assert akashi.client is tenant.client
+    assert isinstance(akashi.bucket, TokenBucket)
+    assert Tenant.from_settings().scope('U1') == 'U1'
+
+
+class TenantRegistryTest(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.default = Tenant.from_settings()
+        self.loader = AsyncMock(side_effect=lambda team_id: config(team_id) if team_id.startswith('T') else None)
+        self.registry = TenantRegistry(self.loader, self.default, maxsize=2, idle_ttl=60)
+
+    async def asyncTearDown(self):
+        await self.registry.close()
+
+    async def test_get(self):
+        self.assertIs(await self.registry.get(None), self.default)
+        tenants = await asyncio.gather(*(self.registry.get('T1') for _ in range(3)))
+        self.assertEqual(tenants[0].company_id, 'company-T1')
+        self.assertTrue(all(i is tenants[0] for i in tenants))
+        self.loader.assert_awaited_once_with('T1')
+        # 登録されていないワークスペースは環境変数の設定で処理する
+        self.assertIs(await self.registry.get('E1'), self.default)
+
+    async def test_get_unknown(self):
+        self.registry.team_id = 'E1'
+        self.assertIs(await self.registry.get('E1'), self.default)
+        self.assertIsNone(await self.registry.get('E2'))
+        with self.assertRaises(UnknownTenantError):
+            await self.registry.akashi('E2', 'token')
+
+    async def test_evict(self):
+        first = await self.registry.get('T1')
+        await self.registry.get('T2')
+        await self.registry.get('T1')
+        await self.registry.get('T3')
+        # 最も長く使われていないT2を破棄する
+        self.assertEqual(list(self.registry._entries), ['T1', 'T3'])
+        first.last_used -= 61
+        self.registry.evict(first.last_used + 61)
+        self.assertEqual(list(self.registry._entries), ['T3'])
+        await asyncio.gather(*self.registry._closing)
+        self.assertTrue(first.client.is_closed)
+        self.assertIsNot(await self.registry.get('T1'), first)
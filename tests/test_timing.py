@@ -0,0 +1,86 @@
+import sys
+import time
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.profiler import SamplingProfiler, collapse
+from app.timing import ServerTimingMiddleware, Timings, budget, measure, record, remaining
+
+
+async def busy(request):
+    with measure('akashi'):
+        started = time.perf_counter()
+        while time.perf_counter() - started < 0.05:
+            pass
+    record('db', 0.002)
+    return Response('ok')
+
+
+class TimingsTest(TestCase):
+    def test_header(self):
+        timings = Timings()
+        timings.add('db', 0.001)
+        timings.add('db', 0.002)
+        header = timings.header()
+        self.assertTrue(header.startswith('db;dur=3.0, total;dur='))
+
+    def test_record_outside_request(self):
+        record('db', 0.001)
+
+
+def test_budget():
+    assert remaining() is None
+    with budget(2.5):
+        assert 2.4 < remaining() <= 2.5
+        # 内側の期限は外側より遅くならない
+        with budget(10):
+            assert remaining() <= 2.5
+        with budget(1, started=time.perf_counter() - 2):
+            assert remaining() < 0
+    assert remaining() is None
+
+
+class ServerTimingMiddlewareTest(TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.profiler = SamplingProfiler(self.directory.name, interval=0.001)
+        app = Starlette(routes=[Route('/slash', busy), Route('/other', busy)])
+        app.add_middleware(ServerTimingMiddleware, profiler=self.profiler)
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_server_timing(self):
+        res = self.client.get('/slash')
+        phases = [i.split(';')[0] for i in res.headers['server-timing'].split(', ')]
+        self.assertEqual(phases, ['akashi', 'db', 'total'])
+
+    def test_other_path(self):
+        res = self.client.get('/other')
+        self.assertNotIn('server-timing', res.headers)
+
+    def test_profiler(self):
+        self.profiler.arm(2)
+        self.client.get('/slash')
+        self.assertTrue(self.profiler.running)
+        self.client.get('/other')
+        self.client.get('/slash')
+        self.assertFalse(self.profiler.running)
+        with open(self.profiler.last_path) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(any('busy (test_timing.py' in i for i in lines))
+        self.assertTrue(all(i.rsplit(' ', 1)[1].isdigit() for i in lines))
+        # 指定した件数を処理したら止まる
+        self.client.get('/slash')
+        self.assertFalse(self.profiler.running)
+
+
+def test_collapse():
+    stack = collapse(sys._getframe())
+    assert stack.endswith('test_collapse (test_timing.py:{})'.format(test_collapse.__code__.co_firstlineno))
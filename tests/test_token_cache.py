@@ -0,0 +1,85 @@
+from unittest import IsolatedAsyncioTestCase, TestCase
+from uuid import uuid4
+
+from prometheus_client import REGISTRY
+
+from app.async_crud import delete, fetch, fetch_credential, update_or_create
+from app.token_cache import (MAX_PAYLOAD_BYTES, TokenCache, TokenCacheListener, notify_statement, split_payloads,
+                             token_cache)
+from tests.factories import UserTokenFactory
+from tests.helpers import AsyncSessionLocal, Base, engine
+
+
+def query_count(function: str):
+    return REGISTRY.get_sample_value('db_query_duration_seconds_count', {'function': function})
+
+
+class TokenCacheTest(TestCase):
+    def test_invalidate(self):
+        cache = TokenCache(maxsize=10, ttl=60)
+        cache.set('U1', 'token1')
+        cache.set('U2', 'token2')
+        cache.invalidate(['U1'])
+        self.assertIsNone(cache.get('U1'))
+        self.assertEqual(cache.get('U2'), 'token2')
+
+    def test_on_notify(self):
+        cache = TokenCache(maxsize=10, ttl=60)
+        cache.set('U1', 'token1')
+        cache.set('U2', 'token2')
+        TokenCacheListener('postgresql://localhost/test', cache).on_notify(None, 0, 'user_tokens', 'U1,U2')
+        self.assertEqual(len(cache.cache), 0)
+
+    def test_notify_statement(self):
+        self.assertIn('pg_notify', str(notify_statement(['U1', 'U2'])))
+
+    def test_split_payloads(self):
+        self.assertEqual(list(split_payloads(['U1', 'U2', 'U3'], limit=5)), [['U1', 'U2'], ['U3']])
+        # ワークスペースごとのキーは500件で8000バイトを超える
+        keys = [f'T0123456789:U{i:010d}' for i in range(500)]
+        chunks = list(split_payloads(keys))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(sum(chunks, []), keys)
+        self.assertTrue(all(len(','.join(i).encode()) <= MAX_PAYLOAD_BYTES for i in chunks))
+
+
+class FetchCredentialTest(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        Base.metadata.create_all(engine)
+        self.db = AsyncSessionLocal()
+        token_cache.clear()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        Base.metadata.drop_all(engine)
+
+    async def test_read_through(self):
+        instance = UserTokenFactory.create()
+        self.assertEqual((await fetch_credential(self.db, instance.user_id)).token, instance.token)
+        self.assertEqual(token_cache.get(instance.user_id), instance.token)
+
+    async def test_cache_hit_is_not_timed(self):
+        instance = UserTokenFactory.create()
+        await fetch_credential(self.db, instance.user_id)
+        count = query_count('select_credential')
+        # キャッシュから返した場合はDBの実行時間に記録しない
+        await fetch_credential(self.db, instance.user_id)
+        self.assertEqual(query_count('select_credential'), count)
+        self.assertIsNone(query_count('fetch_credential'))
+
+    async def test_not_found_is_not_cached(self):
+        self.assertIsNone(await fetch_credential(self.db, 'U1'))
+        self.assertIsNone(token_cache.get('U1'))
+
+    async def test_invalidate_on_update(self):
+        instance = UserTokenFactory.create()
+        await fetch_credential(self.db, instance.user_id)
+        token = str(uuid4())
+        await update_or_create(self.db, instance.user_id, token=token)
+        self.assertEqual((await fetch_credential(self.db, instance.user_id)).token, token)
+
+    async def test_invalidate_on_delete(self):
+        instance = UserTokenFactory.create()
+        await fetch_credential(self.db, instance.user_id)
+        await delete(self.db, await fetch(self.db, instance.user_id))
+        self.assertIsNone(await fetch_credential(self.db, instance.user_id))
@@ -0,0 +1,55 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from app.slack_client import InstrumentedWebClient
+from app.transport import LazyWebClient, create_client, create_transport
+
+RESPONSE = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\nContent-Type: application/json\r\n\r\n{}'
+
+
+class PooledTransportTest(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            self.connections += 1
+            while await reader.readuntil(b'\r\n\r\n'):
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+                await asyncio.sleep(0.01)
+                self.active -= 1
+                writer.write(RESPONSE)
+                await writer.drain()
+
+        self.server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.sockets[0].getsockname()[1])
+
+    async def asyncTearDown(self):
+        self.server.close()
+
+    async def test_reuse_connection(self):
+        transport = create_transport()
+        async with create_client(transport) as client:
+            for _ in range(3):
+                await client.get(self.url)
+        self.assertEqual(self.connections, 1)
+        self.assertEqual(transport.stats.misses, 1)
+        self.assertEqual(transport.stats.hits, 2)
+
+    async def test_max_connections_per_host(self):
+        transport = create_transport(max_connections_per_host=2)
+        async with create_client(transport) as client:
+            await asyncio.gather(*(client.get(self.url) for _ in range(10)))
+        self.assertLessEqual(self.max_active, 2)
+        self.assertEqual(transport.stats.hits + transport.stats.misses, 10)
+
+
+def test_lazy_web_client():
+    client = LazyWebClient('xoxb-test')
+    assert client._client is None
+    client.base_url = 'http://127.0.0.1/api/'
+    assert isinstance(client.client, InstrumentedWebClient)
+    assert client.client.token == 'xoxb-test'
+    assert client.client.base_url == 'http://127.0.0.1/api/'